@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+#
+# Cost of the k-mer prefilter against plain alignment, on seeded synthetic
+# data: random reads against references drawn afresh for every pair (the
+# prefilter's worst case, nothing to reuse) or shared by every read, plus
+# reads sampled from their reference so that some pairs pass.  Every case
+# times Aligner.align with and without a KmerPrefilter and reports both, the
+# pairs pruned and the speedup, as JSON.
+#
+#   python benchmarks/bench_prefilter.py
+#   python benchmarks/bench_prefilter.py --min-scores 150,190 -o prefilter.json
+
+from __future__ import print_function
+import sys
+import json
+import time
+import random
+import platform
+import argparse
+import itertools
+from collections import OrderedDict
+
+import ssw
+from ssw import libssw
+from ssw.prefilter import KmerPrefilter
+
+clock = getattr(time, "perf_counter", time.time)
+
+BASES = "ACGT"
+
+def random_sequence(rnd, length):
+    return str.join("", map(rnd.choice, [BASES] * length))
+
+def make_case(seed, query_length, reference_length, distinct, related, pairs):
+    # pairs (query, reference) tuples; a related fraction of the queries
+    # are exact windows of their reference, the rest are random
+    rnd = random.Random("%s:%d:%d:%s:%s" % (seed, query_length, reference_length, distinct, related))
+    shared = random_sequence(rnd, reference_length)
+    cases = []
+    for idx in range(pairs):
+        reference = random_sequence(rnd, reference_length) if distinct else shared
+        if rnd.random() < related:
+            start = rnd.randint(0, reference_length - query_length)
+            query = reference[start:start + query_length]
+        else:
+            query = random_sequence(rnd, query_length)
+        cases.append((query, reference))
+    return cases
+
+def time_pairs(aligner, cases, repeat):
+    # the fastest of repeat runs, and the scores of the last
+    best = None
+    for run in range(repeat):
+        if aligner.prefilter is not None:
+            # a fresh prefilter every run, so distinct references stay unseen
+            aligner.prefilter = KmerPrefilter(aligner.prefilter.min_score, k=aligner.prefilter.k)
+        start = clock()
+        scores = [aligner.align(query, reference).score for (query, reference) in cases]
+        seconds = clock() - start
+        best = seconds if best is None else min(best, seconds)
+    return (best, scores)
+
+def run_case(args, min_score, query_length, reference_length, distinct, related):
+    cases = make_case(args.seed, query_length, reference_length, distinct, related, args.pairs)
+    plain = ssw.Aligner(gap_open=args.gap_open, gap_extend=args.gap_extend)
+    filtered = ssw.Aligner(gap_open=args.gap_open, gap_extend=args.gap_extend, prefilter=KmerPrefilter(min_score, k=args.k))
+    (plain_seconds, plain_scores) = time_pairs(plain, cases, args.repeat)
+    (filtered_seconds, filtered_scores) = time_pairs(filtered, cases, args.repeat)
+    # a pruned pair scores 0, every other pair keeps its score
+    lost = sum(1 for (before, after) in zip(plain_scores, filtered_scores) if before != after and before >= min_score)
+    return OrderedDict((
+        ("min_score", min_score),
+        ("query_length", query_length),
+        ("reference_length", reference_length),
+        ("distinct_references", distinct),
+        ("related", related),
+        ("pairs", len(cases)),
+        ("threshold", filtered.prefilter.threshold(filtered, query_length)),
+        ("pruned", filtered.prefilter.pruned),
+        ("lost", lost),
+        ("plain_per_pair_us", 1e6 * plain_seconds / len(cases)),
+        ("prefilter_per_pair_us", 1e6 * filtered_seconds / len(cases)),
+        ("speedup", plain_seconds / filtered_seconds if filtered_seconds else None),
+    ))
+
+def numbers(text, kind):
+    return [kind(value) for value in text.split(",") if value]
+
+def run(args):
+    if args.simd:
+        libssw.set_simd(args.simd)
+    results = OrderedDict((
+        ("python", platform.python_version()),
+        ("platform", platform.platform()),
+        ("simd", libssw.get_simd()),
+        ("extension", libssw.extension is not None),
+        ("seed", args.seed),
+        ("k", args.k),
+        ("cases", []),
+    ))
+    sweep = itertools.product(
+        numbers(args.min_scores, int), numbers(args.query_lengths, int),
+        numbers(args.reference_lengths, int), (True, False), numbers(args.related, float))
+    for (min_score, query_length, reference_length, distinct, related) in sweep:
+        if query_length > reference_length:
+            continue
+        case = run_case(args, min_score, query_length, reference_length, distinct, related)
+        results["cases"].append(case)
+        if args.verbose:
+            sys.stderr.write("min %4d  query %5d  reference %7d  %-8s  related %.2f  %8.1f us  %8.1f us  x%.2f\n" % (
+                min_score, query_length, reference_length, "distinct" if distinct else "shared", related,
+                case["plain_per_pair_us"], case["prefilter_per_pair_us"], case["speedup"] or 0))
+    return results
+
+def get_parser():
+    parser = argparse.ArgumentParser(description="Benchmark the k-mer prefilter against plain alignment")
+    parser.add_argument("-o", "--output", default="-", help="JSON results file (default: stdout)")
+    parser.add_argument("--seed", type=int, default=1, help="seed of the synthetic data (default: %(default)s)")
+    parser.add_argument("--min-scores", default="170", help="prefilter min_score values to sweep (default: %(default)s)")
+    parser.add_argument("--query-lengths", default="100", help="query lengths to sweep (default: %(default)s)")
+    parser.add_argument("--reference-lengths", default="1000,10000", help="reference lengths to sweep (default: %(default)s)")
+    parser.add_argument("--related", default="0,0.1", help="fractions of reads taken from their reference (default: %(default)s)")
+    parser.add_argument("--pairs", type=int, default=500, help="pairs per case (default: %(default)s)")
+    parser.add_argument("--repeat", type=int, default=3, help="runs of each case, the fastest counts (default: %(default)s)")
+    parser.add_argument("-k", type=int, default=8, help="prefilter k-mer length (default: %(default)s)")
+    parser.add_argument("--gap-open", type=int, default=3, help="gap open penalty (default: %(default)s)")
+    parser.add_argument("--gap-extend", type=int, default=1, help="gap extension penalty (default: %(default)s)")
+    parser.add_argument("--simd", default=None, help="SIMD kernel to use (default: the best supported)")
+    parser.add_argument("-v", "--verbose", action="store_true", help="report every case on stderr")
+    return parser
+
+def main(argv=None):
+    args = get_parser().parse_args(argv)
+    results = run(args)
+    text = json.dumps(results, indent=2)
+    if args.output == "-":
+        print(text)
+    else:
+        with open(args.output, "w") as fh:
+            fh.write(text + "\n")
+    return results
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,266 @@
+#!/usr/bin/env python
+#
+# Stage by stage benchmark of the alignment path, on seeded synthetic data:
+# every case draws a reference and reads sampled from it with mismatches,
+# indels and IUPAC codes at the requested rates, and times each stage a
+# read goes through on its way to an alignment report.  Results are written
+# as JSON, so runs from different releases can be compared with --baseline.
+#
+#   python benchmarks/bench_ssw.py -o before.json
+#   python benchmarks/bench_ssw.py --baseline before.json -o after.json
+
+from __future__ import print_function
+import os
+import sys
+import json
+import time
+import random
+import platform
+import argparse
+import itertools
+from collections import OrderedDict
+
+try:
+    import resource
+except ImportError:
+    resource = None
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+import ssw
+from ssw import libssw
+
+clock = getattr(time, "perf_counter", time.time)
+
+BASES = "ACGT"
+# ambiguity codes a reference may carry instead of its base
+AMBIGUOUS = {
+    "A": "RMWDHVN",
+    "C": "YMSBHVN",
+    "G": "RKSBDVN",
+    "T": "YKWBDHN",
+}
+
+# the stages, in the order a read goes through them
+STAGES = (
+    ("encode", "convert_sequence_to_ints of the query and reference"),
+    ("profile", "ssw_init: query profile construction"),
+    ("align", "ssw_align: scan, start finding and traceback"),
+    ("alignment", "Alignment.__init__ from the native result"),
+    ("cigar", "Alignment.cigar"),
+    ("report", "Alignment.alignment_report"),
+)
+
+QUICK = {
+    "query_lengths": "50,150",
+    "reference_lengths": "100,1000",
+    "iupac": "0,0.05",
+    "errors": "0.01:0.002",
+    "pairs": 5,
+    "repeat": 1,
+}
+
+def random_sequence(rnd, length):
+    return str.join("", map(rnd.choice, [BASES] * length))
+
+def add_iupac(rnd, sequence, rate):
+    if not rate:
+        return sequence
+    return str.join("", (rnd.choice(AMBIGUOUS[base]) if rnd.random() < rate else base for base in sequence))
+
+def mutate(rnd, sequence, mismatch, indel):
+    # substitutions at the mismatch rate, and single base insertions and
+    # deletions at the indel rate (half each)
+    read = []
+    for base in sequence:
+        roll = rnd.random()
+        if roll < indel / 2.0:
+            continue
+        if roll < indel:
+            read.append(rnd.choice(BASES))
+        if rnd.random() < mismatch:
+            base = rnd.choice(BASES.replace(base, ""))
+        read.append(base)
+    return str.join("", read)
+
+def make_case(seed, query_length, reference_length, iupac, mismatch, indel, pairs):
+    # the reference (with IUPAC codes at the iupac rate) and pairs reads,
+    # each a mutated window of it
+    rnd = random.Random("%s:%d:%d:%s:%s:%s" % (seed, query_length, reference_length, iupac, mismatch, indel))
+    plain = random_sequence(rnd, reference_length)
+    reference = add_iupac(rnd, plain, iupac)
+    reads = []
+    for idx in range(pairs):
+        start = rnd.randint(0, reference_length - query_length)
+        reads.append(mutate(rnd, plain[start:start + query_length], mismatch, indel))
+    return (reference, reads)
+
+def peak_rss():
+    # kilobytes on Linux, bytes on macOS; None where it is not available
+    if resource is None:
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def run_pair(aligner, query, reference, timings):
+    # one read through every stage, adding the seconds each took to timings
+    matrix = aligner.matrix
+    t0 = clock()
+    encoded_query = ssw.EncodedSequence.from_codes(matrix.convert_sequence_to_ints(query), matrix, sequence=query)
+    encoded_reference = ssw.EncodedSequence.from_codes(matrix.convert_sequence_to_ints(reference), matrix, sequence=reference)
+    t1 = clock()
+    profile = aligner.profile(encoded_query)
+    t2 = clock()
+    try:
+        result = aligner._ssw_align(profile, encoded_reference, libssw.FLAG_MASK_BUILD_CIGAR, 0, 0, max(15, len(query) // 2))
+        t3 = clock()
+        try:
+            alignment = ssw.Alignment(result, encoded_query, encoded_reference, matrix)
+        finally:
+            libssw.ssw_align_del(result)
+        t4 = clock()
+    finally:
+        profile.close()
+    alignment.cigar
+    t5 = clock()
+    alignment.alignment_report()
+    t6 = clock()
+    for (name, seconds) in zip([name for (name, doc) in STAGES], (t1 - t0, t2 - t1, t3 - t2, t4 - t3, t5 - t4, t6 - t5)):
+        timings[name] += seconds
+    return alignment
+
+def run_case(aligner, seed, query_length, reference_length, iupac, mismatch, indel, pairs, repeat=1):
+    (reference, reads) = make_case(seed, query_length, reference_length, iupac, mismatch, indel, pairs)
+    # the fastest of repeat runs, stage by stage
+    best = None
+    scores = None
+    for run in range(repeat):
+        timings = OrderedDict((name, 0.0) for (name, doc) in STAGES)
+        scores = [run_pair(aligner, read, reference, timings).score for read in reads]
+        best = timings if best is None else OrderedDict((name, min(best[name], timings[name])) for name in timings)
+    total = sum(best.values())
+    peak_python = None
+    if tracemalloc is not None:
+        # a separate, untimed pass: tracing allocations slows everything down
+        tracemalloc.start()
+        run_pair(aligner, reads[0], reference, OrderedDict((name, 0.0) for (name, doc) in STAGES))
+        peak_python = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return OrderedDict((
+        ("query_length", query_length),
+        ("reference_length", reference_length),
+        ("iupac", iupac),
+        ("mismatch", mismatch),
+        ("indel", indel),
+        ("pairs", len(reads)),
+        ("mean_score", float(sum(scores)) / len(scores)),
+        ("seconds", total),
+        ("pairs_per_second", len(reads) / total if total else None),
+        ("cells_per_second", len(reads) * query_length * reference_length / total if total else None),
+        ("stages", OrderedDict((name, OrderedDict((("seconds", seconds), ("per_pair_us", 1e6 * seconds / len(reads))))) for (name, seconds) in best.items())),
+        ("peak_python_bytes", peak_python),
+        ("max_rss", peak_rss()),
+    ))
+
+def case_key(case):
+    return tuple(case[name] for name in ("query_length", "reference_length", "iupac", "mismatch", "indel"))
+
+def compare(results, baseline):
+    # speedup of every case and stage over the matching baseline case
+    old = dict((case_key(case), case) for case in baseline["cases"])
+    for case in results["cases"]:
+        before = old.get(case_key(case))
+        if before is None:
+            continue
+        per_pair = (before["seconds"] / before["pairs"], case["seconds"] / case["pairs"])
+        case["speedup"] = OrderedDict([("total", per_pair[0] / per_pair[1] if per_pair[1] else None)] + [
+            (name, before["stages"][name]["per_pair_us"] / stage["per_pair_us"] if stage["per_pair_us"] else None)
+            for (name, stage) in case["stages"].items() if name in before["stages"]
+        ])
+
+def numbers(text, kind):
+    return [kind(value) for value in text.split(",") if value]
+
+def errors(text):
+    # mismatch:indel rate pairs
+    return [tuple(float(rate) for rate in pair.split(":")) for pair in text.split(",") if pair]
+
+def run(args):
+    if args.simd:
+        libssw.set_simd(args.simd)
+    aligner = ssw.Aligner(gap_open=args.gap_open, gap_extend=args.gap_extend)
+    results = OrderedDict((
+        ("ssw_version", ssw_version()),
+        ("python", platform.python_version()),
+        ("platform", platform.platform()),
+        ("simd", libssw.get_simd()),
+        ("extension", libssw.extension is not None),
+        ("seed", args.seed),
+        ("stages", OrderedDict(STAGES)),
+        ("cases", []),
+    ))
+    sweep = itertools.product(
+        numbers(args.query_lengths, int), numbers(args.reference_lengths, int),
+        numbers(args.iupac, float), errors(args.errors))
+    for (query_length, reference_length, iupac, (mismatch, indel)) in sweep:
+        if query_length > reference_length:
+            # reads are windows of the reference
+            continue
+        # long pairs get fewer repetitions, down to one
+        pairs = max(1, min(args.pairs, int(args.max_cells // (query_length * reference_length))))
+        case = run_case(aligner, args.seed, query_length, reference_length, iupac, mismatch, indel, pairs, args.repeat)
+        results["cases"].append(case)
+        if args.verbose:
+            sys.stderr.write("query %6d  reference %8d  iupac %.3f  errors %.3f/%.3f  %10.1f pairs/s\n" % (
+                query_length, reference_length, iupac, mismatch, indel, case["pairs_per_second"] or 0))
+    if args.baseline:
+        with open(args.baseline) as fh:
+            compare(results, json.load(fh))
+    return results
+
+def ssw_version():
+    # from the source tree the benchmark ships in
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "VERSION")
+    if not os.path.exists(path):
+        return None
+    with open(path) as fh:
+        return fh.read().strip()
+
+def get_parser():
+    parser = argparse.ArgumentParser(description="Benchmark every stage of the ssw alignment path")
+    parser.add_argument("-o", "--output", default="-", help="JSON results file (default: stdout)")
+    parser.add_argument("--seed", type=int, default=1, help="seed of the synthetic data (default: %(default)s)")
+    parser.add_argument("--query-lengths", default="50,150,1000,10000", help="query lengths to sweep (default: %(default)s)")
+    parser.add_argument("--reference-lengths", default="100,10000,1000000", help="reference lengths to sweep (default: %(default)s)")
+    parser.add_argument("--iupac", default="0,0.05", help="rates of IUPAC codes in the reference (default: %(default)s)")
+    parser.add_argument("--errors", default="0.01:0.002,0.08:0.02", help="mismatch:indel rates of the reads (default: %(default)s)")
+    parser.add_argument("--pairs", type=int, default=50, help="pairs per case (default: %(default)s)")
+    parser.add_argument("--max-cells", type=float, default=2e9, help="fewer pairs for cases with more matrix cells than this (default: %(default)s)")
+    parser.add_argument("--repeat", type=int, default=3, help="runs of each case, the fastest counts (default: %(default)s)")
+    parser.add_argument("--gap-open", type=int, default=3, help="gap open penalty (default: %(default)s)")
+    parser.add_argument("--gap-extend", type=int, default=1, help="gap extension penalty (default: %(default)s)")
+    parser.add_argument("--simd", default=None, help="SIMD kernel to use (default: the best supported)")
+    parser.add_argument("--baseline", default=None, help="earlier results to report speedups against")
+    parser.add_argument("--quick", action="store_true", help="a small sweep, for smoke testing")
+    parser.add_argument("-v", "--verbose", action="store_true", help="report every case on stderr")
+    return parser
+
+def main(argv=None):
+    parser = get_parser()
+    args = parser.parse_args(argv)
+    if args.quick:
+        # the quick sweep only replaces the defaults
+        parser.set_defaults(**QUICK)
+        args = parser.parse_args(argv)
+    results = run(args)
+    text = json.dumps(results, indent=2)
+    if args.output == "-":
+        print(text)
+    else:
+        with open(args.output, "w") as fh:
+            fh.write(text + "\n")
+    return results
+
+if __name__ == "__main__":
+    main()
@@ -17,6 +17,15 @@ interface is maintained by Giles Hall.
 libssw_ext = {
     "sources": ["src/ssw/ssw.c"],
     "include_dirs": ["src/ssw"],
+    "depends": ["src/ssw/ssw.h", "src/ssw/ssw_kernel.h"],
+}
+
+# the CPython binding that aligns in one call; it compiles in its own copy
+# of the library, and the package falls back to ctypes when it is missing
+sswext_ext = {
+    "sources": ["src/ssw/sswext.c"],
+    "include_dirs": ["src/ssw"],
+    "depends": ["src/ssw/ssw.c", "src/ssw/ssw.h", "src/ssw/ssw_kernel.h"],
 }
 
 config = {
@@ -53,7 +62,7 @@ config = {
         "six",
     ],
     "platforms": "any",
-    "ext_modules": [Extension("_libssw", **libssw_ext)],
+    "ext_modules": [Extension("_libssw", **libssw_ext), Extension("ssw._sswext", **sswext_ext)],
     "zip_safe": False,
     "download_url": download_url,
     "url": "https://github.com/vishnubob/ssw",
@@ -0,0 +1,64 @@
+import sys
+import argparse
+from . import pipeline
+from . import refstore
+from . sswobj import Aligner, NucleotideScoreMatrix
+
+def get_aligner(args):
+    matrix = NucleotideScoreMatrix(match=args.match, mismatch=-abs(args.mismatch))
+    return Aligner(matrix=matrix, gap_open=args.gap_open, gap_extend=args.gap_extend)
+
+def add_scoring_arguments(parser):
+    parser.add_argument("--match", type=int, default=2, help="match score (default: %(default)s)")
+    parser.add_argument("--mismatch", type=int, default=2, help="mismatch penalty (default: %(default)s)")
+    parser.add_argument("--gap-open", type=int, default=3, help="gap open penalty (default: %(default)s)")
+    parser.add_argument("--gap-extend", type=int, default=1, help="gap extension penalty (default: %(default)s)")
+
+def cmd_align(args):
+    pipeline.align_reads(
+        args.reference, args.reads, args.output,
+        aligner=get_aligner(args),
+        workers=args.workers,
+        chunk_size=args.chunk_size,
+        max_pending=args.max_pending,
+        revcomp=not args.forward_only,
+        min_score=args.min_score,
+        command_line=str.join(" ", ["ssw"] + args.argv),
+    )
+
+def cmd_encode(args):
+    count = refstore.write_reference_store(args.output, args.reference)
+    sys.stderr.write("%d contigs written to %s\n" % (count, args.output))
+
+def get_parser():
+    parser = argparse.ArgumentParser(prog="python -m ssw", description="Smith-Waterman Sequence Aligner")
+    commands = parser.add_subparsers(dest="command")
+    commands.required = True
+
+    align = commands.add_parser("align", help="align FASTA/FASTQ reads to a reference and write SAM")
+    align.add_argument("reference", help="reference FASTA, optionally gzipped, or an encoded reference file")
+    align.add_argument("reads", help="reads as FASTA or FASTQ, optionally gzipped; - for stdin")
+    align.add_argument("-o", "--output", default="-", help="SAM output file (default: stdout)")
+    align.add_argument("-j", "--workers", type=int, default=None, help="worker processes (default: one per core)")
+    align.add_argument("--chunk-size", type=int, default=256, help="reads sent to a worker at a time (default: %(default)s)")
+    align.add_argument("--max-pending", type=int, default=None, help="chunks in flight at once (default: twice the workers)")
+    align.add_argument("--min-score", type=int, default=0, help="report reads scoring below this as unmapped")
+    align.add_argument("--forward-only", action="store_true", help="do not align the reverse complement of reads")
+    add_scoring_arguments(align)
+    align.set_defaults(func=cmd_align)
+
+    encode = commands.add_parser("encode", help="write an encoded reference file that aligners memory map")
+    encode.add_argument("reference", help="reference FASTA, optionally gzipped")
+    encode.add_argument("-o", "--output", required=True, help="encoded reference file")
+    encode.set_defaults(func=cmd_encode)
+    return parser
+
+def main(argv=None):
+    argv = list(sys.argv[1:] if argv is None else argv)
+    args = get_parser().parse_args(argv)
+    args.argv = argv
+    args.func(args)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
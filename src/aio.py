@@ -0,0 +1,191 @@
+import asyncio
+import collections
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
+import six
+from . sswobj import Aligner
+
+__all__ = (
+    "AsyncAligner",
+)
+
+DEFAULT_BATCH_SIZE = 32
+# seconds a batch waits for company before it is sent to the workers
+DEFAULT_BATCH_DELAY = 0.0005
+
+_Batch = collections.namedtuple("_Batch", ("reference", "options", "items", "timer"))
+
+def _reference_key(reference):
+    # requests against equal reference strings (or the same object) share
+    # batches
+    if reference is None or isinstance(reference, six.string_types):
+        return reference
+    return id(reference)
+
+class AsyncAligner(object):
+    # Aligner for asyncio code.  Alignments run on a dedicated pool of
+    # worker threads (the native alignment releases the GIL), so the event
+    # loop is never blocked.  Concurrent requests against the same
+    # reference with the same options are collected into micro-batches of
+    # up to batch_size, sent to the pool as one job once full or after
+    # batch_delay seconds, and the reference is encoded once per batch.  At
+    # most max_pending queries are queued or aligning at a time; callers
+    # beyond that wait for a slot, which keeps latency bounded under bursts.
+    def __init__(self, aligner=None, workers=None, max_pending=None, batch_size=DEFAULT_BATCH_SIZE, batch_delay=DEFAULT_BATCH_DELAY, **kw):
+        # without an aligner, one is made from the remaining keywords
+        if batch_size < 1:
+            raise ValueError("batch_size must be at least 1")
+        self.aligner = aligner if aligner is not None else Aligner(**kw)
+        self.workers = workers if workers is not None else multiprocessing.cpu_count()
+        self.batch_size = batch_size
+        self.batch_delay = batch_delay
+        self.max_pending = max_pending if max_pending is not None else 2 * self.workers * batch_size
+        if self.max_pending < 1:
+            raise ValueError("max_pending must be at least 1")
+        self._executor = ThreadPoolExecutor(self.workers)
+        self._batches = {}
+        self._jobs = set()
+        self._slots = None
+        self._loop = None
+        self.pending = 0
+        self.batches = 0
+        self.aligned = 0
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        await self.close()
+
+    def stats(self):
+        return {"pending": self.pending, "batches": self.batches, "aligned": self.aligned}
+
+    async def align(self, query, reference=None, **kw):
+        # as Aligner.align, with the same keywords
+        loop = self._bind()
+        await self._slots.acquire()
+        self.pending += 1
+        try:
+            return await self._submit(loop, query, reference, kw)
+        finally:
+            self.pending -= 1
+            self._slots.release()
+
+    async def align_many(self, queries, reference=None, ordered=True, **kw):
+        # Async iterator over the alignments of queries (an iterable of
+        # query sequences, or of (query, reference) pairs without a
+        # reference), in input order, or as (index, alignment) tuples in
+        # completion order when not ordered.  No more than max_pending
+        # queries are taken from the iterable ahead of the results.
+        self._bind()
+        window = collections.deque() if ordered else set()
+        try:
+            for (idx, item) in enumerate(queries):
+                if reference is None and not isinstance(item, six.string_types):
+                    (query, pair_reference) = item
+                else:
+                    (query, pair_reference) = (item, reference)
+                task = asyncio.ensure_future(self._indexed(idx, query, pair_reference, kw))
+                if ordered:
+                    window.append(task)
+                else:
+                    window.add(task)
+                while len(window) >= self.max_pending:
+                    if ordered:
+                        yield (await window.popleft())[1]
+                    else:
+                        for result in await self._next_done(window):
+                            yield result
+            while window:
+                if ordered:
+                    yield (await window.popleft())[1]
+                else:
+                    for result in await self._next_done(window):
+                        yield result
+        finally:
+            for task in window:
+                task.cancel()
+
+    async def _indexed(self, idx, query, reference, kw):
+        return (idx, await self.align(query, reference, **kw))
+
+    async def _next_done(self, window):
+        (done, rest) = await asyncio.wait(window, return_when=asyncio.FIRST_COMPLETED)
+        window.difference_update(done)
+        return [task.result() for task in done]
+
+    async def close(self):
+        # sends off the batches still collecting, waits for every job and
+        # shuts the worker pool down
+        for key in list(self._batches):
+            self._flush(key)
+        if self._jobs:
+            await asyncio.wait(list(self._jobs))
+        self._executor.shutdown(wait=False)
+
+    def _bind(self):
+        # the queue state belongs to the event loop of the first caller
+        loop = asyncio.get_event_loop()
+        if self._loop is None:
+            self._loop = loop
+            self._slots = asyncio.Semaphore(self.max_pending)
+        elif self._loop is not loop:
+            raise RuntimeError("AsyncAligner is bound to another event loop")
+        return loop
+
+    def _submit(self, loop, query, reference, kw):
+        future = loop.create_future()
+        options = tuple(sorted(kw.items()))
+        key = (_reference_key(reference), options)
+        batch = self._batches.get(key)
+        if batch is None:
+            batch = self._batches[key] = _Batch(reference, kw, [], loop.call_later(self.batch_delay, self._flush, key))
+        batch.items.append((query, future))
+        if len(batch.items) >= self.batch_size:
+            self._flush(key)
+        return future
+
+    def _flush(self, key):
+        batch = self._batches.pop(key, None)
+        if batch is None:
+            return
+        batch.timer.cancel()
+        self.batches += 1
+        queries = [query for (query, future) in batch.items]
+        job = self._loop.run_in_executor(self._executor, self._run_batch, batch.reference, batch.options, queries)
+        self._jobs.add(job)
+        job.add_done_callback(lambda job: self._deliver(job, batch))
+
+    def _run_batch(self, reference, options, queries):
+        # runs on a worker thread; every query gets its alignment or the
+        # exception aligning it raised
+        aligner = self.aligner
+        results = []
+        try:
+            if reference is not None:
+                reference = aligner.encode(reference)
+        except Exception as err:
+            return [err] * len(queries)
+        for query in queries:
+            try:
+                results.append(aligner.align(query, reference, **options))
+            except Exception as err:
+                results.append(err)
+        return results
+
+    def _deliver(self, job, batch):
+        self._jobs.discard(job)
+        if job.cancelled():
+            results = [asyncio.CancelledError()] * len(batch.items)
+        elif job.exception() is not None:
+            results = [job.exception()] * len(batch.items)
+        else:
+            results = job.result()
+        for ((query, future), result) in zip(batch.items, results):
+            if future.done():
+                continue
+            if isinstance(result, BaseException):
+                future.set_exception(result)
+            else:
+                self.aligned += 1
+                future.set_result(result)
@@ -0,0 +1,98 @@
+import hashlib
+import threading
+from collections import OrderedDict
+
+__all__ = (
+    "AlignmentCache",
+)
+
+DEFAULT_MAX_ENTRIES = 65536
+
+# rough per entry cost of the key tuple, the Alignment and the dict slot,
+# on top of the query and the CIGAR
+ENTRY_OVERHEAD = 512
+
+def codes_digest(encoded):
+    # digest of an encoded sequence's codes, worked out once per sequence
+    digest = getattr(encoded, "_digest", None)
+    if digest is None:
+        digest = encoded._digest = hashlib.sha1(_codes_bytes(encoded)).digest()
+    return digest
+
+def _codes_bytes(encoded):
+    codes = encoded.codes
+    if isinstance(codes, bytes):
+        return codes
+    return memoryview(codes).tobytes()
+
+class AlignmentCache(object):
+    # Least recently used cache of Alignments, bounded by the number of
+    # entries, an estimate of the bytes they hold, or both.  Cached
+    # alignments are shared between everyone who asks for the same key, so
+    # they should be treated as read only.  Safe to share between threads.
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, max_bytes=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __getstate__(self):
+        # the bounds travel, the entries do not
+        return (self.max_entries, self.max_bytes)
+
+    def __setstate__(self, state):
+        self.__init__(*state)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def key(self, aligner, query, reference, strand, *options):
+        # query and reference are encoded sequences; the key covers
+        # everything the alignment depends on
+        matrix = aligner.matrix
+        prefilter = aligner.prefilter
+        if prefilter is not None:
+            prefilter = (prefilter.min_score, prefilter.k, prefilter.max_expansions)
+        return (
+            _codes_bytes(query), codes_digest(reference),
+            str.join("", matrix.alphabet), bytes(bytearray(matrix._matrix)),
+            aligner.gap_open, aligner.gap_extend, strand, prefilter,
+        ) + options
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries[key] = entry
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, alignment):
+        size = ENTRY_OVERHEAD + len(key[0]) + 4 * len(alignment._cigar)
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.nbytes -= old[1]
+            self._entries[key] = (alignment, size)
+            self.nbytes += size
+            while self._entries and ((self.max_entries is not None and len(self._entries) > self.max_entries) or (self.max_bytes is not None and self.nbytes > self.max_bytes)):
+                (oldest, (alignment, size)) = self._entries.popitem(last=False)
+                self.nbytes -= size
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+
+    def stats(self):
+        return {"entries": len(self._entries), "bytes": self.nbytes, "hits": self.hits, "misses": self.misses, "evictions": self.evictions}
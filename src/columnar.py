@@ -0,0 +1,132 @@
+import ctypes
+from array import array
+from . import libssw
+from . sswobj import CIGAR_OPS
+
+try:
+    import numpy
+except ImportError:
+    raise ImportError("columnar alignment results need numpy")
+
+__all__ = (
+    "ALIGNMENT_DTYPE",
+    "AlignmentTable",
+)
+
+# The first seven fields have the layout of the leading fields of
+# libssw.AlignmentResult, so a row is filled with one copy from the
+# native result.
+ALIGNMENT_DTYPE = numpy.dtype([
+    ("score", numpy.uint16),
+    ("score2", numpy.uint16),
+    ("reference_begin", numpy.int32),
+    ("reference_end", numpy.int32),
+    ("query_begin", numpy.int32),
+    ("query_end", numpy.int32),
+    ("reference_end2", numpy.int32),
+    ("strand", "S1"),
+    ("query_length", numpy.int32),
+    ("reference_length", numpy.int32),
+    ("query_coverage", numpy.float32),
+    ("reference_coverage", numpy.float32),
+], align=True)
+
+NATIVE_FIELDS_SIZE = libssw.AlignmentResult.ref_end2.offset + libssw.AlignmentResult.ref_end2.size
+
+class AlignmentTable(object):
+    # Alignments of a batch as columns: records is a structured array with
+    # one row per alignment (see ALIGNMENT_DTYPE), and the packed CIGAR of
+    # row i is cigars[offsets[i]:offsets[i + 1]].  The coverages are NaN
+    # where there is no start position (score only, or filtered out).
+    # numpy.rec / pandas.DataFrame(table.records) take the rows as is.
+    def __init__(self, records, cigars, offsets):
+        self.records = records
+        self.cigars = cigars
+        self.offsets = offsets
+
+    def __len__(self):
+        return len(self.records)
+
+    def __getitem__(self, key):
+        # a column by name, or a row by index
+        return self.records[key]
+
+    @property
+    def columns(self):
+        return self.records.dtype.names
+
+    def take(self, indices):
+        # a new table of the given rows, in the given order
+        indices = numpy.asarray(indices, dtype=numpy.int64)
+        starts = self.offsets[indices]
+        lengths = self.offsets[indices + 1] - starts
+        offsets = numpy.zeros(len(indices) + 1, dtype=numpy.int64)
+        numpy.cumsum(lengths, out=offsets[1:])
+        gather = numpy.repeat(starts - offsets[:-1], lengths) + numpy.arange(offsets[-1], dtype=numpy.int64)
+        return AlignmentTable(self.records.take(indices), self.cigars.take(gather), offsets)
+
+    def cigar_codes(self, idx):
+        return self.cigars[self.offsets[idx]:self.offsets[idx + 1]]
+
+    def iter_cigar(self, idx):
+        for val in self.cigar_codes(idx):
+            val = int(val)
+            op = val & 0xf
+            yield (val >> 4, CIGAR_OPS[op] if op < len(CIGAR_OPS) else 'M')
+
+    def cigar(self, idx):
+        # the CIGAR string with soft clips, as Alignment.cigar gives it
+        row = self.records[idx]
+        cigar = ""
+        if row["query_begin"] < 0:
+            return cigar
+        if row["query_begin"] > 0:
+            cigar += str(row["query_begin"]) + "S"
+        cigar += str.join('', (str(op_len) + op_char for (op_len, op_char) in self.iter_cigar(idx)))
+        end_len = row["query_length"] - row["query_end"] - 1
+        if end_len != 0:
+            cigar += str(end_len) + "S"
+        return cigar
+
+class _TableWriter(object):
+    # fills the rows of an AlignmentTable from native results; rows may be
+    # written from several threads at once, as each writes its own rows and
+    # keeps its own CIGAR chunk
+    def __init__(self, size):
+        self.records = numpy.zeros(size, dtype=ALIGNMENT_DTYPE)
+        self.address = self.records.ctypes.data
+        self.itemsize = self.records.dtype.itemsize
+        self.strand = self.records["strand"]
+        self.query_length = self.records["query_length"]
+        self.reference_length = self.records["reference_length"]
+
+    def chunk(self):
+        # (cigars, cigar lengths) collected for one run of rows
+        return (array('I'), array('i'))
+
+    def put(self, row, alignment, strand, query_length, reference_length, chunk):
+        ctypes.memmove(self.address + row * self.itemsize, alignment, NATIVE_FIELDS_SIZE)
+        self.strand[row] = strand
+        self.query_length[row] = query_length
+        self.reference_length[row] = reference_length
+        (cigars, cigar_lengths) = chunk
+        cigar_len = alignment.contents.cigarLen
+        if cigar_len > 0:
+            cigars.frombytes(libssw.string_at(alignment.contents.cigar, cigar_len * cigars.itemsize))
+        cigar_lengths.append(max(cigar_len, 0))
+
+    def finish(self, chunks):
+        # chunks in row order
+        records = self.records
+        cigars = numpy.concatenate([numpy.frombuffer(cigars, dtype=numpy.uint32) for (cigars, lengths) in chunks] or [numpy.zeros(0, numpy.uint32)])
+        offsets = numpy.zeros(len(records) + 1, dtype=numpy.int64)
+        if len(records):
+            lengths = numpy.concatenate([numpy.frombuffer(lengths, dtype=numpy.int32) for (cigars, lengths) in chunks])
+            numpy.cumsum(lengths, out=offsets[1:])
+        for (side, length) in (("query", "query_length"), ("reference", "reference_length")):
+            (begin, end) = (records[side + "_begin"], records[side + "_end"])
+            valid = (begin >= 0) & (records[length] > 0)
+            coverage = numpy.full(len(records), numpy.nan, dtype=numpy.float32)
+            coverage[valid] = (end[valid] - begin[valid] + 1) / records[length][valid]
+            records[side + "_coverage"] = coverage
+        return AlignmentTable(records, cigars, offsets)
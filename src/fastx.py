@@ -0,0 +1,77 @@
+import io
+import gzip
+import sys
+from collections import namedtuple
+
+__all__ = (
+    "SequenceRecord",
+    "open_sequence_file",
+    "read_fastx",
+)
+
+SequenceRecord = namedtuple("SequenceRecord", ("name", "sequence", "quality"))
+
+GZIP_MAGIC = b"\x1f\x8b"
+
+class _StdinReader(io.RawIOBase):
+    # standard input, in a stream that can be closed without closing it
+    def __init__(self, stream):
+        self.stream = stream
+
+    def readable(self):
+        return True
+
+    def readinto(self, buf):
+        read = getattr(self.stream, "read1", self.stream.read)
+        data = read(len(buf))
+        buf[:len(data)] = data
+        return len(data)
+
+def open_sequence_file(path):
+    # plain or gzip compressed, decided by the magic bytes rather than the
+    # name; "-" reads standard input, which is left open
+    if path == "-":
+        fh = io.BufferedReader(_StdinReader(getattr(sys.stdin, "buffer", sys.stdin)))
+        if fh.peek(2)[:2] == GZIP_MAGIC:
+            return io.TextIOWrapper(gzip.GzipFile(fileobj=fh))
+        return io.TextIOWrapper(fh)
+    with open(path, "rb") as fh:
+        magic = fh.read(2)
+    if magic == GZIP_MAGIC:
+        return io.TextIOWrapper(gzip.open(path, "rb"))
+    return io.open(path, "r")
+
+def read_fastx(source):
+    # lazily yields one SequenceRecord at a time from a FASTA or FASTQ
+    # file name or open text handle; quality is None for FASTA records
+    if isinstance(source, str):
+        with open_sequence_file(source) as fh:
+            for record in read_fastx(fh):
+                yield record
+        return
+    lines = (line.rstrip("\r\n") for line in source)
+    line = next(lines, None)
+    while line is not None:
+        if not line:
+            line = next(lines, None)
+        elif line.startswith(">"):
+            name = (line[1:].split(None, 1) or [""])[0]
+            chunks = []
+            line = next(lines, None)
+            while line is not None and not line.startswith(">"):
+                chunks.append(line.strip())
+                line = next(lines, None)
+            yield SequenceRecord(name, str.join("", chunks), None)
+        elif line.startswith("@"):
+            name = (line[1:].split(None, 1) or [""])[0]
+            sequence = next(lines, None)
+            separator = next(lines, None)
+            quality = next(lines, None)
+            if quality is None or not separator.startswith("+"):
+                raise ValueError("Truncated FASTQ record '%s'" % name)
+            if len(quality) != len(sequence):
+                raise ValueError("FASTQ record '%s' has %d bases but %d qualities" % (name, len(sequence), len(quality)))
+            yield SequenceRecord(name, sequence, quality)
+            line = next(lines, None)
+        else:
+            raise ValueError("Expected a FASTA or FASTQ record, found %r" % line[:40])
@@ -0,0 +1,140 @@
+import bisect
+import struct
+import zlib
+from array import array
+from six.moves import range
+from . sswobj import EncodedSequence, _byte_view
+
+__all__ = (
+    "ReferenceIndex",
+)
+
+DEFAULT_KMER = 14
+DEFAULT_MAX_OCCURRENCES = 512
+
+INDEX_MAGIC = b"SSWKMER1"
+# magic, k, bits per symbol, alphabet length, reference length, reference
+# crc32, number of distinct k-mers, number of positions
+INDEX_HEADER = struct.Struct("<8sIIIQIQQ")
+
+def _codes_bytes(codes):
+    if isinstance(codes, bytes):
+        return codes
+    return _byte_view(codes).tobytes()
+
+class ReferenceIndex(object):
+    # Exact k-mer seeds of one encoded reference.  The k-mers are packed
+    # into integers (bits_per_symbol bits for each symbol code); kmers holds
+    # the distinct ones in order, and the reference positions of kmers[i]
+    # are positions[starts[i]:starts[i + 1]], in increasing order.
+    def __init__(self, reference, matrix=None, k=DEFAULT_KMER):
+        if not isinstance(reference, EncodedSequence):
+            if matrix is None:
+                raise ValueError("a reference that is not encoded needs a score matrix")
+            reference = EncodedSequence(reference, matrix)
+        self.matrix = reference.matrix
+        self.k = k
+        self.bits_per_symbol = max(1, (len(self.matrix.alphabet) - 1).bit_length())
+        if k < 1 or k * self.bits_per_symbol > 64:
+            raise ValueError("k must be between 1 and %d for this alphabet" % (64 // self.bits_per_symbol))
+        codes = _codes_bytes(reference.codes)
+        self.reference_length = len(codes)
+        self.checksum = zlib.crc32(codes) & 0xffffffff
+        self._build(codes)
+
+    def _kmers(self, codes):
+        # (position, k-mer) for every k-mer of codes
+        (k, bits) = (self.k, self.bits_per_symbol)
+        mask = (1 << (k * bits)) - 1
+        value = 0
+        for (pos, code) in enumerate(bytearray(codes)):
+            value = ((value << bits) | code) & mask
+            if pos >= k - 1:
+                yield (pos - k + 1, value)
+
+    def _build(self, codes):
+        values = array('Q', (value for (pos, value) in self._kmers(codes)))
+        order = sorted(range(len(values)), key=values.__getitem__)
+        self.kmers = array('Q')
+        self.starts = array('Q')
+        self.positions = array('I', order)
+        last = None
+        for (idx, pos) in enumerate(order):
+            if values[pos] != last:
+                last = values[pos]
+                self.kmers.append(last)
+                self.starts.append(idx)
+        self.starts.append(len(order))
+
+    def matches(self, reference):
+        # True if this index was built from the (encoded) reference
+        codes = _codes_bytes(reference.codes)
+        return len(codes) == self.reference_length and zlib.crc32(codes) & 0xffffffff == self.checksum
+
+    def lookup(self, kmer):
+        idx = bisect.bisect_left(self.kmers, kmer)
+        if idx == len(self.kmers) or self.kmers[idx] != kmer:
+            return self.positions[0:0]
+        return self.positions[self.starts[idx]:self.starts[idx + 1]]
+
+    def windows(self, query, pad, max_occurrences=DEFAULT_MAX_OCCURRENCES):
+        # (start, stop) reference windows around the diagonals the k-mers of
+        # the encoded query hit, padded by pad bases on both sides, in
+        # reference order and without overlaps.  k-mers with more than
+        # max_occurrences hits are repeats and are left out, unless every
+        # k-mer of the query is.
+        diagonals = []
+        repeats = []
+        for (offset, kmer) in self._kmers(_codes_bytes(query.codes)):
+            hits = self.lookup(kmer)
+            if max_occurrences and len(hits) > max_occurrences:
+                repeats.append((offset, hits))
+                continue
+            diagonals.extend(pos - offset for pos in hits)
+        if not diagonals:
+            for (offset, hits) in repeats:
+                diagonals.extend(pos - offset for pos in hits)
+        windows = []
+        for diagonal in sorted(set(diagonals)):
+            start = max(0, diagonal - pad)
+            stop = min(self.reference_length, diagonal + len(query) + pad)
+            if windows and start <= windows[-1][1]:
+                windows[-1][1] = max(windows[-1][1], stop)
+            else:
+                windows.append([start, stop])
+        return [tuple(window) for window in windows]
+
+    def save(self, path):
+        alphabet = str.join("", self.matrix.alphabet).encode("latin-1")
+        header = INDEX_HEADER.pack(INDEX_MAGIC, self.k, self.bits_per_symbol, len(alphabet), self.reference_length, self.checksum, len(self.kmers), len(self.positions))
+        with open(path, "wb") as fh:
+            fh.write(header)
+            fh.write(alphabet)
+            for values in (self.kmers, self.starts, self.positions):
+                values.tofile(fh)
+
+    @classmethod
+    def load(cls, path, matrix):
+        # matrix is the score matrix the reference is encoded with; its
+        # alphabet has to be the one the index was built with
+        with open(path, "rb") as fh:
+            header = fh.read(INDEX_HEADER.size)
+            if len(header) != INDEX_HEADER.size or header[:len(INDEX_MAGIC)] != INDEX_MAGIC:
+                raise ValueError("%s is not a reference index" % path)
+            (magic, k, bits, alphabet_length, reference_length, checksum, kmer_count, position_count) = INDEX_HEADER.unpack(header)
+            alphabet = fh.read(alphabet_length).decode("latin-1")
+            if tuple(alphabet) != tuple(matrix.alphabet):
+                raise ValueError("reference index alphabet %r does not match the score matrix" % alphabet)
+            index = cls.__new__(cls)
+            (index.matrix, index.k, index.bits_per_symbol) = (matrix, k, bits)
+            (index.reference_length, index.checksum) = (reference_length, checksum)
+            index.kmers = array('Q')
+            index.starts = array('Q')
+            index.positions = array('I')
+            try:
+                index.kmers.fromfile(fh, kmer_count)
+                index.starts.fromfile(fh, kmer_count + 1)
+                index.positions.fromfile(fh, position_count)
+            except EOFError:
+                raise ValueError("%s is truncated" % path)
+        return index
@@ -0,0 +1,104 @@
+import time
+import threading
+from . import libssw
+
+__all__ = (
+    "Instrumentation",
+)
+
+clock = getattr(time, "perf_counter", time.time)
+
+# what an Aligner times: sequence encoding, query profile construction,
+# native alignment calls (the forward scan, the reverse pass for the start
+# and the CIGAR traceback; the compiled binding also builds its profiles
+# here), the traceback of the winning strand of a two strand alignment,
+# banded alignment, batch scoring, and building Alignments from results
+STAGES = ("encode", "profile", "align", "traceback", "banded", "batch", "alignment")
+
+# the instruments counting natively, and whether the native counters were on
+# before the first of them turned them on
+_native_lock = threading.Lock()
+_native_users = [0, False]
+
+def _acquire_native():
+    with _native_lock:
+        was = libssw.enable_native_stats(True)
+        if not _native_users[0]:
+            _native_users[1] = was
+        _native_users[0] += 1
+
+def _release_native():
+    with _native_lock:
+        _native_users[0] -= 1
+        if not _native_users[0]:
+            libssw.enable_native_stats(_native_users[1])
+
+class Instrumentation(object):
+    # Opt-in counters and timers for an Aligner, given as
+    # Aligner(instrument=True) or instrument=Instrumentation(hook=...).
+    # Every stage counts its calls, the items they covered and the seconds
+    # they took; hook, if given, is called as hook(stage, seconds, items)
+    # after each one, on the thread that ran it, to feed a metrics system.
+    # With native, the library's own counters (8 bit overflows, scan cells,
+    # time in the scan, the reverse pass and the traceback, ...) are turned
+    # on as well.  They are process wide, so a snapshot reports how much
+    # they moved since this object was made or reset, and they stay on
+    # until the last instrument using them is closed (or collected), when
+    # they are put back as they were.  The counts and the hook stay in this
+    # process when an Aligner is pickled.
+    def __init__(self, hook=None, native=True):
+        self.hook = hook
+        self.native = native
+        self._lock = threading.Lock()
+        self._native_on = False
+        if native:
+            _acquire_native()
+            self._native_on = True
+        self.reset()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __del__(self):
+        self.close()
+
+    def close(self):
+        # lets go of the native counters; the stage counts stay readable
+        if getattr(self, "_native_on", False):
+            self._native_on = False
+            _release_native()
+
+    def __getstate__(self):
+        return (self.native,)
+
+    def __setstate__(self, state):
+        self.__init__(native=state[0])
+
+    def reset(self):
+        with self._lock:
+            self._stages = dict((stage, [0, 0, 0.0]) for stage in STAGES)
+            self._native_base = libssw.native_stats() if self.native else None
+
+    def record(self, stage, start, items=1):
+        # start is a clock() reading taken when the stage began
+        seconds = clock() - start
+        with self._lock:
+            counts = self._stages[stage]
+            counts[0] += 1
+            counts[1] += items
+            counts[2] += seconds
+        if self.hook is not None:
+            self.hook(stage, seconds, items)
+
+    def snapshot(self):
+        with self._lock:
+            stages = dict((stage, {"calls": calls, "items": items, "seconds": seconds}) for (stage, (calls, items, seconds)) in self._stages.items())
+            base = self._native_base
+        snapshot = {"stages": stages}
+        if self.native:
+            counts = libssw.native_stats()
+            snapshot["native"] = dict((name, max(0, count - base.get(name, 0))) for (name, count) in counts.items())
+        return snapshot
@@ -2,20 +2,49 @@ import os
 import itertools
 from ctypes import *
 
+try:
+    from importlib.machinery import EXTENSION_SUFFIXES
+except ImportError:
+    import imp
+    EXTENSION_SUFFIXES = [suffix for (suffix, mode, kind) in imp.get_suffixes() if kind == imp.C_EXTENSION]
+
+LIBRARY_NAME = "_libssw"
+# path of the compiled library, to use instead of looking for it
+LIBRARY_ENV = "SSW_LIBRARY"
+
+def find_ssw_library(package_dir=None):
+    # The library is built as a top level extension module, so it sits
+    # beside the package when installed and at the top of the source tree
+    # when built in place.  Only those few names are tried, however many
+    # other packages share the directory.
+    path = os.environ.get(LIBRARY_ENV)
+    if path:
+        if not os.path.isfile(path):
+            raise ImportError("%s is set to %r, which is not a file" % (LIBRARY_ENV, path))
+        return path
+    package_dir = package_dir if package_dir is not None else os.path.dirname(os.path.abspath(__file__))
+    tried = []
+    for directory in (package_dir, os.path.dirname(package_dir)):
+        for suffix in EXTENSION_SUFFIXES:
+            path = os.path.join(directory, LIBRARY_NAME + suffix)
+            if os.path.isfile(path):
+                return path
+            tried.append(path)
+    raise ImportError("the compiled SSW library was not found (tried %s); build it with 'python setup.py build_ext --inplace' or set %s to its path" % (str.join(", ", tried), LIBRARY_ENV))
+
 def load_ssw_library():
-    mod_path = os.path.split(__file__)[0]
-    search_path = os.path.join(mod_path, "..")
-    libname = "_libssw"
-    for (root, dirs, files) in os.walk(search_path):
-        for fn in files:
-            if fn.lower().startswith(libname) and fn.lower().endswith(".so"):
-                libpath = os.path.join(root, fn)
-                return cdll.LoadLibrary(libpath)
-    return cdll.LoadLibrary(libname)
+    return cdll.LoadLibrary(find_ssw_library())
 
 # load our library
 libssw = load_ssw_library()
 
+# the compiled binding, when it was built: sswobj aligns through it in one
+# call per alignment, and through the ctypes functions below otherwise
+try:
+    from . import _sswext as extension
+except ImportError:
+    extension = None
+
 # Types
 class AlignmentResult(Structure):
     _fields_ = [
@@ -33,12 +62,36 @@ class AlignmentResult(Structure):
 ssw_profile_p = c_void_p
 matrix_type = c_int8
 symbol_type = c_int8
+symbol_p = POINTER(symbol_type)
+
+def symbol_pointer(buf):
+    # int8_t* straight into the memory of a buffer protocol object; only
+    # read-only buffers other than bytes have to be copied to get there
+    if isinstance(buf, bytes):
+        return cast(c_char_p(buf), symbol_p)
+    view = memoryview(buf)
+    if view.nbytes == 0:
+        return cast((symbol_type * 1)(), symbol_p)
+    try:
+        return cast((c_char * view.nbytes).from_buffer(buf), symbol_p)
+    except (TypeError, ValueError):
+        return cast(c_char_p(view.tobytes()), symbol_p)
 
 # ssw_init method
 ssw_profile_init = libssw.ssw_init
 ssw_profile_init.argtypes = [POINTER(c_int8), c_int32, POINTER(c_int8), c_int32, c_int8]
 ssw_profile_init.restype = ssw_profile_p
 
+# ssw_score_size function
+ssw_score_size = libssw.ssw_score_size
+ssw_score_size.argtypes = [c_int32, POINTER(c_int8), c_int32]
+ssw_score_size.restype = c_int8
+
+# ssw_profile_widths function
+ssw_profile_widths = libssw.ssw_profile_widths
+ssw_profile_widths.argtypes = [ssw_profile_p]
+ssw_profile_widths.restype = c_int32
+
 # init_destroy function
 ssw_profile_del = libssw.init_destroy
 ssw_profile_del.argtypes =  [ssw_profile_p]
@@ -49,6 +102,21 @@ ssw_align_init = libssw.ssw_align
 ssw_align_init.argtypes = [ssw_profile_p, POINTER(c_int8), c_int32, c_uint8, c_uint8, c_uint8, c_uint16, c_int32, c_int32]
 ssw_align_init.restype = POINTER(AlignmentResult)
 
+# ssw_traceback function
+ssw_traceback = libssw.ssw_traceback
+ssw_traceback.argtypes = [ssw_profile_p, POINTER(c_int8), c_uint8, c_uint8, c_uint8, c_uint16, c_int32, c_int32, POINTER(AlignmentResult)]
+ssw_traceback.restype = c_int32
+
+# ssw_score_refs function
+ssw_score_refs = libssw.ssw_score_refs
+ssw_score_refs.argtypes = [ssw_profile_p, symbol_p, POINTER(c_int64), c_int32, c_uint8, c_uint8, c_int32, POINTER(AlignmentResult)]
+ssw_score_refs.restype = c_int32
+
+# ssw_align_banded function
+ssw_align_banded = libssw.ssw_align_banded
+ssw_align_banded.argtypes = [symbol_p, c_int32, symbol_p, c_int32, POINTER(c_int8), c_int32, c_uint8, c_uint8, c_int32, c_int32, c_uint8, c_uint16, c_int32, c_int32, POINTER(c_int32)]
+ssw_align_banded.restype = POINTER(AlignmentResult)
+
 # align_destroy function
 ssw_align_del = libssw.align_destroy
 ssw_align_del.argtypes = [POINTER(AlignmentResult)]
@@ -64,8 +132,151 @@ cigar_int_to_op = libssw.cigar_int_to_op
 cigar_int_to_op.argtypes = [c_uint32]
 cigar_int_to_op.restype = c_char
 
+# mark_mismatch function
+mark_mismatch = libssw.mark_mismatch
+mark_mismatch.argtypes = [c_int32, c_int32, c_int32, POINTER(c_int8), POINTER(c_int8), c_int32, POINTER(POINTER(c_uint32)), POINTER(c_int32)]
+mark_mismatch.restype = c_int32
+
+# mismatch_info function
+mismatch_info = libssw.mismatch_info
+mismatch_info.argtypes = [c_int32, c_int32, POINTER(c_int8), POINTER(c_int8), POINTER(c_uint32), c_int32, c_char_p, c_int32, c_char_p, POINTER(c_uint32), POINTER(c_int32), c_char_p, POINTER(c_int32)]
+mismatch_info.restype = c_int32
+
+# ssw_score_batch function
+ssw_score_batch = libssw.ssw_score_batch
+ssw_score_batch.argtypes = [POINTER(symbol_p), POINTER(c_int32), POINTER(symbol_p), POINTER(c_int32), c_int32, POINTER(c_int8), c_int32, c_uint8, c_uint8, c_int32, POINTER(AlignmentResult)]
+ssw_score_batch.restype = c_int32
+
+# ssw_kmers function
+ssw_kmers = libssw.ssw_kmers
+ssw_kmers.argtypes = [symbol_p, c_int32, POINTER(c_int8), c_int32, POINTER(c_uint64)]
+ssw_kmers.restype = c_int32
+
+# ssw_kmer_sort function
+ssw_kmer_sort = libssw.ssw_kmer_sort
+ssw_kmer_sort.argtypes = [POINTER(c_uint64), c_int32]
+ssw_kmer_sort.restype = c_int32
+
+# ssw_kmer_shared function
+ssw_kmer_shared = libssw.ssw_kmer_shared
+ssw_kmer_shared.argtypes = [POINTER(c_uint64), c_int32, POINTER(c_uint64), c_int32, c_int32, POINTER(c_uint8)]
+ssw_kmer_shared.restype = c_int32
+
+# ssw_kmer_scan function
+ssw_kmer_scan = libssw.ssw_kmer_scan
+ssw_kmer_scan.argtypes = [POINTER(c_uint64), c_int32, symbol_p, c_int32, POINTER(c_int8), c_int32, c_int32]
+ssw_kmer_scan.restype = c_int32
+
+KMER_AMBIGUOUS = (1 << 64) - 1
+
+# ssw_set_simd function
+ssw_set_simd = libssw.ssw_set_simd
+ssw_set_simd.argtypes = [c_int32]
+ssw_set_simd.restype = c_int32
+
+# ssw_get_simd function
+ssw_get_simd = libssw.ssw_get_simd
+ssw_get_simd.argtypes = []
+ssw_get_simd.restype = c_int32
+
+# ssw_simd_supported function
+ssw_simd_supported = libssw.ssw_simd_supported
+ssw_simd_supported.argtypes = [c_int32]
+ssw_simd_supported.restype = c_int32
+
+# ssw_simd_name function
+ssw_simd_name = libssw.ssw_simd_name
+ssw_simd_name.argtypes = [c_int32]
+ssw_simd_name.restype = c_char_p
+
+# ssw_stats_enable function
+ssw_stats_enable = libssw.ssw_stats_enable
+ssw_stats_enable.argtypes = [c_int32]
+ssw_stats_enable.restype = c_int32
+
+# ssw_stats function
+ssw_stats = libssw.ssw_stats
+ssw_stats.argtypes = [POINTER(c_uint64), c_int32]
+ssw_stats.restype = c_int32
+
+# ssw_stats_reset function
+ssw_stats_reset = libssw.ssw_stats_reset
+ssw_stats_reset.argtypes = []
+ssw_stats_reset.restype = None
+
+# ssw_stat_name function
+ssw_stat_name = libssw.ssw_stat_name
+ssw_stat_name.argtypes = [c_int32]
+ssw_stat_name.restype = c_char_p
+
+# kernel instruction sets, narrowest first; the SSW_SIMD environment
+# variable (sse2, avx2 or avx512) caps the choice made from the CPU
+SIMD_SSE2 = 0
+SIMD_AVX2 = 1
+SIMD_AVX512 = 2
+
+def simd_levels():
+    # names of the kernel levels this CPU and build can run
+    levels = []
+    level = 0
+    while ssw_simd_name(level) is not None:
+        if ssw_simd_supported(level):
+            levels.append(ssw_simd_name(level).decode("ascii"))
+        level += 1
+    return levels
+
+def get_simd():
+    return ssw_simd_name(ssw_get_simd()).decode("ascii")
+
+def set_simd(name=None):
+    # kernels for the query profiles created from now on; None goes back
+    # to the widest supported (or the one SSW_SIMD names)
+    if name is None:
+        level = -1
+    else:
+        names = [ssw_simd_name(level).decode("ascii") for level in range(SIMD_AVX512 + 1) if ssw_simd_name(level) is not None]
+        if name not in names:
+            raise ValueError("unknown SIMD level %r, expected one of %s" % (name, str.join(", ", names)))
+        level = names.index(name)
+    if ssw_set_simd(level) < 0:
+        raise ValueError("this CPU does not support %s" % name)
+    if extension is not None:
+        extension.set_simd(level)
+    return get_simd()
+
+def enable_native_stats(on=True):
+    # the native counters are process wide; returns whether they were on
+    was = ssw_stats_enable(int(bool(on)))
+    if extension is not None:
+        extension.stats_enable(int(bool(on)))
+    return bool(was)
+
+def native_stats():
+    # the native counters by name, summed over the library and the
+    # compiled binding (which has its own copy)
+    count = ssw_stats(None, 0)
+    counts = (c_uint64 * count)()
+    ssw_stats(counts, count)
+    counts = list(counts)
+    if extension is not None:
+        counts = [total + more for (total, more) in zip(counts, extension.stats())]
+    return dict((ssw_stat_name(idx).decode("ascii"), counts[idx]) for idx in range(count))
+
+def reset_native_stats():
+    ssw_stats_reset()
+    if extension is not None:
+        extension.stats_reset()
+
 # flags
 FLAG_BEST_POS = 0
 FLAG_FILTER_SCORE = 1
 FLAG_FILTER_DISTANCE = 2
 FLAG_BUILD_CIGAR = 3
+
+# ssw_align flag bits; when none are set only the scores and the
+# ending positions are computed (no reverse pass, no traceback)
+FLAG_MASK_SCORE_ONLY = 0x00
+FLAG_MASK_BUILD_CIGAR = 0x01
+FLAG_MASK_FILTER_SCORE = 0x02
+FLAG_MASK_FILTER_DISTANCE = 0x04
+FLAG_MASK_BEST_POS = 0x08
@@ -0,0 +1,102 @@
+import heapq
+from collections import namedtuple
+from six.moves import range
+from . import fastx
+from . import libssw
+from . sswobj import Aligner, EncodedSequence, _byte_view
+
+__all__ = (
+    "PanelHit",
+    "ReferencePanel",
+)
+
+# score2 is the best score the query reaches anywhere else: elsewhere in
+# the same reference (the alignment's own score2) or in any other reference
+# of the panel.  A hit is ambiguous when score2 is within the search margin
+# of its score.
+PanelHit = namedtuple("PanelHit", ("name", "index", "alignment", "score2", "ambiguous"))
+
+class ReferencePanel(object):
+    # Many (short) references searched together, such as amplicon or
+    # barcode panels.  The references are encoded once into one buffer with
+    # an offset table, and a search profiles the query once and scores it
+    # against every reference in one native call per strand.
+    def __init__(self, references, aligner=None):
+        # references are (name, sequence) pairs or a FASTA file name
+        self.aligner = aligner if aligner is not None else Aligner()
+        if isinstance(references, str):
+            references = fastx.read_fastx(references)
+        self.names = []
+        codes = bytearray()
+        offsets = [0]
+        for record in references:
+            (name, sequence) = (record[0], record[1])
+            try:
+                encoded = self.aligner.encode(sequence)
+            except ValueError as err:
+                raise ValueError("reference '%s': %s" % (name, err))
+            self.names.append(name)
+            codes += _byte_view(encoded.codes)
+            offsets.append(len(codes))
+        self._codes = codes
+        self._pointer = libssw.symbol_pointer(codes)
+        self.offsets = (libssw.c_int64 * len(offsets))(*offsets)
+        self._index = dict((name, idx) for (idx, name) in enumerate(self.names))
+        view = memoryview(codes)
+        self._references = []
+        for idx in range(len(self.names)):
+            reference = EncodedSequence.__new__(EncodedSequence)
+            (reference.sequence, reference.matrix) = (None, self.aligner.matrix)
+            reference._set_codes(view[offsets[idx]:offsets[idx + 1]])
+            self._references.append(reference)
+
+    def __len__(self):
+        return len(self.names)
+
+    def __iter__(self):
+        return iter(self.names)
+
+    def __contains__(self, name):
+        return name in self._index
+
+    def __getitem__(self, key):
+        # the encoded reference, by name or by position
+        if not isinstance(key, int):
+            key = self._index[key]
+        return self._references[key]
+
+    def scores(self, profiles):
+        # (score, profile index) of the best strand for every reference
+        aligner = self.aligner
+        count = len(self.names)
+        best = [(0, 0)] * count
+        results = (libssw.AlignmentResult * count)()
+        mask_length = max(15, len(profiles[0]) // 2)
+        for (strand, profile) in enumerate(profiles):
+            if count and libssw.ssw_score_refs(profile._profile, self._pointer, self.offsets, count, aligner.gap_open, aligner.gap_extend, mask_length, results) != 0:
+                raise RuntimeError("SSW alignment failed")
+            for idx in range(count):
+                if results[idx].score > best[idx][0]:
+                    best[idx] = (results[idx].score, strand)
+        return best
+
+    def search(self, query, k=5, min_score=None, revcomp=True, strand=None, margin=0):
+        # The k best scoring references, best first (ties in panel order),
+        # as PanelHits with their full alignments.  References scoring 0 or
+        # below min_score are left out.
+        aligner = self.aligner
+        strand = aligner._strand(strand, revcomp)
+        with aligner.profile(query) as profile:
+            profiles = {"+": [profile], "-": [profile.reverse_complement()], "both": [profile, profile.reverse_complement()]}[strand]
+            best = self.scores(profiles)
+            ranked = heapq.nlargest(max(k, 2), range(len(best)), key=lambda idx: (best[idx][0], -idx))
+            hits = []
+            for (rank, idx) in enumerate(ranked[:k]):
+                (score, strand_idx) = best[idx]
+                if score <= 0 or (min_score is not None and score < min_score):
+                    break
+                alignment = aligner.align_profile(profiles[strand_idx], self._references[idx], strand="+")
+                others = [best[other][0] for other in ranked[:2] if other != idx]
+                score2 = max([alignment.score2] + others)
+                hits.append(PanelHit(self.names[idx], idx, alignment, score2, score2 >= alignment.score - margin))
+        return hits
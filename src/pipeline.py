@@ -0,0 +1,172 @@
+import sys
+import itertools
+import collections
+import multiprocessing
+from . import fastx
+from . import refstore
+from . sswobj import Aligner
+
+__all__ = (
+    "SamWriter",
+    "AlignmentPipeline",
+    "align_reads",
+)
+
+SAM_FLAG_UNMAPPED = 0x4
+SAM_FLAG_REVERSE = 0x10
+SAM_MAPQ_UNAVAILABLE = 255
+
+class SamWriter(object):
+    def __init__(self, handle, references, program="ssw", command_line=None):
+        self.handle = handle
+        self.references = references
+        self.program = program
+        self.command_line = command_line
+
+    def write_header(self):
+        lines = ["@HD\tVN:1.6\tSO:unsorted"]
+        for (name, sequence) in self.references:
+            lines.append("@SQ\tSN:%s\tLN:%d" % (name, len(sequence)))
+        program = "@PG\tID:%s\tPN:%s" % (self.program, self.program)
+        if self.command_line:
+            program += "\tCL:%s" % self.command_line
+        lines.append(program)
+        self.handle.write(str.join("\n", lines) + "\n")
+
+    def write(self, records):
+        # records arrive as preformatted blocks of SAM lines
+        self.handle.write(records)
+
+class _ReadAligner(object):
+    # alignment state held by each worker: one Aligner and the references,
+    # encoded once when the worker starts
+    def __init__(self, aligner, references, revcomp=True, min_score=0):
+        self.aligner = aligner
+        self.references = [(name, aligner.encode(sequence)) for (name, sequence) in references]
+        self.revcomp = revcomp
+        self.min_score = min_score
+
+    def align_record(self, record):
+        (name, sequence, quality) = record
+        best = None
+        if sequence:
+            try:
+                query = self.aligner.encode(sequence)
+            except ValueError as err:
+                raise ValueError("read '%s': %s" % (name, err))
+            strand = "both" if self.revcomp else "+"
+            with self.aligner.profile(query) as profile:
+                for (reference_name, reference) in self.references:
+                    alignment = self.aligner.align_profile(profile, reference, strand=strand)
+                    if best is None or alignment.score > best[0].score:
+                        best = (alignment, reference_name)
+        return sam_record(record, best, self.min_score)
+
+    def align_chunk(self, chunk):
+        return str.join("", [self.align_record(record) for record in chunk])
+
+def sam_record(record, hit, min_score=0):
+    (name, sequence, quality) = record
+    quality = quality or "*"
+    if hit is None or hit[0].score <= 0 or hit[0].score < min_score:
+        fields = (name, SAM_FLAG_UNMAPPED, "*", 0, 0, "*", "*", 0, 0, sequence or "*", quality)
+        return str.join("\t", map(str, fields)) + "\n"
+    (alignment, reference_name) = hit
+    flag = 0
+    if alignment.strand == "-":
+        flag |= SAM_FLAG_REVERSE
+        sequence = alignment.query
+        quality = quality[::-1]
+    fields = (
+        name, flag, reference_name, alignment.reference_begin + 1, SAM_MAPQ_UNAVAILABLE,
+        alignment.cigar, "*", 0, 0, sequence, quality,
+        "AS:i:%d" % alignment.score, "XS:i:%d" % alignment.score2,
+        "NM:i:%d" % alignment.nm, "MD:Z:%s" % alignment.md,
+    )
+    return str.join("\t", map(str, fields)) + "\n"
+
+_worker = None
+
+def _init_worker(aligner, references, revcomp, min_score):
+    global _worker
+    _worker = _ReadAligner(aligner, references, revcomp, min_score)
+
+def _align_chunk(chunk):
+    return _worker.align_chunk(chunk)
+
+class AlignmentPipeline(object):
+    # Streams reads through a pool of worker processes and writes SAM.
+    # Reads are pulled lazily and at most max_pending chunks are in flight
+    # at once, so memory use does not depend on the size of the input.
+    def __init__(self, references, aligner=None, workers=None, chunk_size=256, max_pending=None, revcomp=True, min_score=0):
+        self.references = [(name, sequence) for (name, sequence) in references]
+        self.aligner = aligner if aligner is not None else Aligner()
+        self.workers = workers if workers is not None else multiprocessing.cpu_count()
+        self.chunk_size = chunk_size
+        self.max_pending = max_pending if max_pending is not None else self.workers * 2
+        self.revcomp = revcomp
+        self.min_score = min_score
+
+    def _chunks(self, records):
+        records = iter(records)
+        while True:
+            chunk = [tuple(record) for record in itertools.islice(records, self.chunk_size)]
+            if not chunk:
+                break
+            yield chunk
+
+    def _initargs(self):
+        return (self.aligner, self.references, self.revcomp, self.min_score)
+
+    def results(self, records):
+        # blocks of SAM lines, in input order
+        chunks = self._chunks(records)
+        if self.workers <= 1:
+            worker = _ReadAligner(*self._initargs())
+            for chunk in chunks:
+                yield worker.align_chunk(chunk)
+            return
+        pool = multiprocessing.Pool(self.workers, _init_worker, self._initargs())
+        try:
+            pending = collections.deque()
+            for chunk in chunks:
+                if len(pending) >= self.max_pending:
+                    yield pending.popleft().get()
+                pending.append(pool.apply_async(_align_chunk, (chunk,)))
+            while pending:
+                yield pending.popleft().get()
+            pool.close()
+        finally:
+            pool.terminate()
+            pool.join()
+
+    def run(self, records, output, header=True, command_line=None):
+        writer = SamWriter(output, self.references, command_line=command_line)
+        if header:
+            writer.write_header()
+        for block in self.results(records):
+            writer.write(block)
+
+def align_reads(reference, reads, output=None, **kw):
+    # reference and reads are FASTA/FASTQ file names (optionally gzipped)
+    # or iterables of records; output is a file name or handle.  An encoded
+    # reference file is memory mapped, and the worker processes map it too
+    # rather than each getting a copy of the reference.
+    if isinstance(reference, str):
+        if refstore.is_reference_store(reference):
+            aligner = kw.get("aligner")
+            reference = refstore.ReferenceStore(reference, aligner.matrix if aligner is not None else None).items()
+        else:
+            reference = fastx.read_fastx(reference)
+    references = [(record[0], record[1]) for record in reference]
+    if isinstance(reads, str):
+        reads = fastx.read_fastx(reads)
+    command_line = kw.pop("command_line", None)
+    pipeline = AlignmentPipeline(references, **kw)
+    if output is None or output == "-":
+        pipeline.run(reads, sys.stdout, command_line=command_line)
+    elif isinstance(output, str):
+        with open(output, "w") as fh:
+            pipeline.run(reads, fh, command_line=command_line)
+    else:
+        pipeline.run(reads, output, command_line=command_line)
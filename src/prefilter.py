@@ -0,0 +1,316 @@
+import re
+import itertools
+import math
+import threading
+from collections import OrderedDict
+from . import iupac
+from . import libssw
+from . cache import codes_digest, _codes_bytes
+
+__all__ = (
+    "KmerPrefilter",
+)
+
+DEFAULT_KMER = 8
+# ambiguous k-mers with more concrete spellings than this are not spelled out
+DEFAULT_MAX_EXPANSIONS = 64
+# references whose k-mers are kept, by content
+DEFAULT_MAX_REFERENCES = 256
+
+BASES = "ACGT"
+
+class _MatrixTable(object):
+    # What the prefilter needs to know about a score matrix: the bases each
+    # symbol code stands for (a bit mask over ACGT), and the scores that
+    # bound an alignment.  Symbols outside the nucleotide table, and pairs
+    # the matrix scores as matches although their bases differ, stand for
+    # every base, so that any column the matrix scores positive is made of
+    # symbols that share a base.
+    def __init__(self, matrix):
+        alphabet = matrix.alphabet
+        n = len(alphabet)
+        scores = list(matrix.iter_matrix())
+        masks = []
+        for symbol in alphabet:
+            matches = iupac.NucleotideTable.get(symbol.upper(), {}).get("matches", ())
+            mask = 0
+            for base in matches:
+                mask |= 1 << BASES.index(base)
+            masks.append(mask or 0xf)
+        for ref in range(n):
+            for query in range(n):
+                if scores[ref * n + query] > 0 and not masks[ref] & masks[query]:
+                    masks[ref] = masks[query] = 0xf
+        self.masks = masks
+        self.bases = [tuple(base for base in range(4) if mask & (1 << base)) for mask in masks]
+        self.match = max(scores)
+        nonpositive = [score for score in scores if score <= 0]
+        self.mismatch = -max(nonpositive) if nonpositive else None
+        # the base of each code for ssw_kmers, -1 for ambiguous ones, and a
+        # pattern matching the ambiguous codes (None when there are none)
+        self.base_codes = (libssw.c_int8 * n)(*[bases[0] if len(bases) == 1 else -1 for bases in self.bases])
+        ambiguous = [code for code in range(n) if len(self.bases[code]) > 1]
+        self.ambiguous = re.compile(b"[" + b"".join(re.escape(bytes(bytearray([code]))) for code in ambiguous) + b"]") if ambiguous else None
+
+class KmerPrefilter(object):
+    # Skips Smith-Waterman for query / reference pairs that cannot score
+    # min_score.  The positive columns of an alignment come in runs split
+    # by breaks (mismatches or gaps), each of which costs at least the
+    # smallest mismatch penalty or the gap open penalty.  A run of r
+    # columns holds r - k + 1 query k-mers that also occur in the reference
+    # (up to IUPAC ambiguity), so an alignment scoring min_score shares at
+    # least a number of k-mers that only depends on the query length and
+    # the scoring.  Pairs sharing fewer are pruned: they come back
+    # unaligned, with score 0.  The bound only bites when min_score asks
+    # for high identity, roughly above (1 - 1/k) of a perfect score;
+    # below it nothing is pruned.
+    def __init__(self, min_score, k=DEFAULT_KMER, max_expansions=DEFAULT_MAX_EXPANSIONS, max_references=DEFAULT_MAX_REFERENCES):
+        if k < 1 or k > 31:
+            raise ValueError("k must be between 1 and 31")
+        self.min_score = min_score
+        self.k = k
+        self.max_expansions = max_expansions
+        self.max_references = max_references
+        self.checked = 0
+        self.pruned = 0
+        self._lock = threading.Lock()
+        self._tables = {}
+        self._thresholds = {}
+        self._references = OrderedDict()
+        self._seen = OrderedDict()
+
+    def __getstate__(self):
+        return (self.min_score, self.k, self.max_expansions, self.max_references)
+
+    def __setstate__(self, state):
+        self.__init__(*state)
+
+    def stats(self):
+        return {"checked": self.checked, "pruned": self.pruned}
+
+    def reset(self):
+        with self._lock:
+            self.checked = 0
+            self.pruned = 0
+
+    def _table(self, matrix):
+        key = (tuple(matrix.alphabet), bytes(bytearray(matrix._matrix)))
+        table = self._tables.get(key)
+        if table is None:
+            table = self._tables[key] = _MatrixTable(matrix)
+            table.key = key
+        return table
+
+    def threshold(self, aligner, length):
+        # the fewest shared k-mers an alignment of a query of this length
+        # scoring min_score can have, or None if no alignment can
+        table = self._table(aligner.matrix)
+        key = (table.key, aligner.gap_open, length)
+        if key not in self._thresholds:
+            self._thresholds[key] = _min_shared(length, self.min_score, self.k, table.match, table.mismatch, aligner.gap_open)
+        return self._thresholds[key]
+
+    def passes(self, aligner, query, reference, strand="both"):
+        # query and reference are encoded sequences; True if the pair may
+        # score min_score on the strand (or either strand, for "both")
+        needed = self.threshold(aligner, len(query))
+        passed = needed is not None
+        if passed and needed > 0:
+            table = self._table(aligner.matrix)
+            kmers = self._reference_kmers(reference, table, build=False)
+            queries = {"+": [query], "-": [query.reverse_complement()], "both": [query, query.reverse_complement()]}[strand]
+            passed = any(self._count(strand_query, reference, kmers, table, needed) >= needed for strand_query in queries)
+        with self._lock:
+            self.checked += 1
+            if not passed:
+                self.pruned += 1
+        return passed
+
+    def shared(self, aligner, query, reference):
+        # number of query positions whose k-mer occurs in the reference
+        table = self._table(aligner.matrix)
+        return self._count(query, reference, self._reference_kmers(reference, table, build=False), table)
+
+    def _count(self, query, reference, kmers, table, needed=None):
+        # shared k-mers, looked up in the reference's k-mers when they are
+        # at hand and otherwise by reading through the reference once
+        if kmers is None:
+            if not self._ambiguous_windows(query, table):
+                (query_kmers, count) = self._kmers(query, table)
+                shared = libssw.ssw_kmer_scan(query_kmers, count, reference, len(reference), table.base_codes, self.k, needed or 0)
+                if shared < 0:
+                    raise MemoryError("k-mer scan failed")
+                return shared
+            kmers = self._reference_kmers(reference, table)
+        return self._shared(query, kmers, table, needed)
+
+    def _window(self, codes, start, table):
+        # the packed spellings of the ambiguous k-mer at start, or its masks
+        # when it has too many spellings to list
+        window = bytearray(codes[start:start + self.k])
+        choices = [table.bases[code] for code in window]
+        count = 1
+        for bases in choices:
+            count *= len(bases)
+        if count > self.max_expansions:
+            return tuple(table.masks[code] for code in window)
+        return [_pack(spelling) for spelling in itertools.product(*choices)]
+
+    def _ambiguous_windows(self, encoded, table):
+        # starts of the k-mers that hold a symbol standing for more than one
+        # base, found with a regular expression over the codes
+        if table.ambiguous is None or len(encoded) < self.k:
+            return []
+        starts = set()
+        last = max(0, len(encoded) - self.k)
+        for match in table.ambiguous.finditer(_codes_bytes(encoded)):
+            pos = match.start()
+            starts.update(range(max(0, pos - self.k + 1), min(pos, last) + 1))
+        return sorted(starts)
+
+    def _kmers(self, encoded, table, extra=0):
+        # the packed k-mers of an encoded sequence, from the library, in an
+        # array with room for extra more
+        count = max(0, len(encoded) - self.k + 1)
+        kmers = (libssw.c_uint64 * (count + extra))()
+        if count:
+            libssw.ssw_kmers(encoded, len(encoded), table.base_codes, self.k, kmers)
+        return (kmers, count)
+
+    def _reference_kmers(self, reference, table, build=True):
+        # (sorted k-mer array, its length, masks of the k-mers too ambiguous
+        # to spell out) of an encoded reference.  Kept for the most recent
+        # references by content, so equal references encoded separately
+        # share one entry.  Sorting costs more than reading through the
+        # reference once, so without build a reference seen for the first
+        # time gets None instead (unless it is ambiguous, which the scan
+        # does not handle), and is only indexed when it comes back.
+        key = (codes_digest(reference), self.k, self.max_expansions, table.key)
+        with self._lock:
+            cached = self._references.pop(key, None)
+            if cached is not None:
+                self._references[key] = cached
+                return cached
+            if not build and key not in self._seen:
+                self._seen[key] = True
+                while len(self._seen) > 4 * self.max_references:
+                    self._seen.popitem(last=False)
+                build = bool(self._ambiguous_windows(reference, table))
+                if not build:
+                    return None
+        spellings = []
+        wild = set()
+        for start in self._ambiguous_windows(reference, table):
+            window = self._window(reference.codes, start, table)
+            if isinstance(window, tuple):
+                wild.add(window)
+            else:
+                spellings.extend(window)
+        (kmers, count) = self._kmers(reference, table, len(spellings))
+        kmers[count:count + len(spellings)] = spellings
+        result = (kmers, libssw.ssw_kmer_sort(kmers, count + len(spellings)), tuple(wild))
+        with self._lock:
+            self._references[key] = result
+            while len(self._references) > self.max_references:
+                self._references.popitem(last=False)
+        return result
+
+    def _shared(self, query, kmers, table, needed=None):
+        # query k-mers that occur in the reference; stops counting once
+        # needed is reached
+        (reference_kmers, reference_count, wild) = kmers
+        (query_kmers, count) = self._kmers(query, table)
+        ambiguous = self._ambiguous_windows(query, table)
+        if not ambiguous and not wild:
+            return libssw.ssw_kmer_shared(query_kmers, count, reference_kmers, reference_count, needed or 0, None)
+        # the library counts the concrete k-mers found, the rest are
+        # looked at here
+        found = (libssw.c_uint8 * count)()
+        shared = libssw.ssw_kmer_shared(query_kmers, count, reference_kmers, reference_count, 0, found)
+        ambiguous = set(ambiguous)
+        for pos in range(count):
+            if found[pos]:
+                continue
+            if pos in ambiguous:
+                window = self._window(query.codes, pos, table)
+                if isinstance(window, tuple):
+                    # too ambiguous to look up, so it counts
+                    hit = True
+                else:
+                    spellings = (libssw.c_uint64 * len(window))(*window)
+                    hit = libssw.ssw_kmer_shared(spellings, len(window), reference_kmers, reference_count, 1, None) > 0 or any(self._matches_wild(spelling, wild) for spelling in window)
+            else:
+                hit = self._matches_wild(query_kmers[pos], wild)
+            if hit:
+                shared += 1
+        return shared
+
+    def _matches_wild(self, value, wild):
+        if not wild:
+            return False
+        k = self.k
+        masks = [1 << ((value >> (2 * (k - 1 - idx))) & 3) for idx in range(k)]
+        for window in wild:
+            if all(mask & other for (mask, other) in zip(masks, window)):
+                return True
+        return False
+
+def _pack(bases):
+    value = 0
+    for base in bases:
+        value = (value << 2) | base
+    return value
+
+def _min_shared(length, min_score, k, match, mismatch, gap_open):
+    # Lower bound on the query k-mers shared by any alignment of a query of
+    # this length scoring at least min_score, from the linear relaxation
+    # of: m positive columns (at most match each) in x + y + 1 runs, split
+    # by x breaks that use up query positions (mismatches, insertions;
+    # costing at least the smaller of the mismatch and gap open penalties)
+    # and y that do not (deletions, costing at least gap_open).  Minimise
+    # m - (x + y + 1)(k - 1), the shared k-mers when every run is counted.
+    # None if no alignment can score min_score at all.
+    if min_score <= 0:
+        return 0
+    if match <= 0:
+        return None
+    used = gap_open if mismatch is None else min(mismatch, gap_open)
+    # rows of a . (m, x, y) >= b
+    constraints = [
+        ((match, -used, -gap_open), min_score),
+        ((-1, -1, 0), -length),
+        ((1, -1, -1), 1),
+        ((0, 1, 0), 0),
+        ((0, 0, 1), 0),
+    ]
+    best = None
+    for rows in itertools.combinations(constraints, 3):
+        point = _solve3([row[0] for row in rows], [row[1] for row in rows])
+        if point is None:
+            continue
+        if any(sum(a * v for (a, v) in zip(row, point)) < bound - 1e-9 for (row, bound) in constraints):
+            continue
+        (m, x, y) = point
+        value = m - (x + y + 1) * (k - 1)
+        if best is None or value < best:
+            best = value
+    if best is None:
+        return None
+    return max(0, int(math.ceil(best - 1e-9)))
+
+def _solve3(a, b):
+    # a v = b for a 3x3 system, by Cramer's rule; None when singular
+    def det(m):
+        return (m[0][0] * (m[1][1] * m[2][2] - m[1][2] * m[2][1])
+            - m[0][1] * (m[1][0] * m[2][2] - m[1][2] * m[2][0])
+            + m[0][2] * (m[1][0] * m[2][1] - m[1][1] * m[2][0]))
+    d = float(det(a))
+    if d == 0:
+        return None
+    point = []
+    for col in range(3):
+        m = [list(row) for row in a]
+        for row in range(3):
+            m[row][col] = b[row]
+        point.append(det(m) / d)
+    return point
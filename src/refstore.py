@@ -0,0 +1,139 @@
+import mmap
+import struct
+from . import fastx
+from . sswobj import EncodedSequence, NucleotideScoreMatrix
+
+__all__ = (
+    "ReferenceStore",
+    "StoredSequence",
+    "write_reference_store",
+    "is_reference_store",
+)
+
+# An encoded reference file: a header, the alphabet, the symbol codes of
+# every contig back to back, and a table of (offset, length, name) for the
+# contigs at the end, so contigs can be written out one at a time.
+STORE_MAGIC = b"SSWREF01"
+# magic, alphabet length, contig count, table offset
+STORE_HEADER = struct.Struct("<8sIIQ")
+# contig offset, contig length, name length, then the name in utf-8
+CONTIG_ENTRY = struct.Struct("<QQI")
+
+def is_reference_store(path):
+    try:
+        with open(path, "rb") as fh:
+            return fh.read(len(STORE_MAGIC)) == STORE_MAGIC
+    except (IOError, OSError):
+        return False
+
+def write_reference_store(path, records, matrix=None):
+    # records are (name, sequence) pairs, or a FASTA file name; each
+    # contig is encoded in the matrix symbol space (the nucleotide alphabet
+    # by default).  Returns the number of contigs written.
+    matrix = matrix if matrix is not None else NucleotideScoreMatrix()
+    if isinstance(records, str):
+        records = fastx.read_fastx(records)
+    alphabet = str.join("", matrix.alphabet).encode("latin-1")
+    contigs = []
+    with open(path, "wb") as fh:
+        fh.write(STORE_HEADER.pack(STORE_MAGIC, len(alphabet), 0, 0))
+        fh.write(alphabet)
+        for record in records:
+            (name, sequence) = (record[0], record[1])
+            try:
+                codes = matrix.convert_sequence_to_ints(sequence)
+            except ValueError as err:
+                raise ValueError("contig '%s': %s" % (name, err))
+            contigs.append((fh.tell(), len(codes), name))
+            fh.write(codes)
+        table_offset = fh.tell()
+        for (offset, length, name) in contigs:
+            name = name.encode("utf-8")
+            fh.write(CONTIG_ENTRY.pack(offset, length, len(name)))
+            fh.write(name)
+        fh.seek(0)
+        fh.write(STORE_HEADER.pack(STORE_MAGIC, len(alphabet), len(contigs), table_offset))
+    return len(contigs)
+
+class StoredSequence(EncodedSequence):
+    # An encoded contig (or a slice of one) that lives in the memory map
+    # of a ReferenceStore.  The codes are handed to ssw_align in place, and
+    # pickling only sends where the contig is, so worker processes map the
+    # same file instead of receiving a copy.
+    def __init__(self, store, name, start, stop):
+        self.sequence = None
+        self.matrix = store.matrix
+        self._location = (store.path, name, start, stop)
+        (offset, length) = store.contigs[name]
+        self._set_codes(store._view[offset + start:offset + stop])
+
+    def __reduce__(self):
+        (path, name, start, stop) = self._location
+        return (_stored_sequence, (path, self.matrix, name, start, stop))
+
+# stores opened by unpickled StoredSequences, one per file and process
+_stores = {}
+
+def _stored_sequence(path, matrix, name, start, stop):
+    store = _stores.get(path)
+    if store is None or not (store.matrix == matrix):
+        store = _stores[path] = ReferenceStore(path, matrix)
+    return store.fetch(name, start, stop)
+
+class ReferenceStore(object):
+    # Read-only view of an encoded reference file.  The file is mapped
+    # copy-on-write: nothing ever writes to it, so every process that opens
+    # it shares the one copy in the page cache, while ctypes can still take
+    # a pointer straight into the mapping.
+    def __init__(self, path, matrix=None):
+        self.path = path
+        with open(path, "rb") as fh:
+            header = fh.read(STORE_HEADER.size)
+            if len(header) != STORE_HEADER.size or header[:len(STORE_MAGIC)] != STORE_MAGIC:
+                raise ValueError("%s is not an encoded reference file" % path)
+            (magic, alphabet_length, contig_count, table_offset) = STORE_HEADER.unpack(header)
+            alphabet = fh.read(alphabet_length).decode("latin-1")
+            self._map = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_COPY)
+        self.matrix = matrix if matrix is not None else NucleotideScoreMatrix(alphabet=alphabet)
+        if tuple(alphabet) != tuple(self.matrix.alphabet):
+            self._map.close()
+            raise ValueError("%s is encoded with the alphabet %r, not %r" % (path, alphabet, str.join("", self.matrix.alphabet)))
+        self._view = memoryview(self._map)
+        self.names = []
+        self.contigs = {}
+        pos = table_offset
+        for idx in range(contig_count):
+            (offset, length, name_length) = CONTIG_ENTRY.unpack_from(self._map, pos)
+            pos += CONTIG_ENTRY.size
+            name = self._map[pos:pos + name_length].decode("utf-8")
+            pos += name_length
+            self.names.append(name)
+            self.contigs[name] = (offset, length)
+
+    def __len__(self):
+        return len(self.names)
+
+    def __iter__(self):
+        return iter(self.names)
+
+    def __contains__(self, name):
+        return name in self.contigs
+
+    def __getitem__(self, name):
+        return self.fetch(name)
+
+    def length(self, name):
+        return self.contigs[name][1]
+
+    def fetch(self, name, start=0, stop=None):
+        # the encoded contig, or its [start:stop) slice, without a copy
+        if name not in self.contigs:
+            raise KeyError(name)
+        length = self.contigs[name][1]
+        stop = length if stop is None else min(stop, length)
+        start = min(max(start, 0), stop)
+        return StoredSequence(self, name, start, stop)
+
+    def items(self):
+        for name in self.names:
+            yield (name, self.fetch(name))
@@ -68,11 +68,17 @@
 
 //#include <nmmintrin.h>
 #include <emmintrin.h>
+#if defined(__GNUC__) && (defined(__x86_64__) || defined(__i386__))
+/* The AVX2 and AVX-512 kernels are compiled with function target attributes and only run when the CPU has them. */
+#include <immintrin.h>
+#define SSW_WIDE_SIMD
+#endif
 #include <stdint.h>
 #include <stdlib.h>
 #include <stdio.h>
 #include <string.h>
 #include <math.h>
+#include <time.h>
 #include "ssw.h"
 
 #ifdef __GNUC__
@@ -107,14 +113,18 @@ typedef struct {
 	int32_t length;
 } cigar;
 
+typedef struct _simd_kernels simd_kernels;
+
 struct _profile{
-	__m128i* profile_byte;	// 0: none
-	__m128i* profile_word;	// 0: none
+	void* profile_byte;	// 0: none
+	void* profile_word;	// 0: none, or not built yet
+	const simd_kernels* simd;	// the kernels the profiles are laid out for
 	const int8_t* read;
 	const int8_t* mat;
 	int32_t readLen;
 	int32_t n;
 	uint8_t bias;
+	int8_t score_size;
 };
 
 /* array index is an ASCII character value from a CIGAR, 
@@ -154,26 +164,28 @@ const uint8_t encoded_ops[] = {
 	0 /* | */, 0 /* } */, 0 /* ~ */, 0 /*  */
 };
 
-/* Generate query profile rearrange query sequence & calculate the weight of match/mismatch. */
-static __m128i* qP_byte (const int8_t* read_num,
+/* Generate query profile rearrange query sequence & calculate the weight of match/mismatch.
+   lanes is the number of 8 bit values in one vector of the kernel the profile is built for. */
+static void* qP_byte (const int8_t* read_num,
 				  const int8_t* mat,
 				  const int32_t readLen,
 				  const int32_t n,	/* the edge length of the squre matrix mat */
-				  uint8_t bias) {
+				  uint8_t bias,
+				  int32_t lanes) {
 
-	int32_t segLen = (readLen + 15) / 16; /* Split the 128 bit register into 16 pieces.
-								     Each piece is 8 bit. Split the read into 16 segments.
-								     Calculat 16 segments in parallel.
+	int32_t segLen = (readLen + lanes - 1) / lanes; /* Split the register into lanes pieces.
+								     Each piece is 8 bit. Split the read into lanes segments.
+								     Calculat the segments in parallel.
 								   */
-	__m128i* vProfile = (__m128i*)malloc(n * segLen * sizeof(__m128i));
-	int8_t* t = (int8_t*)vProfile;
+	int8_t* vProfile = (int8_t*)malloc(n * segLen * lanes);
+	int8_t* t = vProfile;
 	int32_t nt, i, j, segNum;
 
 	/* Generate query profile rearrange query sequence & calculate the weight of match/mismatch */
 	for (nt = 0; LIKELY(nt < n); nt ++) {
 		for (i = 0; i < segLen; i ++) {
 			j = i;
-			for (segNum = 0; LIKELY(segNum < 16) ; segNum ++) {
+			for (segNum = 0; LIKELY(segNum < lanes) ; segNum ++) {
 				*t++ = j>= readLen ? bias : mat[nt * n + read_num[j]] + bias;
 				j += segLen;
 			}
@@ -182,403 +194,268 @@ static __m128i* qP_byte (const int8_t* read_num,
 	return vProfile;
 }
 
+/* lanes is the number of 16 bit values in one vector. */
+static void* qP_word (const int8_t* read_num,
+				  const int8_t* mat,
+				  const int32_t readLen,
+				  const int32_t n,
+				  int32_t lanes) {
+
+	int32_t segLen = (readLen + lanes - 1) / lanes;
+	int16_t* vProfile = (int16_t*)malloc(n * segLen * lanes * sizeof(int16_t));
+	int16_t* t = vProfile;
+	int32_t nt, i, j;
+	int32_t segNum;
+
+	/* Generate query profile rearrange query sequence & calculate the weight of match/mismatch */
+	for (nt = 0; LIKELY(nt < n); nt ++) {
+		for (i = 0; i < segLen; i ++) {
+			j = i;
+			for (segNum = 0; LIKELY(segNum < lanes) ; segNum ++) {
+				*t++ = j>= readLen ? 0 : mat[nt * n + read_num[j]];
+				j += segLen;
+			}
+		}
+	}
+	return vProfile;
+}
+
 /* Striped Smith-Waterman
    Record the highest score of each reference position.
    Return the alignment score and ending position of the best alignment, 2nd best alignment, etc.
    Gap begin and gap extension are different.
    wight_match > 0, all other weights < 0.
    The returned positions are 0-based.
- */
-static alignment_end* sw_sse2_byte (const int8_t* ref,
-							 int8_t ref_dir,	// 0: forward ref; 1: reverse ref
-							 int32_t refLen,
-							 int32_t readLen,
-							 const uint8_t weight_gapO, /* will be used as - */
-							 const uint8_t weight_gapE, /* will be used as - */
-							 const __m128i* vProfile,
-							 uint8_t terminate,	/* the best alignment score: used to terminate
-												   the matrix calculation when locating the
-												   alignment beginning point. If this score
-												   is set to 0, it will not be used */
-	 						 uint8_t bias,  /* Shift 0 point to a positive value. */
-							 int32_t maskLen) {
-
-// Put the largest number of the 16 numbers in vm into m.
-#define max16(m, vm) (vm) = _mm_max_epu8((vm), _mm_srli_si128((vm), 8)); \
-					  (vm) = _mm_max_epu8((vm), _mm_srli_si128((vm), 4)); \
-					  (vm) = _mm_max_epu8((vm), _mm_srli_si128((vm), 2)); \
-					  (vm) = _mm_max_epu8((vm), _mm_srli_si128((vm), 1)); \
-					  (m) = _mm_extract_epi16((vm), 0)
-
-	uint8_t max = 0;		                     /* the max alignment score */
-	int32_t end_read = readLen - 1;
-	int32_t end_ref = -1; /* 0_based best alignment ending point; Initialized as isn't aligned -1. */
-	int32_t segLen = (readLen + 15) / 16; /* number of segment */
-
-	/* array to record the largest score of each reference position */
-	uint8_t* maxColumn = (uint8_t*) calloc(refLen, 1);
-
-	/* array to record the alignment read ending position of the largest score of each reference position */
-	int32_t* end_read_column = (int32_t*) calloc(refLen, sizeof(int32_t));
-
-	/* Define 16 byte 0 vector. */
-	__m128i vZero = _mm_set1_epi32(0);
-
-	__m128i* pvHStore = (__m128i*) calloc(segLen, sizeof(__m128i));
-	__m128i* pvHLoad = (__m128i*) calloc(segLen, sizeof(__m128i));
-	__m128i* pvE = (__m128i*) calloc(segLen, sizeof(__m128i));
-	__m128i* pvHmax = (__m128i*) calloc(segLen, sizeof(__m128i));
-
-	int32_t i, j, k;
-	/* 16 byte insertion begin vector */
-	__m128i vGapO = _mm_set1_epi8(weight_gapO);
-
-	/* 16 byte insertion extension vector */
-	__m128i vGapE = _mm_set1_epi8(weight_gapE);
-
-	/* 16 byte bias vector */
-	__m128i vBias = _mm_set1_epi8(bias);
-
-	__m128i vMaxScore = vZero; /* Trace the highest score of the whole SW matrix. */
-	__m128i vMaxMark = vZero; /* Trace the highest score till the previous column. */
-	__m128i vTemp;
-	int32_t edge, begin = 0, end = refLen, step = 1;
-
-	/* outer loop to process the reference sequence */
-	if (ref_dir == 1) {
-		begin = refLen - 1;
-		end = -1;
-		step = -1;
-	}
-	for (i = begin; LIKELY(i != end); i += step) {
-		int32_t cmp;
-		__m128i e, vF = vZero, vMaxColumn = vZero; /* Initialize F value to 0.
-							   Any errors to vH values will be corrected in the Lazy_F loop.
-							 */
-
-		__m128i vH = pvHStore[segLen - 1];
-		vH = _mm_slli_si128 (vH, 1); /* Shift the 128-bit value in vH left by 1 byte. */
-		const __m128i* vP = vProfile + ref[i] * segLen; /* Right part of the vProfile */
-
-		/* Swap the 2 H buffers. */
-		__m128i* pv = pvHLoad;
-		pvHLoad = pvHStore;
-		pvHStore = pv;
-
-		/* inner loop to process the query sequence */
-		for (j = 0; LIKELY(j < segLen); ++j) {
-			vH = _mm_adds_epu8(vH, _mm_load_si128(vP + j));
-			vH = _mm_subs_epu8(vH, vBias); /* vH will be always > 0 */
-
-			/* Get max from vH, vE and vF. */
-			e = _mm_load_si128(pvE + j);
-			vH = _mm_max_epu8(vH, e);
-			vH = _mm_max_epu8(vH, vF);
-			vMaxColumn = _mm_max_epu8(vMaxColumn, vH);
-
-			/* Save vH values. */
-			_mm_store_si128(pvHStore + j, vH);
-
-			/* Update vE value. */
-			vH = _mm_subs_epu8(vH, vGapO); /* saturation arithmetic, result >= 0 */
-			e = _mm_subs_epu8(e, vGapE);
-			e = _mm_max_epu8(e, vH);
-			_mm_store_si128(pvE + j, e);
-
-			/* Update vF value. */
-			vF = _mm_subs_epu8(vF, vGapE);
-			vF = _mm_max_epu8(vF, vH);
-
-			/* Load the next vH. */
-			vH = _mm_load_si128(pvHLoad + j);
-		}
+   The kernels come from ssw_kernel.h, once per instruction set:
+   sw_byte_* scores in 8 bit lanes and sw_word_* in 16 bit lanes. */
+
+/* SSE2: 16 x 8 bit or 8 x 16 bit lanes */
+static inline uint8_t hmax_u8_sse2 (__m128i vm) {
+	vm = _mm_max_epu8(vm, _mm_srli_si128(vm, 8));
+	vm = _mm_max_epu8(vm, _mm_srli_si128(vm, 4));
+	vm = _mm_max_epu8(vm, _mm_srli_si128(vm, 2));
+	vm = _mm_max_epu8(vm, _mm_srli_si128(vm, 1));
+	return (uint8_t)_mm_extract_epi16(vm, 0);
+}
 
-/* Lazy_F loop: has been revised to disallow adjecent insertion and then deletion, so don't update E(i, j), learn from SWPS3 */
-		for (k = 0; LIKELY(k < 16); ++k) {
-			vF = _mm_slli_si128 (vF, 1);
-			for (j = 0; LIKELY(j < segLen); ++j) {
-				vH = _mm_load_si128(pvHStore + j);
-				vH = _mm_max_epu8(vH, vF);
-				vMaxColumn = _mm_max_epu8(vMaxColumn, vH);	// newly added line
-				_mm_store_si128(pvHStore + j, vH);
-				vH = _mm_subs_epu8(vH, vGapO);
-				vF = _mm_subs_epu8(vF, vGapE);
-				if (UNLIKELY(! _mm_movemask_epi8(_mm_cmpgt_epi8(vF, vH)))) goto end;
-			}
-		}
+static inline uint16_t hmax_i16_sse2 (__m128i vm) {
+	vm = _mm_max_epi16(vm, _mm_srli_si128(vm, 8));
+	vm = _mm_max_epi16(vm, _mm_srli_si128(vm, 4));
+	vm = _mm_max_epi16(vm, _mm_srli_si128(vm, 2));
+	return (uint16_t)_mm_extract_epi16(vm, 0);
+}
 
-end:		
+#define SIMD_NAME sse2
+#define SIMD_ATTR
+#define VEC __m128i
+#define VBYTES 16
+#define VLOAD(p) _mm_loadu_si128(p)
+#define VSTORE(p, v) _mm_storeu_si128((p), (v))
+#define VSET1_8(x) _mm_set1_epi8(x)
+#define VSET1_16(x) _mm_set1_epi16(x)
+#define VZERO() _mm_setzero_si128()
+#define VAND(a, b) _mm_and_si128((a), (b))
+#define VADDS_U8(a, b) _mm_adds_epu8((a), (b))
+#define VSUBS_U8(a, b) _mm_subs_epu8((a), (b))
+#define VMAX_U8(a, b) _mm_max_epu8((a), (b))
+#define VADDS_I16(a, b) _mm_adds_epi16((a), (b))
+#define VSUBS_U16(a, b) _mm_subs_epu16((a), (b))
+#define VMAX_I16(a, b) _mm_max_epi16((a), (b))
+#define VSHL_BYTES(v, n) _mm_slli_si128((v), (n))
+#define VSHL_LANES128(v, m) _mm_setzero_si128()
+#define VANY_GT_U8(a, b) (_mm_movemask_epi8(_mm_cmpeq_epi8(_mm_subs_epu8((a), (b)), _mm_setzero_si128())) != 0xffff)
+#define VANY_GT_I16(a, b) _mm_movemask_epi8(_mm_cmpgt_epi16((a), (b)))
+#define VALL_EQ_I8(a, b) (_mm_movemask_epi8(_mm_cmpeq_epi8((a), (b))) == 0xffff)
+#define VALL_EQ_I16(a, b) (_mm_movemask_epi8(_mm_cmpeq_epi16((a), (b))) == 0xffff)
+#define VHMAX_U8(v) hmax_u8_sse2(v)
+#define VHMAX_I16(v) hmax_i16_sse2(v)
+#include "ssw_kernel.h"
+
+#ifdef SSW_WIDE_SIMD
+
+/* AVX2: 32 x 8 bit or 16 x 16 bit lanes.  Byte shifts across the two 128 bit halves take an alignr with the lower
+   half moved up. */
+#define AVX2_ATTR __attribute__((target("avx2")))
+
+static inline AVX2_ATTR uint8_t hmax_u8_avx2 (__m256i v) {
+	return hmax_u8_sse2(_mm_max_epu8(_mm256_castsi256_si128(v), _mm256_extracti128_si256(v, 1)));
+}
 
-		vMaxScore = _mm_max_epu8(vMaxScore, vMaxColumn);
-		vTemp = _mm_cmpeq_epi8(vMaxMark, vMaxScore);
-		cmp = _mm_movemask_epi8(vTemp);
-		if (cmp != 0xffff) {
-			uint8_t temp;
-			vMaxMark = vMaxScore;
-			max16(temp, vMaxScore);
-			vMaxScore = vMaxMark;
+static inline AVX2_ATTR uint16_t hmax_i16_avx2 (__m256i v) {
+	return hmax_i16_sse2(_mm_max_epi16(_mm256_castsi256_si128(v), _mm256_extracti128_si256(v, 1)));
+}
 
-			if (LIKELY(temp > max)) {
-				max = temp;
-				if (max + bias >= 255) break;	//overflow
-				end_ref = i;
+#define SIMD_NAME avx2
+#define SIMD_ATTR AVX2_ATTR
+#define VEC __m256i
+#define VBYTES 32
+#define VLOAD(p) _mm256_loadu_si256(p)
+#define VSTORE(p, v) _mm256_storeu_si256((p), (v))
+#define VSET1_8(x) _mm256_set1_epi8(x)
+#define VSET1_16(x) _mm256_set1_epi16(x)
+#define VZERO() _mm256_setzero_si256()
+#define VAND(a, b) _mm256_and_si256((a), (b))
+#define VADDS_U8(a, b) _mm256_adds_epu8((a), (b))
+#define VSUBS_U8(a, b) _mm256_subs_epu8((a), (b))
+#define VMAX_U8(a, b) _mm256_max_epu8((a), (b))
+#define VADDS_I16(a, b) _mm256_adds_epi16((a), (b))
+#define VSUBS_U16(a, b) _mm256_subs_epu16((a), (b))
+#define VMAX_I16(a, b) _mm256_max_epi16((a), (b))
+#define VSHL_BYTES(v, n) _mm256_alignr_epi8((v), _mm256_permute2x128_si256((v), (v), 0x08), 16 - (n))
+#define VSHL_LANES128(v, m) ((m) == 1 ? _mm256_permute2x128_si256((v), (v), 0x08) : _mm256_setzero_si256())
+#define VANY_GT_U8(a, b) ((uint32_t)_mm256_movemask_epi8(_mm256_cmpeq_epi8(_mm256_subs_epu8((a), (b)), _mm256_setzero_si256())) != 0xffffffffu)
+#define VANY_GT_I16(a, b) _mm256_movemask_epi8(_mm256_cmpgt_epi16((a), (b)))
+#define VALL_EQ_I8(a, b) ((uint32_t)_mm256_movemask_epi8(_mm256_cmpeq_epi8((a), (b))) == 0xffffffffu)
+#define VALL_EQ_I16(a, b) ((uint32_t)_mm256_movemask_epi8(_mm256_cmpeq_epi16((a), (b))) == 0xffffffffu)
+#define VHMAX_U8(v) hmax_u8_avx2(v)
+#define VHMAX_I16(v) hmax_i16_avx2(v)
+#include "ssw_kernel.h"
+
+/* AVX-512BW: 64 x 8 bit or 32 x 16 bit lanes.  Byte shifts move every 128 bit lane up by one, with zeros into the
+   lowest, and take an alignr against that. */
+#define AVX512_ATTR __attribute__((target("avx512f,avx512bw")))
+
+/* The _MM_SHUFFLE selector moving every 128 bit lane up by m. */
+#define SHUFFLE_LANES128(m) (((3 - (m) > 0 ? 3 - (m) : 0) << 6) | ((2 - (m) > 0 ? 2 - (m) : 0) << 4) | ((1 - (m) > 0 ? 1 - (m) : 0) << 2))
+
+static inline AVX512_ATTR uint8_t hmax_u8_avx512 (__m512i v) {
+	return hmax_u8_avx2(_mm256_max_epu8(_mm512_castsi512_si256(v), _mm512_extracti64x4_epi64(v, 1)));
+}
 
-				/* Store the column with the highest alignment score in order to trace the alignment ending position on read. */
-				for (j = 0; LIKELY(j < segLen); ++j) pvHmax[j] = pvHStore[j];
-			}
-		}
+static inline AVX512_ATTR uint16_t hmax_i16_avx512 (__m512i v) {
+	return hmax_i16_avx2(_mm256_max_epi16(_mm512_castsi512_si256(v), _mm512_extracti64x4_epi64(v, 1)));
+}
 
-		/* Record the max score of current column. */
-		max16(maxColumn[i], vMaxColumn);
-		if (maxColumn[i] == terminate) break;
-	}
+#define SIMD_NAME avx512
+#define SIMD_ATTR AVX512_ATTR
+#define VEC __m512i
+#define VBYTES 64
+#define VLOAD(p) _mm512_loadu_si512(p)
+#define VSTORE(p, v) _mm512_storeu_si512((p), (v))
+#define VSET1_8(x) _mm512_set1_epi8(x)
+#define VSET1_16(x) _mm512_set1_epi16(x)
+#define VZERO() _mm512_setzero_si512()
+#define VAND(a, b) _mm512_and_si512((a), (b))
+#define VADDS_U8(a, b) _mm512_adds_epu8((a), (b))
+#define VSUBS_U8(a, b) _mm512_subs_epu8((a), (b))
+#define VMAX_U8(a, b) _mm512_max_epu8((a), (b))
+#define VADDS_I16(a, b) _mm512_adds_epi16((a), (b))
+#define VSUBS_U16(a, b) _mm512_subs_epu16((a), (b))
+#define VMAX_I16(a, b) _mm512_max_epi16((a), (b))
+#define VSHL_BYTES(v, n) _mm512_alignr_epi8((v), VSHL_LANES128((v), 1), 16 - (n))
+#define VSHL_LANES128(v, m) _mm512_maskz_shuffle_i64x2((0xff << 2 * (m)) & 0xff, (v), (v), SHUFFLE_LANES128(m))
+#define VANY_GT_U8(a, b) _mm512_cmpgt_epu8_mask((a), (b))
+#define VANY_GT_I16(a, b) _mm512_cmpgt_epi16_mask((a), (b))
+#define VALL_EQ_I8(a, b) (_mm512_cmpeq_epi8_mask((a), (b)) == 0xffffffffffffffffull)
+#define VALL_EQ_I16(a, b) (_mm512_cmpeq_epi16_mask((a), (b)) == 0xffffffffu)
+#define VHMAX_U8(v) hmax_u8_avx512(v)
+#define VHMAX_I16(v) hmax_i16_avx512(v)
+#include "ssw_kernel.h"
 
-	/* Trace the alignment ending position on read. */
-	uint8_t *t = (uint8_t*)pvHmax;
-	int32_t column_len = segLen * 16;
-	for (i = 0; LIKELY(i < column_len); ++i, ++t) {
-		int32_t temp;
-		if (*t == max) {
-			temp = i / 16 + i % 16 * segLen;
-			if (temp < end_read) end_read = temp;
-		}
-	}
+#endif
 
-	free(pvHmax);
-	free(pvE);
-	free(pvHLoad);
-	free(pvHStore);
+typedef alignment_end* (*sw_byte_fn) (const int8_t*, int8_t, int32_t, int32_t, const uint8_t, const uint8_t, const void*, uint8_t, uint8_t, int32_t);
+typedef alignment_end* (*sw_word_fn) (const int8_t*, int8_t, int32_t, int32_t, const uint8_t, const uint8_t, const void*, uint16_t, int32_t);
 
-	/* Find the most possible 2nd best alignment. */
-	alignment_end* bests = (alignment_end*) calloc(2, sizeof(alignment_end));
-	bests[0].score = max + bias >= 255 ? 255 : max;
-	bests[0].ref = end_ref;
-	bests[0].read = end_read;
+struct _simd_kernels {
+	const char* name;
+	int32_t width;	// bytes per vector
+	sw_byte_fn sw_byte;
+	sw_word_fn sw_word;
+};
 
-	bests[1].score = 0;
-	bests[1].ref = 0;
-	bests[1].read = 0;
+static const simd_kernels simd_table[] = {
+	{"sse2", 16, sw_byte_sse2, sw_word_sse2},
+#ifdef SSW_WIDE_SIMD
+	{"avx2", 32, sw_byte_avx2, sw_word_avx2},
+	{"avx512", 64, sw_byte_avx512, sw_word_avx512},
+#endif
+};
 
-	edge = (end_ref - maskLen) > 0 ? (end_ref - maskLen) : 0;
-	for (i = 0; i < edge; i ++) {
-		if (maxColumn[i] > bests[1].score) {
-			bests[1].score = maxColumn[i];
-			bests[1].ref = i;
-		}
-	}
-	edge = (end_ref + maskLen) > refLen ? refLen : (end_ref + maskLen);
-	for (i = edge + 1; i < refLen; i ++) {
-		if (maxColumn[i] > bests[1].score) {
-			bests[1].score = maxColumn[i];
-			bests[1].ref = i;
-		}
-	}
+#define SIMD_LEVELS ((int32_t)(sizeof(simd_table) / sizeof(simd_table[0])))
 
-	free(maxColumn);
-	free(end_read_column);
-	return bests;
-}
+/* The kernels new profiles are built for; chosen on first use. */
+static int32_t simd_level = -1;
 
-static __m128i* qP_word (const int8_t* read_num,
-				  const int8_t* mat,
-				  const int32_t readLen,
-				  const int32_t n) {
+int32_t ssw_simd_supported (int32_t level) {
+	if (level < 0 || level >= SIMD_LEVELS) return 0;
+#ifdef SSW_WIDE_SIMD
+	__builtin_cpu_init();
+	if (level == SSW_SIMD_AVX2) return __builtin_cpu_supports("avx2");
+	if (level == SSW_SIMD_AVX512) return __builtin_cpu_supports("avx512f") && __builtin_cpu_supports("avx512bw");
+#endif
+	return 1;
+}
 
-	int32_t segLen = (readLen + 7) / 8;
-	__m128i* vProfile = (__m128i*)malloc(n * segLen * sizeof(__m128i));
-	int16_t* t = (int16_t*)vProfile;
-	int32_t nt, i, j;
-	int32_t segNum;
+const char* ssw_simd_name (int32_t level) {
+	if (level < 0 || level >= SIMD_LEVELS) return 0;
+	return simd_table[level].name;
+}
 
-	/* Generate query profile rearrange query sequence & calculate the weight of match/mismatch */
-	for (nt = 0; LIKELY(nt < n); nt ++) {
-		for (i = 0; i < segLen; i ++) {
-			j = i;
-			for (segNum = 0; LIKELY(segNum < 8) ; segNum ++) {
-				*t++ = j>= readLen ? 0 : mat[nt * n + read_num[j]];
-				j += segLen;
+int32_t ssw_set_simd (int32_t level) {
+	if (level < 0) {
+		/* The widest the CPU runs, and no wider than the one SSW_SIMD names. */
+		const char* name = getenv("SSW_SIMD");
+		int32_t limit = SIMD_LEVELS - 1;
+		if (name && *name) {
+			while (limit >= 0 && strcmp(name, simd_table[limit].name) != 0) --limit;
+			if (limit < 0) {
+				fprintf(stderr, "SSW_SIMD=%s is not a kernel level of this build, the widest supported one is used.\n", name);
+				limit = SIMD_LEVELS - 1;
 			}
 		}
+		for (level = limit; level > 0 && ! ssw_simd_supported(level); --level);
+	} else if (! ssw_simd_supported(level)) {
+		return -1;
 	}
-	return vProfile;
+	simd_level = level;
+	return level;
 }
 
-static alignment_end* sw_sse2_word (const int8_t* ref,
-							 int8_t ref_dir,	// 0: forward ref; 1: reverse ref
-							 int32_t refLen,
-							 int32_t readLen,
-							 const uint8_t weight_gapO, /* will be used as - */
-							 const uint8_t weight_gapE, /* will be used as - */
-							 const __m128i* vProfile,
-							 uint16_t terminate,
-							 int32_t maskLen) {
-
-#define max8(m, vm) (vm) = _mm_max_epi16((vm), _mm_srli_si128((vm), 8)); \
-					(vm) = _mm_max_epi16((vm), _mm_srli_si128((vm), 4)); \
-					(vm) = _mm_max_epi16((vm), _mm_srli_si128((vm), 2)); \
-					(m) = _mm_extract_epi16((vm), 0)
-
-	uint16_t max = 0;		                     /* the max alignment score */
-	int32_t end_read = readLen - 1;
-	int32_t end_ref = 0; /* 1_based best alignment ending point; Initialized as isn't aligned - 0. */
-	int32_t segLen = (readLen + 7) / 8; /* number of segment */
-
-	/* array to record the largest score of each reference position */
-	uint16_t* maxColumn = (uint16_t*) calloc(refLen, 2);
-
-	/* array to record the alignment read ending position of the largest score of each reference position */
-	int32_t* end_read_column = (int32_t*) calloc(refLen, sizeof(int32_t));
-
-	/* Define 16 byte 0 vector. */
-	__m128i vZero = _mm_set1_epi32(0);
-
-	__m128i* pvHStore = (__m128i*) calloc(segLen, sizeof(__m128i));
-	__m128i* pvHLoad = (__m128i*) calloc(segLen, sizeof(__m128i));
-	__m128i* pvE = (__m128i*) calloc(segLen, sizeof(__m128i));
-	__m128i* pvHmax = (__m128i*) calloc(segLen, sizeof(__m128i));
-
-	int32_t i, j, k;
-	/* 16 byte insertion begin vector */
-	__m128i vGapO = _mm_set1_epi16(weight_gapO);
-
-	/* 16 byte insertion extension vector */
-	__m128i vGapE = _mm_set1_epi16(weight_gapE);
-
-	__m128i vMaxScore = vZero; /* Trace the highest score of the whole SW matrix. */
-	__m128i vMaxMark = vZero; /* Trace the highest score till the previous column. */
-	__m128i vTemp;
-	int32_t edge, begin = 0, end = refLen, step = 1;
-
-	/* outer loop to process the reference sequence */
-	if (ref_dir == 1) {
-		begin = refLen - 1;
-		end = -1;
-		step = -1;
-	}
-	for (i = begin; LIKELY(i != end); i += step) {
-		int32_t cmp;
-		__m128i e, vF = vZero; /* Initialize F value to 0.
-							   Any errors to vH values will be corrected in the Lazy_F loop.
-							 */
-		__m128i vH = pvHStore[segLen - 1];
-		vH = _mm_slli_si128 (vH, 2); /* Shift the 128-bit value in vH left by 2 byte. */
-
-		/* Swap the 2 H buffers. */
-		__m128i* pv = pvHLoad;
-
-		__m128i vMaxColumn = vZero; /* vMaxColumn is used to record the max values of column i. */
-
-		const __m128i* vP = vProfile + ref[i] * segLen; /* Right part of the vProfile */
-		pvHLoad = pvHStore;
-		pvHStore = pv;
-
-		/* inner loop to process the query sequence */
-		for (j = 0; LIKELY(j < segLen); j ++) {
-			vH = _mm_adds_epi16(vH, _mm_load_si128(vP + j));
-
-			/* Get max from vH, vE and vF. */
-			e = _mm_load_si128(pvE + j);
-			vH = _mm_max_epi16(vH, e);
-			vH = _mm_max_epi16(vH, vF);
-			vMaxColumn = _mm_max_epi16(vMaxColumn, vH);
-
-			/* Save vH values. */
-			_mm_store_si128(pvHStore + j, vH);
-
-			/* Update vE value. */
-			vH = _mm_subs_epu16(vH, vGapO); /* saturation arithmetic, result >= 0 */
-			e = _mm_subs_epu16(e, vGapE);
-			e = _mm_max_epi16(e, vH);
-			_mm_store_si128(pvE + j, e);
-
-			/* Update vF value. */
-			vF = _mm_subs_epu16(vF, vGapE);
-			vF = _mm_max_epi16(vF, vH);
-
-			/* Load the next vH. */
-			vH = _mm_load_si128(pvHLoad + j);
-		}
-
-		/* Lazy_F loop: has been revised to disallow adjecent insertion and then deletion, so don't update E(i, j), learn from SWPS3 */
-		for (k = 0; LIKELY(k < 8); ++k) {
-			vF = _mm_slli_si128 (vF, 2);
-			for (j = 0; LIKELY(j < segLen); ++j) {
-				vH = _mm_load_si128(pvHStore + j);
-				vH = _mm_max_epi16(vH, vF);
-				vMaxColumn = _mm_max_epi16(vMaxColumn, vH); //newly added line
-				_mm_store_si128(pvHStore + j, vH);
-				vH = _mm_subs_epu16(vH, vGapO);
-				vF = _mm_subs_epu16(vF, vGapE);
-				if (UNLIKELY(! _mm_movemask_epi8(_mm_cmpgt_epi16(vF, vH)))) goto end;
-			}
-		}
-
-end:
-		vMaxScore = _mm_max_epi16(vMaxScore, vMaxColumn);
-		vTemp = _mm_cmpeq_epi16(vMaxMark, vMaxScore);
-		cmp = _mm_movemask_epi8(vTemp);
-		if (cmp != 0xffff) {
-			uint16_t temp;
-			vMaxMark = vMaxScore;
-			max8(temp, vMaxScore);
-			vMaxScore = vMaxMark;
-
-			if (LIKELY(temp > max)) {
-				max = temp;
-				end_ref = i;
-				for (j = 0; LIKELY(j < segLen); ++j) pvHmax[j] = pvHStore[j];
-			}
-		}
+int32_t ssw_get_simd (void) {
+	return simd_level < 0 ? ssw_set_simd(-1) : simd_level;
+}
 
-		/* Record the max score of current column. */
-		max8(maxColumn[i], vMaxColumn);
-		if (maxColumn[i] == terminate) break;
-	}
+/* The counters of ssw_stats.  They are only touched while stats_enabled is set, with atomic adds since profiles are
+   shared between threads. */
+static volatile int32_t stats_enabled = 0;
+static uint64_t stats_counts[SSW_STATS];
+static const char* stats_names[SSW_STATS] = {
+	"alignments", "cells", "byte_overflows", "word_scans", "word_profiles", "reverse_passes", "tracebacks",
+	"traceback_failures", "banded", "batch_fallbacks", "scan_ns", "reverse_ns", "traceback_ns", "banded_ns"
+};
 
-	/* Trace the alignment ending position on read. */
-	uint16_t *t = (uint16_t*)pvHmax;
-	int32_t column_len = segLen * 8;
-	for (i = 0; LIKELY(i < column_len); ++i, ++t) {
-		int32_t temp;
-		if (*t == max) {
-			temp = i / 8 + i % 8 * segLen;
-			if (temp < end_read) end_read = temp;
-		}
-	}
+#define STAT_ADD(stat, value) do { if (UNLIKELY(stats_enabled)) __sync_fetch_and_add(&stats_counts[stat], (uint64_t)(value)); } while (0)
+/* start is a stats_clock() reading, 0 when the counters were off */
+#define STAT_SINCE(stat, start) do { if (UNLIKELY(stats_enabled) && (start)) STAT_ADD(stat, stats_clock() - (start)); } while (0)
 
-	free(pvHmax);
-	free(pvE);
-	free(pvHLoad);
-	free(pvHStore);
+static uint64_t stats_clock (void) {
+	struct timespec ts;
+	if (LIKELY(! stats_enabled)) return 0;
+	clock_gettime(CLOCK_MONOTONIC, &ts);
+	return (uint64_t)ts.tv_sec * 1000000000u + (uint64_t)ts.tv_nsec;
+}
 
-	/* Find the most possible 2nd best alignment. */
-	alignment_end* bests = (alignment_end*) calloc(2, sizeof(alignment_end));
-	bests[0].score = max;
-	bests[0].ref = end_ref;
-	bests[0].read = end_read;
+int32_t ssw_stats_enable (int32_t on) {
+	int32_t was = stats_enabled;
+	stats_enabled = on != 0;
+	return was;
+}
 
-	bests[1].score = 0;
-	bests[1].ref = 0;
-	bests[1].read = 0;
+int32_t ssw_stats (uint64_t* counts, int32_t n) {
+	int32_t i;
+	for (i = 0; i < n && i < SSW_STATS; ++i) counts[i] = __sync_fetch_and_add(&stats_counts[i], 0);
+	return SSW_STATS;
+}
 
-	edge = (end_ref - maskLen) > 0 ? (end_ref - maskLen) : 0;
-	for (i = 0; i < edge; i ++) {
-		if (maxColumn[i] > bests[1].score) {
-			bests[1].score = maxColumn[i];
-			bests[1].ref = i;
-		}
-	}
-	edge = (end_ref + maskLen) > refLen ? refLen : (end_ref + maskLen);
-	for (i = edge; i < refLen; i ++) {
-		if (maxColumn[i] > bests[1].score) {
-			bests[1].score = maxColumn[i];
-			bests[1].ref = i;
-		}
-	}
+void ssw_stats_reset (void) {
+	int32_t i;
+	for (i = 0; i < SSW_STATS; ++i) __sync_lock_test_and_set(&stats_counts[i], 0);
+}
 
-	free(maxColumn);
-	free(end_read_column);
-	return bests;
+const char* ssw_stat_name (int32_t stat) {
+	if (stat < 0 || stat >= SSW_STATS) return 0;
+	return stats_names[stat];
 }
 
 static cigar* banded_sw (const int8_t* ref,
@@ -786,6 +663,7 @@ s_profile* ssw_init (const int8_t* read, const int32_t readLen, const int8_t* ma
 	s_profile* p = (s_profile*)calloc(1, sizeof(struct _profile));
 	p->profile_byte = 0;
 	p->profile_word = 0;
+	p->simd = &simd_table[ssw_get_simd()];
 	p->bias = 0;
 
 	if (score_size == 0 || score_size == 2) {
@@ -795,22 +673,116 @@ s_profile* ssw_init (const int8_t* read, const int32_t readLen, const int8_t* ma
 		bias = abs(bias);
 
 		p->bias = bias;
-		p->profile_byte = qP_byte (read, mat, readLen, n, bias);
+		p->profile_byte = qP_byte (read, mat, readLen, n, bias, p->simd->width);
 	}
-	if (score_size == 1 || score_size == 2) p->profile_word = qP_word (read, mat, readLen, n);
+	/* With score_size 2 the 16 bit profile waits for the first score that overflows 8 bits. */
+	if (score_size == 1) p->profile_word = qP_word (read, mat, readLen, n, p->simd->width / 2);
 	p->read = read;
 	p->mat = mat;
 	p->readLen = readLen;
 	p->n = n;
+	p->score_size = score_size;
 	return p;
 }
 
+int8_t ssw_score_size (const int32_t readLen, const int8_t* mat, const int32_t n) {
+	int32_t i, max = 0, bias = 0;
+	for (i = 0; i < n*n; i++) {
+		if (mat[i] > max) max = mat[i];
+		if (mat[i] < bias) bias = mat[i];
+	}
+	/* No alignment scores more than a match at every query position. */
+	return (int64_t)max * readLen - bias < 255 ? 0 : 2;
+}
+
+int32_t ssw_profile_widths (const s_profile* p) {
+	return (p->profile_byte ? 1 : 0) | (p->profile_word ? 2 : 0);
+}
+
+/* The 16 bit profile of a score_size 2 profile, built on first use.  Profiles are shared between threads, so the one
+   that loses the race to publish it frees its copy. */
+static void* word_profile (const s_profile* prof) {
+	void* word = prof->profile_word;
+	if (word == 0) {
+		void* built = qP_word(prof->read, prof->mat, prof->readLen, prof->n, prof->simd->width / 2);
+		word = __sync_val_compare_and_swap((void**)&prof->profile_word, (void*)0, built);
+		if (word == 0) {
+			STAT_ADD(SSW_STAT_WORD_PROFILES, 1);
+			word = built;
+		} else {
+			free(built);
+		}
+	}
+	return word;
+}
+
 void init_destroy (s_profile* p) {
 	free(p->profile_byte);
 	free(p->profile_word);
 	free(p);
 }
 
+/* Find the beginning position and the cigar of the best alignment in r, whose scores and ending positions are already
+   filled in. Return 0 on success, -1 if the traceback failed. */
+static int32_t align_begin_cigar (const s_profile* prof,
+					const int8_t* ref,
+					const uint8_t weight_gapO,
+					const uint8_t weight_gapE,
+					const uint8_t flag,
+					const uint16_t filters,
+					const int32_t filterd,
+					const int32_t maskLen,
+					int32_t word,
+					s_align* r) {
+
+	alignment_end* bests_reverse = 0;
+	void* vP = 0;
+	int32_t band_width = 0, refLen, readLen;
+	int8_t* read_reverse = 0;
+	cigar* path;
+	uint64_t start;
+
+	/* Nothing more to do when only scores are requested, or when the score filter fails and neither the beginning
+	   position nor an unconditional cigar was asked for. */
+	if (flag == 0 || ((flag & 9) == 0 && (flag & 2) != 0 && r->score1 < filters)) return 0;
+
+	// Find the beginning position of the best alignment.
+	start = stats_clock();
+	read_reverse = seq_reverse(prof->read, r->read_end1);
+	if (word == 0) {
+		vP = qP_byte(read_reverse, prof->mat, r->read_end1 + 1, prof->n, prof->bias, prof->simd->width);
+		bests_reverse = prof->simd->sw_byte(ref, 1, r->ref_end1 + 1, r->read_end1 + 1, weight_gapO, weight_gapE, vP, r->score1, prof->bias, maskLen);
+	} else {
+		vP = qP_word(read_reverse, prof->mat, r->read_end1 + 1, prof->n, prof->simd->width / 2);
+		bests_reverse = prof->simd->sw_word(ref, 1, r->ref_end1 + 1, r->read_end1 + 1, weight_gapO, weight_gapE, vP, r->score1, maskLen);
+	}
+	free(vP);
+	free(read_reverse);
+	r->ref_begin1 = bests_reverse[0].ref;
+	r->read_begin1 = r->read_end1 - bests_reverse[0].read;
+	free(bests_reverse);
+	STAT_ADD(SSW_STAT_REVERSE_PASSES, 1);
+	STAT_SINCE(SSW_STAT_REVERSE_NS, start);
+	if ((7&flag) == 0 || ((2&flag) != 0 && r->score1 < filters) || ((4&flag) != 0 && (r->ref_end1 - r->ref_begin1 > filterd || r->read_end1 - r->read_begin1 > filterd))) return 0;
+
+	// Generate cigar.
+	refLen = r->ref_end1 - r->ref_begin1 + 1;
+	readLen = r->read_end1 - r->read_begin1 + 1;
+	band_width = abs(refLen - readLen) + 1;
+	start = stats_clock();
+	path = banded_sw(ref + r->ref_begin1, prof->read + r->read_begin1, refLen, readLen, r->score1, weight_gapO, weight_gapE, band_width, prof->mat, prof->n);
+	STAT_ADD(SSW_STAT_TRACEBACKS, 1);
+	STAT_SINCE(SSW_STAT_TRACEBACK_NS, start);
+	if (path == 0) {
+		STAT_ADD(SSW_STAT_TRACEBACK_FAILURES, 1);
+		return -1;
+	}
+	r->cigar = path->seq;
+	r->cigarLen = path->length;
+	free(path);
+	return 0;
+}
+
 s_align* ssw_align (const s_profile* prof,
 					const int8_t* ref,
 				  	int32_t refLen,
@@ -821,11 +793,9 @@ s_align* ssw_align (const s_profile* prof,
 					const int32_t filterd,
 					const int32_t maskLen) {
 
-	alignment_end* bests = 0, *bests_reverse = 0;
-	__m128i* vP = 0;
-	int32_t word = 0, band_width = 0, readLen = prof->readLen;
-	int8_t* read_reverse = 0;
-	cigar* path;
+	alignment_end* bests = 0;
+	int32_t word = 0, readLen = prof->readLen;
+	uint64_t start = stats_clock();
 	s_align* r = (s_align*)calloc(1, sizeof(s_align));
 	r->ref_begin1 = -1;
 	r->read_begin1 = -1;
@@ -837,10 +807,11 @@ s_align* ssw_align (const s_profile* prof,
 
 	// Find the alignment scores and ending positions
 	if (prof->profile_byte) {
-		bests = sw_sse2_byte(ref, 0, refLen, readLen, weight_gapO, weight_gapE, prof->profile_byte, -1, prof->bias, maskLen);
-		if (prof->profile_word && bests[0].score == 255) {
+		bests = prof->simd->sw_byte(ref, 0, refLen, readLen, weight_gapO, weight_gapE, prof->profile_byte, -1, prof->bias, maskLen);
+		if (prof->score_size == 2 && bests[0].score == 255) {
+			STAT_ADD(SSW_STAT_BYTE_OVERFLOWS, 1);
 			free(bests);
-			bests = sw_sse2_word(ref, 0, refLen, readLen, weight_gapO, weight_gapE, prof->profile_word, -1, maskLen);
+			bests = prof->simd->sw_word(ref, 0, refLen, readLen, weight_gapO, weight_gapE, word_profile(prof), -1, maskLen);
 			word = 1;
 		} else if (bests[0].score == 255) {
 			fprintf(stderr, "Please set 2 to the score_size parameter of the function ssw_init, otherwise the alignment results will be incorrect.\n");
@@ -848,13 +819,17 @@ s_align* ssw_align (const s_profile* prof,
 			return NULL;
 		}
 	}else if (prof->profile_word) {
-		bests = sw_sse2_word(ref, 0, refLen, readLen, weight_gapO, weight_gapE, prof->profile_word, -1, maskLen);
+		bests = prof->simd->sw_word(ref, 0, refLen, readLen, weight_gapO, weight_gapE, prof->profile_word, -1, maskLen);
 		word = 1;
 	}else {
 		fprintf(stderr, "Please call the function ssw_init before ssw_align.\n");
 		free(r);
 		return NULL;
 	}
+	STAT_ADD(SSW_STAT_ALIGNMENTS, 1);
+	STAT_ADD(SSW_STAT_CELLS, (uint64_t)refLen * readLen);
+	if (word) STAT_ADD(SSW_STAT_WORD_SCANS, 1);
+	STAT_SINCE(SSW_STAT_SCAN_NS, start);
 	r->score1 = bests[0].score;
 	r->ref_end1 = bests[0].ref;
 	r->read_end1 = bests[0].read;
@@ -866,41 +841,261 @@ s_align* ssw_align (const s_profile* prof,
 		r->ref_end2 = -1;
 	}
 	free(bests);
-	if (flag == 0 || (flag == 2 && r->score1 < filters)) goto end;
 
-	// Find the beginning position of the best alignment.
-	read_reverse = seq_reverse(prof->read, r->read_end1);
-	if (word == 0) {
-		vP = qP_byte(read_reverse, prof->mat, r->read_end1 + 1, prof->n, prof->bias);
-		bests_reverse = sw_sse2_byte(ref, 1, r->ref_end1 + 1, r->read_end1 + 1, weight_gapO, weight_gapE, vP, r->score1, prof->bias, maskLen);
-	} else {
-		vP = qP_word(read_reverse, prof->mat, r->read_end1 + 1, prof->n);
-		bests_reverse = sw_sse2_word(ref, 1, r->ref_end1 + 1, r->read_end1 + 1, weight_gapO, weight_gapE, vP, r->score1, maskLen);
+	if (align_begin_cigar(prof, ref, weight_gapO, weight_gapE, flag, filters, filterd, maskLen, word, r) != 0) {
+		free(r);
+		r = NULL;
 	}
-	free(vP);
-	free(read_reverse);
-	r->ref_begin1 = bests_reverse[0].ref;
-	r->read_begin1 = r->read_end1 - bests_reverse[0].read;
-	free(bests_reverse);
-	if ((7&flag) == 0 || ((2&flag) != 0 && r->score1 < filters) || ((4&flag) != 0 && (r->ref_end1 - r->ref_begin1 > filterd || r->read_end1 - r->read_begin1 > filterd))) goto end;
+	return r;
+}
 
-	// Generate cigar.
-	refLen = r->ref_end1 - r->ref_begin1 + 1;
-	readLen = r->read_end1 - r->read_begin1 + 1;
-	band_width = abs(refLen - readLen) + 1;
-	path = banded_sw(ref + r->ref_begin1, prof->read + r->read_begin1, refLen, readLen, r->score1, weight_gapO, weight_gapE, band_width, prof->mat, prof->n);
-	if (path == 0) {
+int32_t ssw_traceback (const s_profile* prof,
+					const int8_t* ref,
+				  	const uint8_t weight_gapO,
+				  	const uint8_t weight_gapE,
+					const uint8_t flag,
+					const uint16_t filters,
+					const int32_t filterd,
+					const int32_t maskLen,
+					s_align* r) {
+
+	/* The forward pass only falls back to 16 bit scores when the 8 bit ones overflow. */
+	int32_t word = prof->profile_byte == 0 || r->score1 + prof->bias >= 255;
+	free(r->cigar);
+	r->cigar = 0;
+	r->cigarLen = 0;
+	r->ref_begin1 = -1;
+	r->read_begin1 = -1;
+	return align_begin_cigar(prof, ref, weight_gapO, weight_gapE, flag, filters, filterd, maskLen, word, r);
+}
+
+int32_t ssw_score_refs (const s_profile* prof,
+					const int8_t* refs,
+					const int64_t* offsets,
+					int32_t count,
+					const uint8_t weight_gapO,
+					const uint8_t weight_gapE,
+					const int32_t maskLen,
+					s_align* results) {
+
+	int32_t i;
+	for (i = 0; i < count; ++i) {
+		s_align* r = ssw_align(prof, refs + offsets[i], (int32_t)(offsets[i + 1] - offsets[i]), weight_gapO, weight_gapE, 0, 0, 0, maskLen);
+		if (! r) return -1;
+		results[i] = *r;
 		free(r);
-		r = NULL;
 	}
-	else {
-		r->cigar = path->seq;
-		r->cigarLen = path->length;
-		free(path);
+	return 0;
+}
+
+/* One cell of a band row: the best scores ending here in H, with a gap in the read (E) and in the reference (F), and
+   whether the alignment behind each touched the edge of the band. */
+typedef struct {
+	int32_t h, e, f;
+	uint8_t h_edge, e_edge, f_edge;
+} band_cell;
+
+#define BAND_NONE (INT32_MIN / 2)
+/* traceback bits of a band cell: where H came from (start, diagonal, E or F), and whether E and F were opened here */
+#define BAND_H_START 0
+#define BAND_H_DIAG 1
+#define BAND_H_E 2
+#define BAND_H_F 3
+#define BAND_E_OPEN 4
+#define BAND_F_OPEN 8
+
+s_align* ssw_align_banded (const int8_t* read,
+					int32_t readLen,
+					const int8_t* ref,
+					int32_t refLen,
+					const int8_t* mat,
+					int32_t n,
+					const uint8_t weight_gapO,
+					const uint8_t weight_gapE,
+					int32_t diagonal,
+					int32_t width,
+					const uint8_t flag,
+					const uint16_t filters,
+					const int32_t filterd,
+					const int32_t maskLen,
+					int32_t* edge) {
+
+	int32_t cols = 2 * width + 1, i, k, j, lo, hi, best = 0, best_i = -1, best_j = -1, best_edge = 0, state, length;
+	band_cell *prev = 0, *cur = 0, *tmp, blank = {0, BAND_NONE, BAND_NONE, 0, 0, 0};
+	int32_t* col_max = 0;
+	uint8_t* dirs = 0;
+	char* ops = 0;
+	/* the traceback is only needed when the beginning position may be asked for */
+	int32_t trace = flag != 0;
+	uint64_t start = stats_clock();
+	s_align* r;
+
+	if (width < 0 || readLen < 0 || refLen < 0) return NULL;
+	STAT_ADD(SSW_STAT_BANDED, 1);
+	r = (s_align*)calloc(1, sizeof(s_align));
+	r->ref_begin1 = r->read_begin1 = r->ref_end1 = r->read_end1 = r->ref_end2 = -1;
+	*edge = 0;
+	/* reference columns the band can reach */
+	lo = diagonal - width > 0 ? diagonal - width : 0;
+	hi = readLen - 1 + diagonal + width < refLen - 1 ? readLen - 1 + diagonal + width : refLen - 1;
+	if (hi < lo) {
+		/* nothing was aligned, so any alignment lies outside the band */
+		*edge = readLen > 0 && refLen > 0;
+		return r;
+	}
+	prev = (band_cell*)malloc((cols + 1) * sizeof(band_cell));
+	cur = (band_cell*)malloc((cols + 1) * sizeof(band_cell));
+	col_max = (int32_t*)calloc(hi - lo + 1, sizeof(int32_t));
+	if (trace) dirs = (uint8_t*)malloc((size_t)readLen * cols);
+	if (! prev || ! cur || ! col_max || (trace && ! dirs)) goto fail;
+	for (k = 0; k <= cols; ++k) prev[k] = blank;
+	cur[cols] = blank;
+
+	/* Row i holds reference columns i + diagonal - width up to i + diagonal + width; the cell above (i - 1, j) is
+	   prev[k + 1], the diagonal one prev[k] and the one to the left cur[k - 1]. */
+	for (i = 0; i < readLen; ++i) {
+		for (k = 0; k < cols; ++k) {
+			band_cell* c = &cur[k];
+			const band_cell *d = &prev[k], *u = &prev[k + 1], *l = k > 0 ? &cur[k - 1] : &blank;
+			int32_t at_edge, h;
+			uint8_t dir;
+			j = i + diagonal - width + k;
+			if (j < 0 || j >= refLen) {
+				*c = blank;
+				continue;
+			}
+			/* a path through the first or last diagonal of the band could have left it */
+			at_edge = (k == 0 && j > 0) || (k == cols - 1 && i > 0);
+			if (l->h - weight_gapO >= l->e - weight_gapE) {
+				c->e = l->h - weight_gapO;
+				c->e_edge = l->h_edge | at_edge;
+				dir = BAND_E_OPEN;
+			} else {
+				c->e = l->e - weight_gapE;
+				c->e_edge = l->e_edge | at_edge;
+				dir = 0;
+			}
+			if (u->h - weight_gapO >= u->f - weight_gapE) {
+				c->f = u->h - weight_gapO;
+				c->f_edge = u->h_edge | at_edge;
+				dir |= BAND_F_OPEN;
+			} else {
+				c->f = u->f - weight_gapE;
+				c->f_edge = u->f_edge | at_edge;
+			}
+			h = d->h + mat[ref[j] * n + read[i]];
+			if (h >= c->e && h >= c->f) {
+				c->h_edge = (d->h > 0 ? d->h_edge : 0) | at_edge;
+				dir |= d->h > 0 ? BAND_H_DIAG : BAND_H_START;
+			} else if (c->e >= c->f) {
+				h = c->e;
+				c->h_edge = c->e_edge;
+				dir |= BAND_H_E;
+			} else {
+				h = c->f;
+				c->h_edge = c->f_edge;
+				dir |= BAND_H_F;
+			}
+			if (h <= 0) {
+				h = 0;
+				c->h_edge = 0;
+			}
+			c->h = h;
+			if (trace) dirs[(size_t)i * cols + k] = dir;
+			if (h > col_max[j - lo]) col_max[j - lo] = h;
+			/* ties go to the leftmost reference column, as in the striped kernels */
+			if (h > best || (h == best && h > 0 && j < best_j)) {
+				best = h;
+				best_i = i;
+				best_j = j;
+				best_edge = c->h_edge;
+			}
+		}
+		tmp = prev;
+		prev = cur;
+		cur = tmp;
+		cur[cols] = blank;
 	}
 
-end:
+	r->score1 = best > 0xffff ? 0xffff : best;
+	if (best > 0) {
+		r->ref_end1 = best_j;
+		r->read_end1 = best_i;
+		*edge = best_edge;
+	}
+	if (maskLen >= 15) {
+		for (j = lo; j <= hi; ++j) {
+			if (best > 0 && j >= best_j - maskLen && j <= best_j + maskLen) continue;
+			if (col_max[j - lo] > r->score2) {
+				r->score2 = col_max[j - lo];
+				r->ref_end2 = j;
+			}
+		}
+	}
+
+	/* the beginning position and the cigar, under the same flags as ssw_align */
+	if (best > 0 && flag != 0 && ! ((flag & 9) == 0 && (flag & 2) != 0 && r->score1 < filters)) {
+		ops = (char*)malloc(best_i + best_j + 2);
+		if (! ops) goto fail;
+		/* state is the matrix the path is in: H (written as BAND_H_DIAG), E or F */
+		i = best_i;
+		j = best_j;
+		state = BAND_H_DIAG;
+		length = 0;
+		for (;;) {
+			uint8_t dir = dirs[(size_t)i * cols + (j - (i + diagonal - width))];
+			if (state == BAND_H_DIAG) {
+				if ((dir & 3) == BAND_H_E || (dir & 3) == BAND_H_F) {
+					state = dir & 3;
+					continue;
+				}
+				ops[length++] = 'M';
+				if ((dir & 3) == BAND_H_START) break;
+				--i;
+				--j;
+			} else if (state == BAND_H_E) {
+				ops[length++] = 'D';
+				state = dir & BAND_E_OPEN ? BAND_H_DIAG : BAND_H_E;
+				--j;
+			} else {
+				ops[length++] = 'I';
+				state = dir & BAND_F_OPEN ? BAND_H_DIAG : BAND_H_F;
+				--i;
+			}
+		}
+		r->read_begin1 = i;
+		r->ref_begin1 = j;
+		if (! ((7&flag) == 0 || ((2&flag) != 0 && r->score1 < filters) || ((4&flag) != 0 && (r->ref_end1 - r->ref_begin1 > filterd || r->read_end1 - r->read_begin1 > filterd)))) {
+			/* ops run from the end back to the beginning */
+			r->cigar = (uint32_t*)malloc(length * sizeof(uint32_t));
+			if (! r->cigar) goto fail;
+			for (k = length - 1; k >= 0; --k) {
+				int32_t run = 1;
+				while (k > 0 && ops[k - 1] == ops[k]) {
+					--k;
+					++run;
+				}
+				r->cigar[r->cigarLen++] = to_cigar_int(run, ops[k]);
+			}
+		}
+	}
+	free(ops);
+	free(dirs);
+	free(prev);
+	free(cur);
+	free(col_max);
+	STAT_SINCE(SSW_STAT_BANDED_NS, start);
 	return r;
+fail:
+	free(ops);
+	free(dirs);
+	free(prev);
+	free(cur);
+	free(col_max);
+	if (r) free(r->cigar);
+	free(r);
+	STAT_SINCE(SSW_STAT_BANDED_NS, start);
+	return NULL;
 }
 
 void align_destroy (s_align* a) {
@@ -1000,3 +1195,436 @@ int32_t mark_mismatch (int32_t ref_begin1,
 	return mismatch_length;
 }
 
+
+/*! @function:
+     Calculate the number of mismatches (NM), the cigar with matches (=) and mismatches (X) told apart, and the MD tag of
+     an alignment, without modifying its cigar.
+*/
+int32_t mismatch_info (int32_t ref_begin1,
+					   int32_t read_begin1,
+					   const int8_t* ref,
+					   const int8_t* read,
+					   const uint32_t* cigar,
+					   int32_t cigarLen,
+					   const uint8_t* match,
+					   int32_t n,
+					   const char* symbols,
+					   uint32_t* xcigar,
+					   int32_t* xcigarLen,
+					   char* md,
+					   int32_t* mdLen) {
+
+	int32_t mismatch_length = 0, p = 0, m = 0, i, j, length, run = 0, is_match;
+	uint32_t length_m = 0, length_x = 0;
+	char op;
+
+#define flush_run() if (md) m += sprintf(md + m, "%d", run); run = 0
+#define flush_mx(choice) \
+	if (length_m && (choice) != 1) { if (xcigar) xcigar[p] = to_cigar_int(length_m, '='); ++ p; length_m = 0; } \
+	if (length_x && (choice) != 2) { if (xcigar) xcigar[p] = to_cigar_int(length_x, 'X'); ++ p; length_x = 0; }
+
+	ref += ref_begin1;
+	read += read_begin1;
+	for (i = 0; i < cigarLen; ++i) {
+		op = cigar_int_to_op(cigar[i]);
+		length = cigar_int_to_len(cigar[i]);
+		if (op == 'M' || op == '=' || op == 'X') {
+			for (j = 0; j < length; ++j) {
+				is_match = match ? match[ref[j] * n + read[j]] : ref[j] == read[j];
+				if (is_match) {
+					flush_mx(1);
+					++ length_m;
+					++ run;
+				} else {
+					flush_mx(2);
+					++ length_x;
+					++ mismatch_length;
+					flush_run();
+					if (md) md[m ++] = symbols[(uint8_t)ref[j]];
+				}
+			}
+			ref += length;
+			read += length;
+		} else if (op == 'I') {
+			flush_mx(0);
+			if (xcigar) xcigar[p] = cigar[i];
+			++ p;
+			read += length;
+			mismatch_length += length;
+		} else if (op == 'D') {
+			flush_mx(0);
+			if (xcigar) xcigar[p] = cigar[i];
+			++ p;
+			flush_run();
+			if (md) {
+				md[m ++] = '^';
+				for (j = 0; j < length; ++j) md[m ++] = symbols[(uint8_t)ref[j]];
+			}
+			ref += length;
+			mismatch_length += length;
+		}
+	}
+	flush_mx(0);
+	flush_run();
+	if (md) md[m] = 0;
+
+#undef flush_mx
+#undef flush_run
+
+	if (xcigarLen) *xcigarLen = p;
+	if (mdLen) *mdLen = m;
+	return mismatch_length;
+}
+
+/* Inter-sequence scoring: eight independent read/reference pairs per vector, one in each 16 bit lane.  The reads of a
+   group are kept as one profile per lane (a row of scores per reference symbol) and the column of scores of the eight
+   lanes is put together with 8x8 transposes.  Everything past the end of a read or reference scores PAD_SCORE, which
+   keeps those cells out of the alignments; cells only depend on cells at lower indices, so the padding never reaches
+   the real ones. */
+
+#define BATCH_LANES 8
+#define PAD_SCORE -16384
+
+typedef struct {
+	int32_t readLen;
+	int32_t refLen;
+	int32_t index;
+} batch_pair;
+
+static int batch_pair_cmp (const void* a, const void* b) {
+	const batch_pair* x = (const batch_pair*)a;
+	const batch_pair* y = (const batch_pair*)b;
+	if (x->readLen != y->readLen) return x->readLen < y->readLen ? -1 : 1;
+	if (x->refLen != y->refLen) return x->refLen < y->refLen ? -1 : 1;
+	return x->index < y->index ? -1 : x->index > y->index;
+}
+
+static inline void transpose8_epi16 (__m128i* r) {
+	__m128i a0 = _mm_unpacklo_epi16(r[0], r[1]), a1 = _mm_unpackhi_epi16(r[0], r[1]);
+	__m128i a2 = _mm_unpacklo_epi16(r[2], r[3]), a3 = _mm_unpackhi_epi16(r[2], r[3]);
+	__m128i a4 = _mm_unpacklo_epi16(r[4], r[5]), a5 = _mm_unpackhi_epi16(r[4], r[5]);
+	__m128i a6 = _mm_unpacklo_epi16(r[6], r[7]), a7 = _mm_unpackhi_epi16(r[6], r[7]);
+	__m128i b0 = _mm_unpacklo_epi32(a0, a2), b1 = _mm_unpackhi_epi32(a0, a2);
+	__m128i b2 = _mm_unpacklo_epi32(a1, a3), b3 = _mm_unpackhi_epi32(a1, a3);
+	__m128i b4 = _mm_unpacklo_epi32(a4, a6), b5 = _mm_unpackhi_epi32(a4, a6);
+	__m128i b6 = _mm_unpacklo_epi32(a5, a7), b7 = _mm_unpackhi_epi32(a5, a7);
+	r[0] = _mm_unpacklo_epi64(b0, b4); r[1] = _mm_unpackhi_epi64(b0, b4);
+	r[2] = _mm_unpacklo_epi64(b1, b5); r[3] = _mm_unpackhi_epi64(b1, b5);
+	r[4] = _mm_unpacklo_epi64(b2, b6); r[5] = _mm_unpackhi_epi64(b2, b6);
+	r[6] = _mm_unpacklo_epi64(b3, b7); r[7] = _mm_unpackhi_epi64(b3, b7);
+}
+
+/* The sub-optimal score the way the striped kernels find it: the best column outside maskLen of the best one.  The
+   8 bit kernel, used whenever the score fits, starts the right hand side one column further out. */
+static void batch_second_best (const int16_t* colMax, int32_t stride, int32_t refLen, int32_t maskLen, int32_t byte, s_align* r) {
+	int32_t i, edge;
+	r->score2 = 0;
+	r->ref_end2 = 0;
+	edge = (r->ref_end1 - maskLen) > 0 ? (r->ref_end1 - maskLen) : 0;
+	for (i = 0; i < edge; i ++) {
+		if (colMax[i * stride] > r->score2) {
+			r->score2 = colMax[i * stride];
+			r->ref_end2 = i;
+		}
+	}
+	edge = (r->ref_end1 + maskLen) > refLen ? refLen : (r->ref_end1 + maskLen);
+	for (i = edge + byte; i < refLen; i ++) {
+		if (colMax[i * stride] > r->score2) {
+			r->score2 = colMax[i * stride];
+			r->ref_end2 = i;
+		}
+	}
+}
+
+/* Score one group of up to BATCH_LANES pairs; returns 0, or -1 when out of memory.  Pairs whose score saturates the
+   16 bit lanes are left with score1 = 0xffff for the caller to redo. */
+static int32_t batch_group (const int8_t* const* reads, const int8_t* const* refs, const batch_pair* pairs, int32_t lanes,
+					const int16_t* mat16, int32_t n, uint8_t weight_gapO, uint8_t weight_gapE, int32_t maskLen,
+					int32_t bias, s_align* results) {
+
+	int32_t maxRead = 0, maxRef = 0, readPad, i, j, l, a, ib, r;
+	int32_t bestRef[BATCH_LANES], bestRead[BATCH_LANES];
+	int16_t best[BATCH_LANES], arg[BATCH_LANES];
+	int16_t *profile, *colMax;
+	__m128i *pvH, *pvE, *pvMask;
+	__m128i vGapO = _mm_set1_epi16(weight_gapO), vGapE = _mm_set1_epi16(weight_gapE), vOne = _mm_set1_epi16(1);
+	__m128i vBest = _mm_setzero_si128();
+
+	for (l = 0; l < lanes; ++l) {
+		if (pairs[l].readLen > maxRead) maxRead = pairs[l].readLen;
+		if (pairs[l].refLen > maxRef) maxRef = pairs[l].refLen;
+	}
+	readPad = (maxRead + 7) / 8 * 8;
+	if (readPad == 0) readPad = 8;
+
+	profile = (int16_t*)malloc(BATCH_LANES * (n + 1) * readPad * sizeof(int16_t));
+	colMax = (int16_t*)malloc(((size_t)maxRef + 1) * BATCH_LANES * sizeof(int16_t));
+	pvH = (__m128i*)calloc(readPad, sizeof(__m128i));
+	pvE = (__m128i*)calloc(readPad, sizeof(__m128i));
+	pvMask = (__m128i*)calloc(readPad, sizeof(__m128i));
+	if (! profile || ! colMax || ! pvH || ! pvE || ! pvMask) {
+		free(profile); free(colMax); free(pvH); free(pvE); free(pvMask);
+		return -1;
+	}
+
+	/* profile[(l * (n + 1) + a) * readPad + i]: the score of read l at i against symbol a; a == n is the padding */
+	for (l = 0; l < BATCH_LANES; ++l) {
+		int32_t readLen = l < lanes ? pairs[l].readLen : 0;
+		const int8_t* read = l < lanes ? reads[pairs[l].index] : 0;
+		for (a = 0; a <= n; ++a) {
+			int16_t* t = profile + (l * (n + 1) + a) * readPad;
+			for (i = 0; i < readPad; ++i) t[i] = i < readLen ? mat16[a * (n + 1) + read[i]] : PAD_SCORE;
+		}
+		for (i = 0; i < readLen; ++i) ((int16_t*)(pvMask + i))[l] = -1;
+		bestRef[l] = -1;
+		bestRead[l] = readLen > 0 ? 0 : -1;
+	}
+
+	for (j = 0; j < maxRef; ++j) {
+		const int16_t* p[BATCH_LANES];
+		__m128i vF = _mm_setzero_si128(), vHdiag = _mm_setzero_si128(), vColMax = _mm_setzero_si128();
+		__m128i vArg = _mm_setzero_si128(), vI = _mm_setzero_si128(), gt;
+		for (l = 0; l < BATCH_LANES; ++l) {
+			a = l < lanes && j < pairs[l].refLen ? refs[pairs[l].index][j] : n;
+			p[l] = profile + (l * (n + 1) + a) * readPad;
+		}
+		for (ib = 0; ib < readPad; ib += 8) {
+			__m128i vS[8];
+			for (l = 0; l < BATCH_LANES; ++l) vS[l] = _mm_loadu_si128((const __m128i*)(p[l] + ib));
+			transpose8_epi16(vS);
+			for (r = 0; r < 8; ++r) {
+				__m128i vE = _mm_load_si128(pvE + ib + r), vH, vM;
+				vH = _mm_adds_epi16(vHdiag, vS[r]);
+				vH = _mm_max_epi16(vH, vE);
+				vH = _mm_max_epi16(vH, vF);
+				vHdiag = _mm_load_si128(pvH + ib + r);
+				_mm_store_si128(pvH + ib + r, vH);
+
+				/* the column maximum over the read only, and the first row reaching it */
+				vM = _mm_and_si128(vH, _mm_load_si128(pvMask + ib + r));
+				gt = _mm_cmpgt_epi16(vM, vColMax);
+				vColMax = _mm_max_epi16(vColMax, vM);
+				vArg = _mm_or_si128(_mm_and_si128(gt, vI), _mm_andnot_si128(gt, vArg));
+				vI = _mm_add_epi16(vI, vOne);
+
+				vH = _mm_subs_epu16(vH, vGapO);
+				_mm_store_si128(pvE + ib + r, _mm_max_epi16(_mm_subs_epu16(vE, vGapE), vH));
+				vF = _mm_max_epi16(_mm_subs_epu16(vF, vGapE), vH);
+			}
+		}
+		_mm_storeu_si128((__m128i*)(colMax + j * BATCH_LANES), vColMax);
+		gt = _mm_cmpgt_epi16(vColMax, vBest);
+		if (_mm_movemask_epi8(gt)) {
+			vBest = _mm_max_epi16(vBest, vColMax);
+			_mm_storeu_si128((__m128i*)best, gt);
+			_mm_storeu_si128((__m128i*)arg, vArg);
+			for (l = 0; l < BATCH_LANES; ++l) {
+				if (best[l]) {
+					bestRef[l] = j;
+					bestRead[l] = arg[l];
+				}
+			}
+		}
+	}
+
+	_mm_storeu_si128((__m128i*)best, vBest);
+	for (l = 0; l < lanes; ++l) {
+		s_align* res = results + pairs[l].index;
+		int32_t mask = maskLen > 0 ? maskLen : (pairs[l].readLen / 2 > 15 ? pairs[l].readLen / 2 : 15);
+		int32_t byte = best[l] + bias < 255;
+		res->score1 = best[l] == 0x7fff ? 0xffff : (uint16_t)best[l];
+		res->ref_begin1 = -1;
+		res->read_begin1 = -1;
+		res->ref_end1 = byte || bestRef[l] >= 0 ? bestRef[l] : 0;
+		res->read_end1 = bestRead[l];
+		res->cigar = 0;
+		res->cigarLen = 0;
+		if (mask >= 15) {
+			batch_second_best(colMax + l, BATCH_LANES, pairs[l].refLen, mask, byte, res);
+		} else {
+			res->score2 = 0;
+			res->ref_end2 = -1;
+		}
+	}
+
+	free(profile);
+	free(colMax);
+	free(pvH);
+	free(pvE);
+	free(pvMask);
+	return 0;
+}
+
+int32_t ssw_score_batch (const int8_t* const* reads,
+					const int32_t* readLens,
+					const int8_t* const* refs,
+					const int32_t* refLens,
+					int32_t count,
+					const int8_t* mat,
+					const int32_t n,
+					const uint8_t weight_gapO,
+					const uint8_t weight_gapE,
+					const int32_t maskLen,
+					s_align* results) {
+
+	batch_pair* pairs = (batch_pair*)malloc(((size_t)count + 1) * sizeof(batch_pair));
+	int16_t* mat16 = (int16_t*)malloc((n + 1) * (n + 1) * sizeof(int16_t));
+	int32_t i, a, b, bias = 0, batched = 0, ret = 0;
+
+	if (! pairs || ! mat16) {
+		free(pairs);
+		free(mat16);
+		return -1;
+	}
+	for (i = 0; i < n * n; ++i) if (mat[i] < bias) bias = mat[i];
+	bias = abs(bias);
+	for (a = 0; a <= n; ++a) {
+		for (b = 0; b <= n; ++b) mat16[a * (n + 1) + b] = a == n || b == n ? PAD_SCORE : mat[a * n + b];
+	}
+
+	/* Reads too long for 16 bit row numbers go straight to ssw_align; the rest are grouped by length so that the
+	   lanes of a group carry little padding. */
+	for (i = 0; i < count; ++i) {
+		if (readLens[i] < 0x7fff) {
+			pairs[batched].readLen = readLens[i];
+			pairs[batched].refLen = refLens[i];
+			pairs[batched].index = i;
+			++ batched;
+		} else {
+			results[i].score1 = 0xffff;
+		}
+	}
+	qsort(pairs, batched, sizeof(batch_pair), batch_pair_cmp);
+	for (i = 0; i < batched && ret == 0; i += BATCH_LANES) {
+		int32_t lanes = batched - i < BATCH_LANES ? batched - i : BATCH_LANES;
+		ret = batch_group(reads, refs, pairs + i, lanes, mat16, n, weight_gapO, weight_gapE, maskLen, bias, results);
+	}
+
+	/* Saturated lanes, and the reads left out above, are scored one at a time. */
+	for (i = 0; i < count && ret == 0; ++i) {
+		if (results[i].score1 == 0xffff) {
+			int32_t mask = maskLen > 0 ? maskLen : (readLens[i] / 2 > 15 ? readLens[i] / 2 : 15);
+			s_profile* p = ssw_init(reads[i], readLens[i], mat, n, 2);
+			s_align* r = p ? ssw_align(p, refs[i], refLens[i], weight_gapO, weight_gapE, 0, 0, 0, mask) : 0;
+			STAT_ADD(SSW_STAT_BATCH_FALLBACKS, 1);
+			if (r) {
+				results[i] = *r;
+				free(r);
+			} else {
+				ret = -1;
+			}
+			if (p) init_destroy(p);
+		}
+	}
+
+	free(pairs);
+	free(mat16);
+	return ret;
+}
+
+/* the index of kmer in a sorted array, or -1 */
+static int32_t kmer_find (const uint64_t* sorted, int32_t count, uint64_t kmer) {
+	int32_t lo = 0, hi = count;
+	while (lo < hi) {
+		int32_t mid = lo + (hi - lo) / 2;
+		if (sorted[mid] < kmer) lo = mid + 1;
+		else hi = mid;
+	}
+	return lo < count && sorted[lo] == kmer ? lo : -1;
+}
+
+int32_t ssw_kmers (const int8_t* seq, int32_t len, const int8_t* bases, int32_t k, uint64_t* kmers) {
+	uint64_t value = 0, full;
+	int32_t i, ambiguous = -1;
+	if (k < 1 || k > 31) return -1;
+	full = ((uint64_t)1 << (2 * k)) - 1;
+	for (i = 0; i < len; ++i) {
+		int8_t base = bases[(uint8_t)seq[i]];
+		/* a window is ambiguous for as long as its last ambiguous symbol is in it; the packed value only takes
+		   in bases, and by the time that symbol leaves it holds the k after it */
+		if (base < 0) ambiguous = i;
+		else value = ((value << 2) | (uint64_t)base) & full;
+		if (i >= k - 1) kmers[i - k + 1] = ambiguous > i - k ? SSW_KMER_AMBIGUOUS : value;
+	}
+	return len >= k ? len - k + 1 : 0;
+}
+
+static int kmer_cmp (const void* a, const void* b) {
+	uint64_t x = *(const uint64_t*)a, y = *(const uint64_t*)b;
+	return x < y ? -1 : x > y;
+}
+
+int32_t ssw_kmer_sort (uint64_t* kmers, int32_t count) {
+	int32_t i, unique = 0;
+	qsort(kmers, count, sizeof(uint64_t), kmer_cmp);
+	/* SSW_KMER_AMBIGUOUS sorts last */
+	for (i = 0; i < count && kmers[i] != SSW_KMER_AMBIGUOUS; ++i) {
+		if (unique == 0 || kmers[i] != kmers[unique - 1]) kmers[unique++] = kmers[i];
+	}
+	return unique;
+}
+
+int32_t ssw_kmer_shared (const uint64_t* kmers, int32_t count, const uint64_t* sorted, int32_t sorted_count, int32_t needed, uint8_t* found) {
+	int32_t i, shared = 0;
+	for (i = 0; i < count; ++i) {
+		int32_t hit = kmers[i] != SSW_KMER_AMBIGUOUS && kmer_find(sorted, sorted_count, kmers[i]) >= 0;
+		if (found) found[i] = (uint8_t)hit;
+		if (hit && ++shared == needed) break;
+	}
+	return shared;
+}
+
+/* bits of the filter ssw_kmer_scan checks reference k-mers against before looking them up */
+#define KMER_FILTER_BITS 16
+
+static inline uint32_t kmer_hash (uint64_t kmer) {
+	return (uint32_t)((kmer * 0x9e3779b97f4a7c15ULL) >> (64 - KMER_FILTER_BITS));
+}
+
+int32_t ssw_kmer_scan (const uint64_t* kmers, int32_t count, const int8_t* ref, int32_t refLen, const int8_t* bases, int32_t k,
+					int32_t needed) {
+	uint64_t *sorted = 0, value = 0, full;
+	int32_t *weight = 0, unique, i, idx, ambiguous = -1, shared = 0;
+	uint8_t* filter = 0;
+
+	if (k < 1 || k > 31) return -1;
+	full = ((uint64_t)1 << (2 * k)) - 1;
+	sorted = (uint64_t*)malloc(((size_t)count + 1) * sizeof(uint64_t));
+	weight = (int32_t*)calloc((size_t)count + 1, sizeof(int32_t));
+	filter = (uint8_t*)calloc(1 << (KMER_FILTER_BITS - 3), 1);
+	if (! sorted || ! weight || ! filter) {
+		shared = -1;
+		goto end;
+	}
+	memcpy(sorted, kmers, (size_t)count * sizeof(uint64_t));
+	unique = ssw_kmer_sort(sorted, count);
+	/* how many query positions each distinct k-mer stands for */
+	for (i = 0; i < count; ++i) {
+		if (kmers[i] == SSW_KMER_AMBIGUOUS) continue;
+		++weight[kmer_find(sorted, unique, kmers[i])];
+	}
+	for (i = 0; i < unique; ++i) {
+		uint32_t h = kmer_hash(sorted[i]);
+		filter[h >> 3] |= (uint8_t)(1 << (h & 7));
+	}
+	for (i = 0; i < refLen; ++i) {
+		int8_t base = bases[(uint8_t)ref[i]];
+		uint32_t h;
+		if (base < 0) ambiguous = i;
+		else value = ((value << 2) | (uint64_t)base) & full;
+		if (i < k - 1 || ambiguous > i - k) continue;
+		h = kmer_hash(value);
+		if (! (filter[h >> 3] & (1 << (h & 7)))) continue;
+		idx = kmer_find(sorted, unique, value);
+		/* a weight is only counted once */
+		if (idx < 0 || weight[idx] == 0) continue;
+		shared += weight[idx];
+		weight[idx] = 0;
+		if (needed > 0 && shared >= needed) break;
+	}
+end:
+	free(sorted);
+	free(weight);
+	free(filter);
+	return shared;
+}
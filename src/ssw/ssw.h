@@ -63,7 +63,8 @@ typedef struct {
 	@param	mat	pointer to the substitution matrix; mat needs to be corresponding to the read sequence
 	@param	n	the square root of the number of elements in mat (mat has n*n elements)
 	@param	score_size	estimated Smith-Waterman score; if your estimated best alignment score is surely < 255 please set 0; if
-						your estimated best alignment score >= 255, please set 1; if you don't know, please set 2
+						your estimated best alignment score >= 255, please set 1; if you don't know, please set 2, and the 16 bit
+						profile will be built by ssw_align the first time a score overflows 8 bits (see ssw_score_size)
 	@return	pointer to the query profile structure
 	@note	example for parameter read and mat:
 			If the query sequence is: ACGTATC, the sequence that read points to can be: 1234142
@@ -77,6 +78,84 @@ typedef struct {
 */
 s_profile* ssw_init (const int8_t* read, const int32_t readLen, const int8_t* mat, const int32_t n, const int8_t score_size);
 
+/*!	@function	The narrowest score_size for ssw_init that is safe for a query.
+	@param	readLen	length of the query sequence
+	@param	mat	pointer to the substitution matrix
+	@param	n	the square root of the number of elements in mat
+	@return	0 when no alignment of the query can reach 255 (a match at every position, plus the bias of the 8 bit
+			kernel), 2 otherwise
+*/
+int8_t ssw_score_size (const int32_t readLen, const int8_t* mat, const int32_t n);
+
+/*!	@function	The score widths a query profile holds so far.
+	@param	p	pointer to the query profile structure
+	@return	bit 0 set when the 8 bit profile is built, bit 1 when the 16 bit one is
+*/
+int32_t ssw_profile_widths (const s_profile* p);
+
+/*!	@abstract	Instruction sets of the striped kernels, from the narrowest.	*/
+#define SSW_SIMD_SSE2 0
+#define SSW_SIMD_AVX2 1
+#define SSW_SIMD_AVX512 2
+
+/*!	@function	Choose the kernels used by the query profiles created from now on.
+	@param	level	SSW_SIMD_SSE2, SSW_SIMD_AVX2 or SSW_SIMD_AVX512; -1 picks the widest the CPU supports that is no wider
+					than the one named by the SSW_SIMD environment variable (sse2, avx2 or avx512), if set; an unknown name
+					is reported on stderr and ignored
+	@return	the level now in use, or -1 if the CPU (or this build) does not support level
+	@note	Every kernel gives identical results.  Existing profiles keep the kernels they were created for.  ssw_init
+			calls ssw_set_simd(-1) the first time it runs unless a level was already set.
+*/
+int32_t ssw_set_simd (int32_t level);
+
+/*!	@function	The kernel level used by new query profiles.	*/
+int32_t ssw_get_simd (void);
+
+/*!	@function	Check whether the CPU and this build can run the kernels of a level.
+	@return	1 if they can, 0 if not
+*/
+int32_t ssw_simd_supported (int32_t level);
+
+/*!	@function	The name of a kernel level (sse2, avx2 or avx512), or 0 for an unknown level.	*/
+const char* ssw_simd_name (int32_t level);
+
+/*!	@abstract	Counters of what the library did, kept once ssw_stats_enable(1) is called.  The _NS counters are
+				nanoseconds spent in a phase.	*/
+#define SSW_STAT_ALIGNMENTS 0	/* ssw_align calls */
+#define SSW_STAT_CELLS 1	/* cells of the forward scans */
+#define SSW_STAT_BYTE_OVERFLOWS 2	/* forward scans whose 8 bit scores overflowed and were rerun with 16 bits */
+#define SSW_STAT_WORD_SCANS 3	/* forward scans with 16 bit scores */
+#define SSW_STAT_WORD_PROFILES 4	/* 16 bit profiles built on the first overflow */
+#define SSW_STAT_REVERSE_PASSES 5	/* reverse scans to find beginning positions */
+#define SSW_STAT_TRACEBACKS 6	/* banded_sw calls to build a cigar */
+#define SSW_STAT_TRACEBACK_FAILURES 7
+#define SSW_STAT_BANDED 8	/* ssw_align_banded calls */
+#define SSW_STAT_BATCH_FALLBACKS 9	/* ssw_score_batch pairs scored one at a time */
+#define SSW_STAT_SCAN_NS 10
+#define SSW_STAT_REVERSE_NS 11
+#define SSW_STAT_TRACEBACK_NS 12
+#define SSW_STAT_BANDED_NS 13
+#define SSW_STATS 14
+
+/*!	@function	Turn the counters on or off.
+	@return	whether they were on
+	@note	The counters are shared by every thread.  While they are off, each counting point costs a single branch.
+*/
+int32_t ssw_stats_enable (int32_t on);
+
+/*!	@function	Copy the counters.
+	@param	counts	receives the first n counters, indexed by the SSW_STAT constants
+	@param	n	the size of counts
+	@return	SSW_STATS, the number of counters there are
+*/
+int32_t ssw_stats (uint64_t* counts, int32_t n);
+
+/*!	@function	Set every counter back to 0.	*/
+void ssw_stats_reset (void);
+
+/*!	@function	The name of a counter (alignments, cells, ...), or 0 for an unknown one.	*/
+const char* ssw_stat_name (int32_t stat);
+
 /*!	@function	Release the memory allocated by function ssw_init.
 	@param	p	pointer to the query profile structure
 */
@@ -125,6 +204,88 @@ s_align* ssw_align (const s_profile* prof,
 					const int32_t filterd,
 					const int32_t maskLen);
 
+/*!	@function	Find the beginning position and cigar of an alignment found by ssw_align with flag 0.
+	@param	prof	pointer to the query profile structure that was passed to ssw_align
+	@param	ref	pointer to the target sequence that was passed to ssw_align
+	@param	weight_gapO	the absolute value of gap open penalty
+	@param	weight_gapE	the absolute value of gap extension penalty
+	@param	flag	bitwise FLAG, as for ssw_align
+	@param	filters	score filter, as for ssw_align
+	@param	filterd	distance filter, as for ssw_align
+	@param	maskLen	as for ssw_align
+	@param	r	alignment result returned by ssw_align; its beginning positions and cigar are filled in place
+	@return	0 on success, -1 if the traceback failed
+	@note	This lets callers score several candidates with flag 0 and only pay for the reverse pass and the traceback
+			of the one they keep.
+*/
+int32_t ssw_traceback (const s_profile* prof,
+					const int8_t* ref,
+					const uint8_t weight_gapO,
+					const uint8_t weight_gapE,
+					const uint8_t flag,
+					const uint16_t filters,
+					const int32_t filterd,
+					const int32_t maskLen,
+					s_align* r);
+
+/*!	@function	Score one query profile against many references held back to back in one buffer.
+	@param	prof	pointer to the query profile structure
+	@param	refs	the references, as numbers, one after another
+	@param	offsets	count + 1 offsets into refs: reference i is refs[offsets[i]] up to refs[offsets[i + 1]]
+	@param	count	number of references
+	@param	weight_gapO	the absolute value of gap open penalty
+	@param	weight_gapE	the absolute value of gap extension penalty
+	@param	maskLen	as for ssw_align
+	@param	results	array of count alignment results, filled in as ssw_align does with flag 0
+	@return	0 on success, -1 if an alignment failed
+	@note	The same as calling ssw_align with flag 0 for each reference, without a round trip per reference.
+*/
+int32_t ssw_score_refs (const s_profile* prof,
+					const int8_t* refs,
+					const int64_t* offsets,
+					int32_t count,
+					const uint8_t weight_gapO,
+					const uint8_t weight_gapE,
+					const int32_t maskLen,
+					s_align* results);
+
+/*!	@function	Smith-Waterman alignment within a band of diagonals.
+	@param	read	pointer to the query sequence, as numbers
+	@param	readLen	length of the query sequence
+	@param	ref	pointer to the target sequence, as numbers
+	@param	refLen	length of the target sequence
+	@param	mat	pointer to the substitution matrix
+	@param	n	the square root of the number of elements in mat
+	@param	weight_gapO	the absolute value of gap open penalty
+	@param	weight_gapE	the absolute value of gap extension penalty
+	@param	diagonal	reference position minus read position of the band's central diagonal
+	@param	width	number of diagonals on each side of the central one
+	@param	flag	bitwise FLAG, as for ssw_align
+	@param	filters	score filter, as for ssw_align
+	@param	filterd	distance filter, as for ssw_align
+	@param	maskLen	as for ssw_align; score2 only covers the reference positions the band reaches
+	@param	edge	set to 1 when the best alignment reaches the first or last diagonal of the band, where a better one may
+			have left it, or when the band misses the reference altogether, and to 0 otherwise
+	@return	pointer to the alignment result structure, as ssw_align returns, or 0 on failure
+	@note	Only the cells of the band are scored, in O(readLen * width) time and O(width) memory, so no query profile is
+			needed.  An alignment with score 0 has no positions.
+*/
+s_align* ssw_align_banded (const int8_t* read,
+					int32_t readLen,
+					const int8_t* ref,
+					int32_t refLen,
+					const int8_t* mat,
+					int32_t n,
+					const uint8_t weight_gapO,
+					const uint8_t weight_gapE,
+					int32_t diagonal,
+					int32_t width,
+					const uint8_t flag,
+					const uint16_t filters,
+					const int32_t filterd,
+					const int32_t maskLen,
+					int32_t* edge);
+
 /*!	@function	Release the memory allocated by function ssw_align.
 	@param	a	pointer to the alignment result structure
 */
@@ -155,6 +316,111 @@ int32_t mark_mismatch (int32_t ref_begin1,
 					   uint32_t** cigar, 
 					   int32_t* cigarLen);
 
+/*! @function:
+     Calculate the number of mismatches (NM), the cigar with matches (=) and mismatches (X) told apart, and the MD tag
+     of an alignment, leaving its cigar untouched.
+	@param	ref_begin1	0-based best alignment beginning position on the reference sequence
+	@param	read_begin1	0-based best alignment beginning position on the read sequence
+	@param	ref	pointer to the reference sequence
+	@param	read	pointer to the read sequence
+	@param	cigar	best alignment cigar, as returned by ssw_align
+	@param	cigarLen	length of the cigar
+	@param	match	n*n table, indexed by ref * n + read, that is non-zero where the pair of symbols is a match; when it is 0
+					symbols only match when their numbers are equal
+	@param	n	the square root of the number of elements in match
+	@param	symbols	the letter for each symbol number, used to write the reference bases into the MD tag
+	@param	xcigar	output =/X cigar without soft clipping, may be 0; needs room for the number of M bases plus cigarLen
+	@param	xcigarLen	output length of xcigar, may be 0
+	@param	md	output nul terminated MD tag, may be 0; needs room for 12 characters per reference base and cigar element
+	@param	mdLen	output length of md, may be 0
+	@return	The number of mismatches, inserted and deleted bases (the NM tag).
+*/
+int32_t mismatch_info (int32_t ref_begin1,
+					   int32_t read_begin1,
+					   const int8_t* ref,
+					   const int8_t* read,
+					   const uint32_t* cigar,
+					   int32_t cigarLen,
+					   const uint8_t* match,
+					   int32_t n,
+					   const char* symbols,
+					   uint32_t* xcigar,
+					   int32_t* xcigarLen,
+					   char* md,
+					   int32_t* mdLen);
+
+/*!	@function	Score many independent read/reference pairs at once, several pairs to a vector.
+	@param	reads	pointers to the read sequences, as numbers (see ssw_init)
+	@param	readLens	lengths of the reads
+	@param	refs	pointers to the reference sequences, as numbers
+	@param	refLens	lengths of the references
+	@param	count	number of pairs
+	@param	mat	substitution matrix, as for ssw_init
+	@param	n	the square root of the number of elements in mat
+	@param	weight_gapO	the absolute value of gap open penalty
+	@param	weight_gapE	the absolute value of gap extension penalty
+	@param	maskLen	as for ssw_align; 0 uses half the length of each read, but at least 15
+	@param	results	array of count alignment results, filled in as ssw_align does with flag 0: the scores and the ending
+					positions, no beginning positions and no cigar
+	@return	0 on success, -1 if memory ran out
+	@note	For short pairs this is several times faster than an ssw_init and ssw_align per pair; the results are the same.
+			Pairs whose scores do not fit in 16 bits are handed to ssw_align.
+*/
+int32_t ssw_score_batch (const int8_t* const* reads,
+					const int32_t* readLens,
+					const int8_t* const* refs,
+					const int32_t* refLens,
+					int32_t count,
+					const int8_t* mat,
+					const int32_t n,
+					const uint8_t weight_gapO,
+					const uint8_t weight_gapE,
+					const int32_t maskLen,
+					s_align* results);
+
+/*!	@abstract	The k-mer ssw_kmers gives a window that holds a symbol standing for more than one base.	*/
+#define SSW_KMER_AMBIGUOUS UINT64_MAX
+
+/*!	@function	Pack every k-mer of a sequence, two bits per base.
+	@param	seq	the sequence, as numbers (see ssw_init)
+	@param	len	length of seq
+	@param	bases	for each number, the base (0 to 3) it stands for, or -1 for a symbol that stands for more than one
+	@param	k	k-mer length, 1 to 31
+	@param	kmers	receives the len - k + 1 k-mers, the one starting at position i in kmers[i]; SSW_KMER_AMBIGUOUS for
+					the windows holding a -1 base
+	@return	the number of k-mers, or -1 if k is out of range
+*/
+int32_t ssw_kmers (const int8_t* seq, int32_t len, const int8_t* bases, int32_t k, uint64_t* kmers);
+
+/*!	@function	Sort k-mers in place, dropping duplicates and SSW_KMER_AMBIGUOUS.
+	@return	the number of distinct k-mers left at the start of kmers
+*/
+int32_t ssw_kmer_sort (uint64_t* kmers, int32_t count);
+
+/*!	@function	Count the k-mers found in a sorted set.
+	@param	kmers	the k-mers to look up, as from ssw_kmers
+	@param	count	number of kmers
+	@param	sorted	the set, as left by ssw_kmer_sort
+	@param	sorted_count	number of k-mers in the set
+	@param	needed	stop counting once this many are found; 0 counts them all
+	@param	found	if not 0, found[i] is set to whether kmers[i] is in the set (up to where counting stopped)
+	@return	the number of k-mers found
+*/
+int32_t ssw_kmer_shared (const uint64_t* kmers, int32_t count, const uint64_t* sorted, int32_t sorted_count, int32_t needed, uint8_t* found);
+
+/*!	@function	Count the k-mers found in a reference by reading through it once, for references seen only once.
+	@param	kmers	the k-mers to look up, as from ssw_kmers; SSW_KMER_AMBIGUOUS ones never count
+	@param	count	number of kmers
+	@param	ref	the reference, as numbers
+	@param	refLen	length of ref
+	@param	bases	as for ssw_kmers; reference windows holding a -1 base are skipped
+	@param	k	k-mer length, 1 to 31
+	@param	needed	stop reading once this many are found; 0 reads the whole reference
+	@return	the number of kmers (counting repeats) that occur in the reference, or -1 on failure
+*/
+int32_t ssw_kmer_scan (const uint64_t* kmers, int32_t count, const int8_t* ref, int32_t refLen, const int8_t* bases, int32_t k,
+					int32_t needed);
+
 /*!	@function		Produce CIGAR 32-bit unsigned integer from CIGAR operation and CIGAR length
 	@param	length		length of CIGAR
 	@param	op_letter	CIGAR operation character ('M', 'I', etc)
@@ -0,0 +1,443 @@
+/*
+ *  ssw_kernel.h
+ *
+ *  The striped Smith-Waterman kernels, written once for any vector width.
+ *  ssw.c includes this file once per instruction set, after defining:
+ *
+ *	SIMD_NAME	suffix of the generated functions
+ *	SIMD_ATTR	function attribute enabling the instruction set
+ *	VEC		vector type, VBYTES bytes wide
+ *	VLOAD, VSTORE	unaligned load and store
+ *	VSET1_8, VSET1_16, VZERO, VAND
+ *	VADDS_U8, VSUBS_U8, VMAX_U8, VADDS_I16, VSUBS_U16, VMAX_I16
+ *	VSHL_BYTES(v, n)	shift the whole vector left (towards higher lanes) by n < 16 bytes
+ *	VSHL_LANES128(v, m)	shift the whole vector left by m 128 bit lanes (zero where the vector is not that wide)
+ *	VANY_GT_U8, VANY_GT_I16	non-zero when any lane of a is greater than that of b
+ *	VALL_EQ_I8, VALL_EQ_I16	non-zero when all lanes are equal
+ *	VHMAX_U8, VHMAX_I16	the largest lane
+ *
+ *  Every macro is undefined again at the end of the file.
+ *
+ *  The lanes past the end of the read are padding.  They never feed back
+ *  into the cells of the read, but they are left out of the column maxima
+ *  so that every vector width reports the same sub-optimal score.
+ */
+
+#define SIMD_CAT2(a, b) a##_##b
+#define SIMD_CAT(a, b) SIMD_CAT2(a, b)
+#define SIMD_FN(name) SIMD_CAT(name, SIMD_NAME)
+
+/* One cell of the inner loop; vHmax is the value taken into the column maximum. */
+#define SW_BYTE_CELL(vHmax) \
+	vH = VADDS_U8(vH, VLOAD(vP + j)); \
+	vH = VSUBS_U8(vH, vBias); /* vH will be always > 0 */ \
+	/* Get max from vH, vE and vF. */ \
+	e = VLOAD(pvE + j); \
+	vH = VMAX_U8(vH, e); \
+	vH = VMAX_U8(vH, vF); \
+	vMaxColumn = VMAX_U8(vMaxColumn, vHmax); \
+	/* Save vH values. */ \
+	VSTORE(pvHStore + j, vH); \
+	/* Update vE value. */ \
+	vH = VSUBS_U8(vH, vGapO); /* saturation arithmetic, result >= 0 */ \
+	e = VSUBS_U8(e, vGapE); \
+	e = VMAX_U8(e, vH); \
+	VSTORE(pvE + j, e); \
+	/* Update vF value. */ \
+	vF = VSUBS_U8(vF, vGapE); \
+	vF = VMAX_U8(vF, vH); \
+	/* Load the next vH. */ \
+	vH = VLOAD(pvHLoad + j)
+
+#define SW_WORD_CELL(vHmax) \
+	vH = VADDS_I16(vH, VLOAD(vP + j)); \
+	/* Get max from vH, vE and vF. */ \
+	e = VLOAD(pvE + j); \
+	vH = VMAX_I16(vH, e); \
+	vH = VMAX_I16(vH, vF); \
+	vMaxColumn = VMAX_I16(vMaxColumn, vHmax); \
+	/* Save vH values. */ \
+	VSTORE(pvHStore + j, vH); \
+	/* Update vE value. */ \
+	vH = VSUBS_U16(vH, vGapO); /* saturation arithmetic, result >= 0 */ \
+	e = VSUBS_U16(e, vGapE); \
+	e = VMAX_I16(e, vH); \
+	VSTORE(pvE + j, e); \
+	/* Update vF value. */ \
+	vF = VSUBS_U16(vF, vGapE); \
+	vF = VMAX_I16(vF, vH); \
+	/* Load the next vH. */ \
+	vH = VLOAD(pvHLoad + j)
+
+/* One step of the prefix scan of F over the lanes: every lane takes the F of the lane bytes below it, less the gap
+   extensions in between (vStep), and the distance doubles for the next step. */
+#define F_SCAN(vmax, vsubs, vadds, bytes) \
+	if (VBYTES > (bytes)) { \
+		vF = vmax(vF, vsubs((bytes) < 16 ? VSHL_BYTES(vF, (bytes) & 15) : VSHL_LANES128(vF, (bytes) >> 4), vStep)); \
+		vStep = vadds(vStep, vStep); \
+	}
+
+/* Lane masks of the segments from padBegin on: all ones for the lanes inside the read, 0 for padding. */
+static SIMD_ATTR VEC* SIMD_FN(pad_mask) (int32_t readLen, int32_t segLen, int32_t lanes, int32_t padBegin) {
+	int32_t size = VBYTES / lanes, j, k;
+	VEC* pvMask = (VEC*)calloc(segLen - padBegin + 1, sizeof(VEC));
+	uint8_t* t = (uint8_t*)pvMask;
+	for (j = padBegin; j < segLen; ++j) {
+		for (k = 0; k < lanes; ++k) {
+			memset(t, j + k * segLen < readLen ? 0xff : 0, size);
+			t += size;
+		}
+	}
+	return pvMask;
+}
+
+static SIMD_ATTR alignment_end* SIMD_FN(sw_byte) (const int8_t* ref,
+							 int8_t ref_dir,	// 0: forward ref; 1: reverse ref
+							 int32_t refLen,
+							 int32_t readLen,
+							 const uint8_t weight_gapO, /* will be used as - */
+							 const uint8_t weight_gapE, /* will be used as - */
+							 const void* profile,
+							 uint8_t terminate,
+	 						 uint8_t bias,
+							 int32_t maskLen) {
+
+	const int32_t lanes = VBYTES;
+	uint8_t max = 0;		                     /* the max alignment score */
+	int32_t end_read = readLen - 1;
+	int32_t end_ref = -1; /* 0_based best alignment ending point; Initialized as isn't aligned -1. */
+	int32_t segLen = (readLen + lanes - 1) / lanes; /* number of segment */
+	int32_t padBegin = readLen - (lanes - 1) * segLen; /* first segment holding padding */
+	const VEC* vProfile = (const VEC*)profile;
+
+	/* array to record the largest score of each reference position */
+	uint8_t* maxColumn = (uint8_t*) calloc(refLen, 1);
+
+	VEC vZero = VZERO();
+
+	VEC* pvHStore = (VEC*) calloc(segLen, sizeof(VEC));
+	VEC* pvHLoad = (VEC*) calloc(segLen, sizeof(VEC));
+	VEC* pvE = (VEC*) calloc(segLen, sizeof(VEC));
+	VEC* pvHmax = (VEC*) calloc(segLen, sizeof(VEC));
+	VEC* pvMask;
+
+	int32_t i, j;
+	VEC vGapO = VSET1_8(weight_gapO);
+	VEC vGapE = VSET1_8(weight_gapE);
+	VEC vLaneGapE = VSET1_8(segLen * weight_gapE > 255 ? 255 : segLen * weight_gapE); /* gap extensions through a lane */
+	VEC vStep;
+	VEC vBias = VSET1_8(bias);
+
+	VEC vMaxScore = vZero; /* Trace the highest score of the whole SW matrix. */
+	VEC vMaxMark = vZero; /* Trace the highest score till the previous column. */
+	int32_t edge, begin = 0, end = refLen, step = 1;
+
+	if (padBegin < 0) padBegin = 0;
+	pvMask = SIMD_FN(pad_mask)(readLen, segLen, lanes, padBegin);
+
+	/* outer loop to process the reference sequence */
+	if (ref_dir == 1) {
+		begin = refLen - 1;
+		end = -1;
+		step = -1;
+	}
+	for (i = begin; LIKELY(i != end); i += step) {
+		VEC e, vF = vZero, vMaxColumn = vZero; /* Initialize F value to 0.
+							   Any errors to vH values will be corrected in the Lazy_F loop.
+							 */
+
+		VEC vH = VLOAD(pvHStore + segLen - 1);
+		vH = VSHL_BYTES(vH, 1); /* Shift the value in vH left by 1 byte. */
+		const VEC* vP = vProfile + ref[i] * segLen; /* Right part of the vProfile */
+
+		/* Swap the 2 H buffers. */
+		VEC* pv = pvHLoad;
+		pvHLoad = pvHStore;
+		pvHStore = pv;
+
+		/* inner loop to process the query sequence; the segments from padBegin on leave the padding out of the
+		   column maximum */
+		for (j = 0; LIKELY(j < padBegin); ++j) {
+			SW_BYTE_CELL(vH);
+		}
+		for (; j < segLen; ++j) {
+			SW_BYTE_CELL(VAND(vH, VLOAD(pvMask + (j - padBegin))));
+		}
+
+		/* Lazy_F loop: has been revised to disallow adjecent insertion and then deletion, so don't update E(i, j), learn from SWPS3.
+		   F has only reached the first segment of each lane from the end of the lane before it; a prefix scan over the
+		   lanes carries it on through whole lanes (segLen gap extensions each), so one pass over the segments is left
+		   however many lanes there are. */
+		vF = VSHL_BYTES(vF, 1);
+		vStep = vLaneGapE;
+		F_SCAN(VMAX_U8, VSUBS_U8, VADDS_U8, 1);
+		F_SCAN(VMAX_U8, VSUBS_U8, VADDS_U8, 2);
+		F_SCAN(VMAX_U8, VSUBS_U8, VADDS_U8, 4);
+		F_SCAN(VMAX_U8, VSUBS_U8, VADDS_U8, 8);
+		F_SCAN(VMAX_U8, VSUBS_U8, VADDS_U8, 16);
+		F_SCAN(VMAX_U8, VSUBS_U8, VADDS_U8, 32);
+		for (j = 0; LIKELY(j < segLen); ++j) {
+			vH = VLOAD(pvHStore + j);
+			vH = VMAX_U8(vH, vF);
+			vMaxColumn = VMAX_U8(vMaxColumn, LIKELY(j < padBegin) ? vH : VAND(vH, VLOAD(pvMask + (j - padBegin))));
+			VSTORE(pvHStore + j, vH);
+			vH = VSUBS_U8(vH, vGapO);
+			vF = VSUBS_U8(vF, vGapE);
+			if (UNLIKELY(! VANY_GT_U8(vF, vH))) break;
+		}
+
+		vMaxScore = VMAX_U8(vMaxScore, vMaxColumn);
+		if (! VALL_EQ_I8(vMaxMark, vMaxScore)) {
+			uint8_t temp;
+			vMaxMark = vMaxScore;
+			temp = VHMAX_U8(vMaxScore);
+
+			if (LIKELY(temp > max)) {
+				max = temp;
+				if (max + bias >= 255) break;	//overflow
+				end_ref = i;
+
+				/* Store the column with the highest alignment score in order to trace the alignment ending position on read. */
+				memcpy(pvHmax, pvHStore, segLen * sizeof(VEC));
+			}
+		}
+
+		/* Record the max score of current column. */
+		maxColumn[i] = VHMAX_U8(vMaxColumn);
+		if (maxColumn[i] == terminate) break;
+	}
+
+	/* Trace the alignment ending position on read. */
+	uint8_t *t = (uint8_t*)pvHmax;
+	int32_t column_len = segLen * lanes;
+	for (i = 0; LIKELY(i < column_len); ++i, ++t) {
+		int32_t temp;
+		if (*t == max) {
+			temp = i / lanes + i % lanes * segLen;
+			if (temp < end_read) end_read = temp;
+		}
+	}
+
+	free(pvMask);
+	free(pvHmax);
+	free(pvE);
+	free(pvHLoad);
+	free(pvHStore);
+
+	/* Find the most possible 2nd best alignment. */
+	alignment_end* bests = (alignment_end*) calloc(2, sizeof(alignment_end));
+	bests[0].score = max + bias >= 255 ? 255 : max;
+	bests[0].ref = end_ref;
+	bests[0].read = end_read;
+
+	bests[1].score = 0;
+	bests[1].ref = 0;
+	bests[1].read = 0;
+
+	edge = (end_ref - maskLen) > 0 ? (end_ref - maskLen) : 0;
+	for (i = 0; i < edge; i ++) {
+		if (maxColumn[i] > bests[1].score) {
+			bests[1].score = maxColumn[i];
+			bests[1].ref = i;
+		}
+	}
+	edge = (end_ref + maskLen) > refLen ? refLen : (end_ref + maskLen);
+	for (i = edge + 1; i < refLen; i ++) {
+		if (maxColumn[i] > bests[1].score) {
+			bests[1].score = maxColumn[i];
+			bests[1].ref = i;
+		}
+	}
+
+	free(maxColumn);
+	return bests;
+}
+
+static SIMD_ATTR alignment_end* SIMD_FN(sw_word) (const int8_t* ref,
+							 int8_t ref_dir,	// 0: forward ref; 1: reverse ref
+							 int32_t refLen,
+							 int32_t readLen,
+							 const uint8_t weight_gapO, /* will be used as - */
+							 const uint8_t weight_gapE, /* will be used as - */
+							 const void* profile,
+							 uint16_t terminate,
+							 int32_t maskLen) {
+
+	const int32_t lanes = VBYTES / 2;
+	uint16_t max = 0;		                     /* the max alignment score */
+	int32_t end_read = readLen - 1;
+	int32_t end_ref = 0; /* 1_based best alignment ending point; Initialized as isn't aligned - 0. */
+	int32_t segLen = (readLen + lanes - 1) / lanes; /* number of segment */
+	int32_t padBegin = readLen - (lanes - 1) * segLen; /* first segment holding padding */
+	const VEC* vProfile = (const VEC*)profile;
+
+	/* array to record the largest score of each reference position */
+	uint16_t* maxColumn = (uint16_t*) calloc(refLen, 2);
+
+	VEC vZero = VZERO();
+
+	VEC* pvHStore = (VEC*) calloc(segLen, sizeof(VEC));
+	VEC* pvHLoad = (VEC*) calloc(segLen, sizeof(VEC));
+	VEC* pvE = (VEC*) calloc(segLen, sizeof(VEC));
+	VEC* pvHmax = (VEC*) calloc(segLen, sizeof(VEC));
+	VEC* pvMask;
+
+	int32_t i, j;
+	VEC vGapO = VSET1_16(weight_gapO);
+	VEC vGapE = VSET1_16(weight_gapE);
+	VEC vLaneGapE = VSET1_16(segLen * weight_gapE > 32767 ? 32767 : segLen * weight_gapE); /* gap extensions through a lane */
+	VEC vStep;
+
+	VEC vMaxScore = vZero; /* Trace the highest score of the whole SW matrix. */
+	VEC vMaxMark = vZero; /* Trace the highest score till the previous column. */
+	int32_t edge, begin = 0, end = refLen, step = 1;
+
+	if (padBegin < 0) padBegin = 0;
+	pvMask = SIMD_FN(pad_mask)(readLen, segLen, lanes, padBegin);
+
+	/* outer loop to process the reference sequence */
+	if (ref_dir == 1) {
+		begin = refLen - 1;
+		end = -1;
+		step = -1;
+	}
+	for (i = begin; LIKELY(i != end); i += step) {
+		VEC e, vF = vZero; /* Initialize F value to 0.
+							   Any errors to vH values will be corrected in the Lazy_F loop.
+							 */
+		VEC vH = VLOAD(pvHStore + segLen - 1);
+		vH = VSHL_BYTES(vH, 2); /* Shift the value in vH left by 2 byte. */
+
+		/* Swap the 2 H buffers. */
+		VEC* pv = pvHLoad;
+
+		VEC vMaxColumn = vZero; /* vMaxColumn is used to record the max values of column i. */
+
+		const VEC* vP = vProfile + ref[i] * segLen; /* Right part of the vProfile */
+		pvHLoad = pvHStore;
+		pvHStore = pv;
+
+		/* inner loop to process the query sequence; the segments from padBegin on leave the padding out of the
+		   column maximum */
+		for (j = 0; LIKELY(j < padBegin); ++j) {
+			SW_WORD_CELL(vH);
+		}
+		for (; j < segLen; ++j) {
+			SW_WORD_CELL(VAND(vH, VLOAD(pvMask + (j - padBegin))));
+		}
+
+		/* Lazy_F loop: has been revised to disallow adjecent insertion and then deletion, so don't update E(i, j), learn from SWPS3.
+		   F has only reached the first segment of each lane from the end of the lane before it; a prefix scan over the
+		   lanes carries it on through whole lanes (segLen gap extensions each), so one pass over the segments is left
+		   however many lanes there are. */
+		vF = VSHL_BYTES(vF, 2);
+		vStep = vLaneGapE;
+		F_SCAN(VMAX_I16, VSUBS_U16, VADDS_I16, 2);
+		F_SCAN(VMAX_I16, VSUBS_U16, VADDS_I16, 4);
+		F_SCAN(VMAX_I16, VSUBS_U16, VADDS_I16, 8);
+		F_SCAN(VMAX_I16, VSUBS_U16, VADDS_I16, 16);
+		F_SCAN(VMAX_I16, VSUBS_U16, VADDS_I16, 32);
+		for (j = 0; LIKELY(j < segLen); ++j) {
+			vH = VLOAD(pvHStore + j);
+			vH = VMAX_I16(vH, vF);
+			vMaxColumn = VMAX_I16(vMaxColumn, LIKELY(j < padBegin) ? vH : VAND(vH, VLOAD(pvMask + (j - padBegin))));
+			VSTORE(pvHStore + j, vH);
+			vH = VSUBS_U16(vH, vGapO);
+			vF = VSUBS_U16(vF, vGapE);
+			if (UNLIKELY(! VANY_GT_I16(vF, vH))) break;
+		}
+
+		vMaxScore = VMAX_I16(vMaxScore, vMaxColumn);
+		if (! VALL_EQ_I16(vMaxMark, vMaxScore)) {
+			uint16_t temp;
+			vMaxMark = vMaxScore;
+			temp = VHMAX_I16(vMaxScore);
+
+			if (LIKELY(temp > max)) {
+				max = temp;
+				end_ref = i;
+				memcpy(pvHmax, pvHStore, segLen * sizeof(VEC));
+			}
+		}
+
+		/* Record the max score of current column. */
+		maxColumn[i] = VHMAX_I16(vMaxColumn);
+		if (maxColumn[i] == terminate) break;
+	}
+
+	/* Trace the alignment ending position on read. */
+	uint16_t *t = (uint16_t*)pvHmax;
+	int32_t column_len = segLen * lanes;
+	for (i = 0; LIKELY(i < column_len); ++i, ++t) {
+		int32_t temp;
+		if (*t == max) {
+			temp = i / lanes + i % lanes * segLen;
+			if (temp < end_read) end_read = temp;
+		}
+	}
+
+	free(pvMask);
+	free(pvHmax);
+	free(pvE);
+	free(pvHLoad);
+	free(pvHStore);
+
+	/* Find the most possible 2nd best alignment. */
+	alignment_end* bests = (alignment_end*) calloc(2, sizeof(alignment_end));
+	bests[0].score = max;
+	bests[0].ref = end_ref;
+	bests[0].read = end_read;
+
+	bests[1].score = 0;
+	bests[1].ref = 0;
+	bests[1].read = 0;
+
+	edge = (end_ref - maskLen) > 0 ? (end_ref - maskLen) : 0;
+	for (i = 0; i < edge; i ++) {
+		if (maxColumn[i] > bests[1].score) {
+			bests[1].score = maxColumn[i];
+			bests[1].ref = i;
+		}
+	}
+	edge = (end_ref + maskLen) > refLen ? refLen : (end_ref + maskLen);
+	for (i = edge; i < refLen; i ++) {
+		if (maxColumn[i] > bests[1].score) {
+			bests[1].score = maxColumn[i];
+			bests[1].ref = i;
+		}
+	}
+
+	free(maxColumn);
+	return bests;
+}
+
+#undef F_SCAN
+#undef SW_BYTE_CELL
+#undef SW_WORD_CELL
+#undef SIMD_FN
+#undef SIMD_CAT
+#undef SIMD_CAT2
+#undef SIMD_NAME
+#undef SIMD_ATTR
+#undef VEC
+#undef VBYTES
+#undef VLOAD
+#undef VSTORE
+#undef VSET1_8
+#undef VSET1_16
+#undef VZERO
+#undef VAND
+#undef VADDS_U8
+#undef VSUBS_U8
+#undef VMAX_U8
+#undef VADDS_I16
+#undef VSUBS_U16
+#undef VMAX_I16
+#undef VSHL_BYTES
+#undef VSHL_LANES128
+#undef VANY_GT_U8
+#undef VANY_GT_I16
+#undef VALL_EQ_I8
+#undef VALL_EQ_I16
+#undef VHMAX_U8
+#undef VHMAX_I16
@@ -0,0 +1,171 @@
+/*
+ *  sswext.c
+ *
+ *  CPython binding for the parts of SSW that run once per alignment: every
+ *  strand's query profile is aligned, the best one is traced back and the
+ *  result is copied out in a single call, without the GIL.
+ *  The ctypes binding in libssw.py stays the general (and fallback) path.
+ */
+
+#define PY_SSIZE_T_CLEAN
+#include <Python.h>
+#include <stdint.h>
+#include <stdlib.h>
+/* ssw.h defines the CIGAR helpers out of line for ctypes, so the library is
+   compiled into this translation unit rather than linked beside it */
+#include "ssw.c"
+
+#define MAX_STRANDS 2
+
+#if PY_MAJOR_VERSION >= 3
+#define BYTES "y"
+#else
+#define BYTES "s"
+#endif
+
+/* Align every profile against ref; the best score (ties going to the first
+   profile) is traced back.  Returns the index of the winner, with its result
+   in *best, or -1 on failure. */
+static int32_t align_strands (const s_profile* const* profs,
+					int32_t count,
+					const int8_t* ref,
+					int32_t refLen,
+					uint8_t gapO,
+					uint8_t gapE,
+					uint8_t flag,
+					uint16_t filters,
+					int32_t filterd,
+					int32_t maskLen,
+					s_align** best) {
+
+	s_align* results[MAX_STRANDS] = {0};
+	int32_t two_pass = count > 1 && flag != 0;
+	int32_t i, winner = -1;
+
+	for (i = 0; i < count; ++i) {
+		results[i] = ssw_align(profs[i], ref, refLen, gapO, gapE, two_pass ? 0 : flag, filters, filterd, maskLen);
+		if (! results[i]) goto end;
+	}
+	winner = 0;
+	for (i = 1; i < count; ++i)
+		if (results[i]->score1 > results[winner]->score1) winner = i;
+	if (two_pass && ssw_traceback(profs[winner], ref, gapO, gapE, flag, filters, filterd, maskLen, results[winner]) != 0) {
+		winner = -1;
+		goto end;
+	}
+	*best = results[winner];
+	results[winner] = 0;
+end:
+	for (i = 0; i < count; ++i)
+		if (results[i]) align_destroy(results[i]);
+	return winner;
+}
+
+/* The profiles are handles from ssw_init (the ctypes binding's copy of the
+   library); every profile carries the kernels it was laid out for, so this
+   copy can align with them.  The caller keeps them alive for the call. */
+static PyObject* sswext_align (PyObject* self, PyObject* args) {
+	PyObject* profiles;
+	Py_buffer ref;
+	int gapO, gapE, flag, filters, filterd, maskLen;
+	const s_profile* profs[MAX_STRANDS];
+	Py_ssize_t count, i;
+	s_align* r = 0;
+	int32_t winner;
+	PyObject* result = NULL;
+
+	if (! PyArg_ParseTuple(args, "O" BYTES "*iiiiii", &profiles, &ref, &gapO, &gapE, &flag, &filters, &filterd, &maskLen))
+		return NULL;
+	if (! PyTuple_Check(profiles) || PyTuple_GET_SIZE(profiles) < 1 || PyTuple_GET_SIZE(profiles) > MAX_STRANDS) {
+		PyErr_SetString(PyExc_TypeError, "profiles must be a tuple of one or two query profile handles");
+		goto done;
+	}
+	if (ref.len > INT32_MAX) {
+		PyErr_SetString(PyExc_OverflowError, "reference is too long");
+		goto done;
+	}
+	count = PyTuple_GET_SIZE(profiles);
+	for (i = 0; i < count; ++i) {
+		profs[i] = (const s_profile*)PyLong_AsVoidPtr(PyTuple_GET_ITEM(profiles, i));
+		if (! profs[i]) {
+			if (! PyErr_Occurred()) PyErr_SetString(PyExc_ValueError, "alignment against a closed query profile");
+			goto done;
+		}
+	}
+
+	Py_BEGIN_ALLOW_THREADS
+	winner = align_strands(profs, (int32_t)count, (const int8_t*)ref.buf, (int32_t)ref.len,
+			(uint8_t)gapO, (uint8_t)gapE, (uint8_t)flag, (uint16_t)filters, filterd, maskLen, &r);
+	Py_END_ALLOW_THREADS
+
+	if (winner < 0) {
+		PyErr_SetString(PyExc_RuntimeError, "SSW alignment failed");
+		goto done;
+	}
+	result = Py_BuildValue("(iiiiiii" BYTES "#)", winner, r->score1, r->score2, r->ref_begin1, r->ref_end1, r->read_begin1, r->read_end1,
+			r->cigar ? (const char*)r->cigar : "", (Py_ssize_t)(r->cigar ? r->cigarLen * sizeof(uint32_t) : 0));
+	align_destroy(r);
+done:
+	PyBuffer_Release(&ref);
+	return result;
+}
+
+static PyObject* sswext_set_simd (PyObject* self, PyObject* args) {
+	int level;
+	if (! PyArg_ParseTuple(args, "i", &level)) return NULL;
+	return Py_BuildValue("i", ssw_set_simd(level));
+}
+
+static PyObject* sswext_stats_enable (PyObject* self, PyObject* args) {
+	int on;
+	if (! PyArg_ParseTuple(args, "i", &on)) return NULL;
+	return Py_BuildValue("i", ssw_stats_enable(on));
+}
+
+static PyObject* sswext_stats (PyObject* self, PyObject* args) {
+	uint64_t counts[SSW_STATS];
+	PyObject* result = PyTuple_New(SSW_STATS);
+	int32_t i;
+	if (! result) return NULL;
+	ssw_stats(counts, SSW_STATS);
+	for (i = 0; i < SSW_STATS; ++i) {
+		PyObject* count = PyLong_FromUnsignedLongLong(counts[i]);
+		if (! count) {
+			Py_DECREF(result);
+			return NULL;
+		}
+		PyTuple_SET_ITEM(result, i, count);
+	}
+	return result;
+}
+
+static PyObject* sswext_stats_reset (PyObject* self, PyObject* args) {
+	ssw_stats_reset();
+	Py_RETURN_NONE;
+}
+
+static PyMethodDef sswext_methods[] = {
+	{"align", sswext_align, METH_VARARGS,
+		"align(profiles, reference, gap_open, gap_extend, flags, filter_score, filter_distance, mask_length)\n\n"
+		"Align one or two query profile handles (from ssw_init) against an encoded reference and trace back the best one.\n"
+		"Returns (profile index, score, score2, ref_begin, ref_end, query_begin, query_end, packed cigar)."},
+	{"set_simd", sswext_set_simd, METH_VARARGS, "set_simd(level): as ssw_set_simd"},
+	{"stats_enable", sswext_stats_enable, METH_VARARGS, "stats_enable(on): as ssw_stats_enable, for the binding's copy of the library"},
+	{"stats", sswext_stats, METH_NOARGS, "stats(): the binding's native counters, as a tuple in SSW_STAT order"},
+	{"stats_reset", sswext_stats_reset, METH_NOARGS, "stats_reset(): as ssw_stats_reset"},
+	{NULL, NULL, 0, NULL}
+};
+
+#if PY_MAJOR_VERSION >= 3
+static struct PyModuleDef sswext_module = {
+	PyModuleDef_HEAD_INIT, "_sswext", NULL, -1, sswext_methods
+};
+
+PyMODINIT_FUNC PyInit__sswext (void) {
+	return PyModule_Create(&sswext_module);
+}
+#else
+PyMODINIT_FUNC init_sswext (void) {
+	Py_InitModule("_sswext", sswext_methods);
+}
+#endif
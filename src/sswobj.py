@@ -1,11 +1,41 @@
+import sys
+import time
+import threading
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+from array import array
 import six
 from six.moves import range
 from . import libssw
 from . import iupac
 
-__all__ = ["ScoreMatrix", "NucleotideScoreMatrix", "Aligner", "Alignment"]
+__all__ = ["ScoreMatrix", "NucleotideScoreMatrix", "EncodedSequence", "QueryProfile", "Aligner", "Alignment"]
+
+STRANDS = ("+", "-", "both")
+
+_clock = getattr(time, "perf_counter", time.time)
+
+# translation table entry for bytes that are not part of the alphabet
+UNKNOWN_SYMBOL = 0xff
+MAX_ALPHABET_SIZE = 0x7f
+
+def _numpy_array(seq):
+    # numpy is never imported by us, but if the caller hands us an array
+    # then it is already loaded and we can use it for the bulk operations
+    np = sys.modules.get("numpy")
+    if np is not None and isinstance(seq, np.ndarray):
+        return np
+    return None
+
+def _byte_view(seq):
+    view = memoryview(seq)
+    if view.itemsize != 1:
+        raise TypeError("sequence buffers must have an item size of one byte, not %d" % view.itemsize)
+    return view
 
 class ScoreMatrix(object):
+    complement_table = None
+
     def __init__(self, alphabet=None, match=2, mismatch=-2):
         self._match = match
         self._mismatch = mismatch
@@ -44,9 +74,28 @@ class ScoreMatrix(object):
     def set_alphabet(self, alphabet):
         self._alphabet = tuple(alphabet) if alphabet else tuple()
         self.symbol_map = {symbol.upper(): idx for (idx, symbol) in enumerate(self._alphabet)}
+        self._init_tables()
         self._init_matrix()
     alphabet = property(get_alphabet, set_alphabet)
 
+    def _init_tables(self):
+        # 256 entry tables to translate between bytes and symbol indices
+        if len(self.symbol_map) > MAX_ALPHABET_SIZE:
+            raise ValueError("alphabet is limited to %d symbols" % MAX_ALPHABET_SIZE)
+        encode_table = bytearray([UNKNOWN_SYMBOL]) * 0x100
+        decode_table = bytearray(b'?') * 0x100
+        for (symbol, idx) in self.symbol_map.items():
+            if len(symbol) != 1 or ord(symbol) > 0xff or ord(symbol.lower()) > 0xff:
+                raise ValueError("alphabet symbol %r is not a single byte character" % symbol)
+            encode_table[ord(symbol)] = idx
+            encode_table[ord(symbol.lower())] = idx
+            decode_table[idx] = ord(symbol)
+        self._encode_table = bytes(encode_table)
+        self._decode_table = bytes(decode_table)
+        self._valid_codes = bytes(bytearray(range(len(self._alphabet))))
+        # test_match for every (reference, query) pair of symbol indices
+        self._match_table = bytes(bytearray(int(self.test_match(row, col)) for row in self._alphabet for col in self._alphabet))
+
     def _init_matrix(self):
         _matrix_type = libssw.matrix_type * (len(self.alphabet) ** 2)
         self._matrix = _matrix_type(*self.iter_matrix())
@@ -63,18 +112,77 @@ class ScoreMatrix(object):
         return symbol_1.upper() == symbol_2.upper()
 
     def convert_sequence_to_ints(self, seq):
-        seq = seq.upper()
-        _seq_type = libssw.symbol_type * len(seq)
-        _seq_instance = _seq_type()
-        for (idx, symbol) in enumerate(seq):
-            _seq_instance[idx] = self.symbol_map[symbol]
-        return _seq_instance
+        # one bulk translation through the encode table, no per symbol loop
+        if isinstance(seq, six.text_type):
+            try:
+                raw = seq.encode("latin-1")
+            except UnicodeEncodeError as err:
+                self._unknown_symbol(seq, err.start)
+        else:
+            raw = seq
+        np = _numpy_array(raw)
+        if np is not None:
+            table = np.frombuffer(self._encode_table, dtype=np.uint8)
+            codes = table.take(raw.view(np.uint8).ravel())
+            unknown = np.flatnonzero(codes == UNKNOWN_SYMBOL)
+            if len(unknown):
+                self._unknown_symbol(seq, int(unknown[0]))
+            return codes
+        if not isinstance(raw, (bytes, bytearray)):
+            raw = _byte_view(raw).tobytes()
+        codes = raw.translate(self._encode_table)
+        pos = codes.find(six.int2byte(UNKNOWN_SYMBOL))
+        if pos != -1:
+            self._unknown_symbol(seq, pos)
+        return codes
+
+    def convert_ints_to_sequence(self, codes):
+        np = _numpy_array(codes)
+        if np is not None:
+            codes = codes.view(np.uint8).tobytes()
+        elif not isinstance(codes, (bytes, bytearray)):
+            codes = _byte_view(codes).tobytes()
+        return bytes(codes.translate(self._decode_table)).decode("latin-1")
+
+    def check_codes(self, codes):
+        # pre-encoded buffers must only hold indices into our alphabet
+        np = _numpy_array(codes)
+        if np is not None:
+            invalid = np.flatnonzero(codes.view(np.uint8).ravel() >= len(self._alphabet))
+            pos = int(invalid[0]) if len(invalid) else -1
+        else:
+            if not isinstance(codes, (bytes, bytearray)):
+                codes = _byte_view(codes).tobytes()
+            pos = -1
+            if codes.translate(None, self._valid_codes):
+                pos = next(idx for (idx, code) in enumerate(bytearray(codes)) if code >= len(self._alphabet))
+        if pos != -1:
+            raise ValueError("Invalid symbol code %d at position %d" % (bytearray(codes[pos:pos + 1])[0], pos))
+
+    def _unknown_symbol(self, seq, pos):
+        symbol = seq[pos:pos + 1]
+        if not isinstance(symbol, six.string_types):
+            symbol = bytes(bytearray(symbol))
+        raise ValueError("Unknown symbol %r at position %d" % (symbol, pos))
 
 class NucleotideScoreMatrix(ScoreMatrix):
     def __init__(self, alphabet=None, **kw):
         alphabet = alphabet if alphabet is not None else iupac.NucleotideAlphabet
         super(NucleotideScoreMatrix, self).__init__(alphabet=alphabet, **kw)
 
+    def _init_tables(self):
+        super(NucleotideScoreMatrix, self)._init_tables()
+        # complement in symbol index space, so encoded sequences can be
+        # reverse complemented without going back through text
+        complement_table = bytearray(range(0x100))
+        for (symbol, idx) in self.symbol_map.items():
+            complement = iupac.NucleotideTable.get(symbol, {}).get("complement")
+            if complement not in self.symbol_map:
+                self.complement_table = None
+                return
+            complement_table[idx] = self.symbol_map[complement]
+        self.complement_table = bytes(complement_table)
+
     def test_match(self, symbol_1, symbol_2):
         _sym_1 = symbol_1.upper()
         _sym_2 = symbol_2.upper()
@@ -85,12 +193,189 @@ class NucleotideScoreMatrix(ScoreMatrix):
             return (_sym_2 in matches)
         return super(NucleotideScoreMatrix, self).test_match(symbol_1, symbol_2)
 
+class EncodedSequence(object):
+    def __init__(self, sequence, matrix):
+        self.sequence = sequence
+        self.matrix = matrix
+        self._set_codes(matrix.convert_sequence_to_ints(sequence))
+
+    @classmethod
+    def from_codes(cls, codes, matrix, sequence=None):
+        # wrap a buffer that is already in the matrix symbol space
+        matrix.check_codes(codes)
+        encoded = cls.__new__(cls)
+        encoded.sequence = sequence
+        encoded.matrix = matrix
+        encoded._set_codes(codes)
+        return encoded
+
+    def __getstate__(self):
+        if isinstance(self.sequence, six.string_types):
+            state = (self.sequence, self.matrix, None)
+        else:
+            state = (None, self.matrix, _byte_view(self._codes).tobytes())
+        return state
+
+    def __setstate__(self, state):
+        (self.sequence, self.matrix, codes) = state
+        if codes is None:
+            codes = self.matrix.convert_sequence_to_ints(self.sequence)
+        self._set_codes(codes)
+
+    def _set_codes(self, codes):
+        self._codes = codes
+        self._text = None
+        # lets ctypes pass us straight through as an int8_t*
+        self._as_parameter_ = libssw.symbol_pointer(codes)
+
+    def __len__(self):
+        return len(self._codes)
+
+    @property
+    def codes(self):
+        return self._codes
+
+    @property
+    def text(self):
+        if isinstance(self.sequence, six.string_types):
+            return self.sequence
+        if self._text is None:
+            self._text = self.matrix.convert_ints_to_sequence(self._codes)
+        return self._text
+
+    def reverse_complement(self):
+        table = self.matrix.complement_table
+        if table is None:
+            return EncodedSequence(iupac.nucleotide_reverse_complement(self.text), self.matrix)
+        sequence = None
+        if isinstance(self.sequence, six.string_types):
+            sequence = iupac.nucleotide_reverse_complement(self.sequence)
+        np = _numpy_array(self._codes)
+        if np is not None:
+            codes = np.frombuffer(table, dtype=np.uint8).take(self._codes[::-1])
+        else:
+            codes = self._codes
+            if not isinstance(codes, (bytes, bytearray)):
+                codes = _byte_view(codes).tobytes()
+            codes = codes[::-1].translate(table)
+        encoded = EncodedSequence.__new__(EncodedSequence)
+        encoded.sequence = sequence
+        encoded.matrix = self.matrix
+        encoded._set_codes(codes)
+        return encoded
+
+class QueryProfile(object):
+    def __init__(self, query, matrix, score_size=None, strand="+"):
+        # ssw_init keeps pointers to both the query and the matrix, so we
+        # hold references to them for as long as the native profile lives.
+        # score_size defaults to the narrowest width the query can score
+        # in: 8 bits when even a perfect match stays below 255, otherwise
+        # 8 bits with the 16 bit profile built on the first overflow.
+        self.query = query
+        self.matrix = matrix
+        if score_size is None:
+            score_size = libssw.ssw_score_size(len(query), matrix._matrix, len(matrix.alphabet))
+        self.score_size = score_size
+        self.strand = strand
+        self._reverse_complement = None
+        self._matrix = matrix._matrix
+        self._profile = libssw.ssw_profile_init(query, len(query), self._matrix, len(matrix.alphabet), score_size)
+
+    def __len__(self):
+        return len(self.query)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __del__(self):
+        self.close()
+
+    @property
+    def closed(self):
+        return not self._profile
+
+    @property
+    def widths(self):
+        # the score widths (in bits) profiled so far
+        if self.closed:
+            return ()
+        widths = libssw.ssw_profile_widths(self._profile)
+        return tuple(width for (bit, width) in ((1, 8), (2, 16)) if widths & bit)
+
+    def close(self):
+        profile = getattr(self, "_profile", None)
+        if profile:
+            self._profile = None
+            libssw.ssw_profile_del(profile)
+        if getattr(self, "_reverse_complement", None) is not None:
+            self._reverse_complement.close()
+
+    def reverse_complement(self):
+        # built on first use and then kept for as long as this profile,
+        # so two-strand alignment against many references only pays once
+        profile = self._reverse_complement
+        if profile is None:
+            if self.closed:
+                raise ValueError("reverse complement of a closed query profile")
+            strand = "-" if self.strand == "+" else "+"
+            profile = QueryProfile(self.query.reverse_complement(), self.matrix, self.score_size, strand)
+            self._reverse_complement = profile
+        return profile
+
+def _identity(obj):
+    # sequences stand for themselves, anything else for the object
+    if isinstance(obj, (six.string_types, bytes)):
+        return obj
+    return id(obj)
+
+def _pair_key(pair):
+    try:
+        (query, reference) = pair
+    except (TypeError, ValueError):
+        return id(pair)
+    return (_identity(query), _identity(reference))
+
+def _unaligned_result():
+    return libssw.AlignmentResult(ref_begin=-1, ref_end=-1, query_begin=-1, query_end=-1, ref_end2=-1)
+
+def _dedupe(items, key):
+    # (the distinct items, and for every item the index of its distinct one)
+    seen = {}
+    unique = []
+    inverse = []
+    for item in items:
+        item_key = key(item)
+        idx = seen.get(item_key)
+        if idx is None:
+            idx = seen[item_key] = len(unique)
+            unique.append(item)
+        inverse.append(idx)
+    return (unique, inverse)
+
 class Aligner(object):
-    def __init__(self, reference=None, matrix=None, molecule="dna", gap_open=3, gap_extend=1):
+    def __init__(self, reference=None, matrix=None, molecule="dna", gap_open=3, gap_extend=1, cache=None, prefilter=None, instrument=None):
+        # cache is a cache.AlignmentCache (or True for one with the default
+        # bounds) that align() and align_many() look alignments up in.
+        # prefilter is a prefilter.KmerPrefilter: align(), align_many() and
+        # score_many() then skip the pairs it rules out, which come back
+        # unaligned.  instrument is an instrument.Instrumentation (or True
+        # for one without a hook) that times every stage, see stats().
+        if cache is True:
+            from . cache import AlignmentCache
+            cache = AlignmentCache()
+        if instrument is True:
+            from . instrument import Instrumentation
+            instrument = Instrumentation()
+        self.cache = cache
+        self.instrument = instrument
+        self.prefilter = prefilter
         self.reference = reference
         self.matrix = matrix
         self.molecule = molecule
-        if self.matrix == None and molecule != None:
+        if self.matrix is None and molecule is not None:
             if molecule == "dna":
                 self.matrix = NucleotideScoreMatrix()
             else:
@@ -100,129 +385,858 @@ class Aligner(object):
         if self.gap_open <= self.gap_extend:
             raise ValueError("gap_open must always be greater than gap_extend")
 
-    def align(self, query='', reference=None, revcomp=True):
+    def __getstate__(self):
+        # the last query profile and the encoded reference hold native
+        # state, and are rebuilt on first use
+        state = self.__dict__.copy()
+        state.pop("_last_profile", None)
+        state["_encoded_reference"] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+
+    def stats(self):
+        # a snapshot of the instrumentation counters, or None without it
+        if self.instrument is None:
+            return None
+        return self.instrument.snapshot()
+
+    def get_reference(self):
+        return self._reference
+
+    def set_reference(self, reference):
+        self._reference = reference
+        self._encoded_reference = None
+        self._index = None
+    reference = property(get_reference, set_reference)
+
+    def get_index(self):
+        return self._index
+
+    def set_index(self, index):
+        # an index.ReferenceIndex of the aligner's reference; align() then
+        # only aligns against the windows of the reference that hold seeds
+        if index is not None and (self.reference is None or not index.matches(self.encode(self.reference))):
+            raise ValueError("reference index was not built from the aligner's reference")
+        self._index = index
+    index = property(get_index, set_index)
+
+    def build_index(self, k=None):
+        from . import index
+        if self.reference is None:
+            raise ValueError("building a reference index needs a reference")
+        self._index = index.ReferenceIndex(self.encode(self.reference), k=k or index.DEFAULT_KMER)
+        return self._index
+
+    def load_index(self, path):
+        from . import index
+        self.index = index.ReferenceIndex.load(path, self.matrix)
+        return self.index
+
+    def _strand(self, strand, revcomp=True):
+        if strand is None:
+            strand = "both" if revcomp else "+"
+        if strand not in STRANDS:
+            raise ValueError("strand must be one of %s, not %r" % (str.join(", ", STRANDS), strand))
+        return strand
+
+    def _query_profile(self, query):
+        # align() holds on to the profiles of the last query it saw, so the
+        # same query against a run of references is only profiled once.
+        # The old profile is released by the garbage collector rather than
+        # closed here, since another thread may still be aligning with it.
+        cached = getattr(self, "_last_profile", None)
+        if cached is not None and cached[1].matrix is self.matrix:
+            if cached[0] is query or (isinstance(query, six.string_types) and isinstance(cached[0], six.string_types) and cached[0] == query):
+                return cached[1]
+            if isinstance(query, EncodedSequence) and isinstance(cached[0], EncodedSequence) and _byte_view(cached[0].codes) == _byte_view(query.codes):
+                return cached[1]
+        profile = self.profile(query)
+        self._last_profile = (query, profile)
+        return profile
+
+    def _check_matrix(self, encoded):
+        if encoded.matrix is not self.matrix and not (encoded.matrix == self.matrix):
+            raise ValueError("sequence was encoded with a different score matrix")
+
+    def encode(self, sequence):
+        if isinstance(sequence, EncodedSequence):
+            self._check_matrix(sequence)
+            return sequence
+        if sequence is self._reference and sequence is not None:
+            # the aligner's own reference is encoded once and reused
+            encoded = self._encoded_reference
+            if encoded is None or encoded.matrix is not self.matrix:
+                encoded = self._encoded_reference = self._encode(sequence)
+            return encoded
+        return self._encode(sequence)
+
+    def _encode(self, sequence):
+        start = self.instrument and _clock()
+        encoded = EncodedSequence(sequence, self.matrix)
+        if start:
+            self.instrument.record("encode", start)
+        return encoded
+
+    def open_reference_store(self, path):
+        # an encoded reference file (see refstore.write_reference_store),
+        # memory mapped; its contigs are references for this aligner
+        from . import refstore
+        return refstore.ReferenceStore(path, self.matrix)
+
+    def profile(self, query, score_size=None):
+        query = self.encode(query)
+        start = self.instrument and _clock()
+        profile = QueryProfile(query, self.matrix, score_size=score_size)
+        if start:
+            self.instrument.record("profile", start)
+        return profile
+
+    def align(self, query='', reference=None, revcomp=True, score_only=False, min_score=None, max_span=None, strand=None, band=None):
         # XXX: I really don't find this part of SSW useful, which
         # is why i broke alignment into two stages, so you can use 
         # the low level interface if you wish.
-        filter_score = 0
-        filter_distance = 0
-        flags = 1
-        mask_length = max(15, len(query) // 2)
-        reference = reference if reference != None else self.reference
-        res = self._align(query, reference, flags, filter_score, filter_distance, mask_length)
-        if revcomp:
-            query_rc = iupac.nucleotide_reverse_complement(query)
-            res_rc = self._align(query_rc, reference, flags, filter_score, filter_distance, mask_length)
-            if res_rc.score > res.score:
-                res = res_rc
-        return res
-    
-    def _align(self, query, reference, flags, filter_score, filter_distance, mask_length, score_size=2): 
-        _query = self.matrix.convert_sequence_to_ints(query)
-        _reference = self.matrix.convert_sequence_to_ints(reference)
-        profile = libssw.ssw_profile_init(_query, len(query), self.matrix._matrix, len(self.matrix.alphabet), score_size)
+        # band is a (diagonal, width) pair: only the reference positions
+        # within width of query position + diagonal are aligned, see
+        # _align_banded.
+        strand = self._strand(strand, revcomp)
+        band = self._band(band)
+        indexed = band is None and self._index is not None and (reference is None or reference is self._reference)
+        if self.cache is None or (reference is None and self.reference is None):
+            return self._align(query, reference, strand, score_only, min_score, max_span, indexed, band)
+        # the key's encodings are handed on, so a miss encodes nothing twice
+        query = self.encode(query)
+        if reference is not None:
+            reference = self.encode(reference)
+        key = self._cache_key(query, reference if reference is not None else self.encode(self.reference), strand, score_only, min_score, max_span, indexed, band)
+        alignment = self.cache.get(key)
+        if alignment is None:
+            alignment = self._align(query, reference, strand, score_only, min_score, max_span, indexed, band)
+            self.cache.put(key, alignment)
+        return alignment
+
+    def _align(self, query, reference, strand, score_only, min_score, max_span, indexed, band=None):
+        if self.prefilter is not None:
+            query = self.encode(query)
+            encoded = self.encode(reference if reference is not None else self.reference)
+            if not self.prefilter.passes(self, query, encoded, strand):
+                if strand == "-":
+                    return self._unaligned(query.reverse_complement(), encoded, "-")
+                return self._unaligned(query, encoded, "+")
+        if indexed:
+            return self._align_indexed(query, strand, score_only=score_only, min_score=min_score, max_span=max_span)
+        reference = reference if reference is not None else self.reference
+        if band is not None:
+            return self._align_banded(query, reference, strand, band, score_only, min_score, max_span)
+        profile = self._query_profile(query)
+        if libssw.extension is not None:
+            return self._align_native(profile, reference, strand, score_only, min_score, max_span)
+        return self.align_profile(profile, reference, score_only=score_only, min_score=min_score, max_span=max_span, strand=strand)
+
+    def _align_native(self, profile, reference, strand, score_only=False, min_score=None, max_span=None):
+        # align_profile in one call to the compiled binding, with the same
+        # (cached) profiles: the same results, without a ctypes round trip
+        # for every step
+        (profiles, reference, flags, filter_score, filter_distance, mask_length) = self._align_args(profile, reference, score_only, min_score, max_span, strand)
         if self.gap_open <= self.gap_extend:
             raise ValueError("gap_open must always be greater than gap_extend")
-        alignment = libssw.ssw_align_init(profile, _reference, len(_reference), self.gap_open, self.gap_extend, flags, filter_score, filter_distance, mask_length) 
-        alignment_instance = Alignment(alignment, query, reference, self.matrix)
-        libssw.ssw_profile_del(profile)
-        libssw.ssw_align_del(alignment)
-        return alignment_instance
+        start = self.instrument and _clock()
+        result = libssw.extension.align(
+            tuple(strand_profile._profile for strand_profile in profiles), reference.codes,
+            self.gap_open, self.gap_extend, flags, filter_score, filter_distance, mask_length)
+        if start:
+            self.instrument.record("align", start, len(profiles))
+        profile = profiles[result[0]]
+        return self._alignment(result[1:], profile.query, reference, profile.strand)
+
+    def _alignment(self, result, query, reference, strand):
+        start = self.instrument and _clock()
+        alignment = Alignment(result, query, reference, self.matrix, strand=strand)
+        if start:
+            self.instrument.record("alignment", start)
+        return alignment
+
+    def _cache_key(self, query, reference, strand, score_only=False, min_score=None, max_span=None, indexed=False, band=None):
+        return self.cache.key(self, query, reference, strand, bool(score_only), min_score, max_span, indexed, band)
+
+    def _band(self, band):
+        if band is None:
+            return None
+        try:
+            (diagonal, width) = (int(band[0]), int(band[1]))
+        except (TypeError, ValueError, IndexError):
+            raise ValueError("band must be a (diagonal, width) pair, not %r" % (band,))
+        if width < 0:
+            raise ValueError("band width must not be negative")
+        return (diagonal, width)
+
+    def _align_banded(self, query, reference, strand, band, score_only=False, min_score=None, max_span=None):
+        # Scores and traces back only the cells within width diagonals of
+        # the band's, so the work grows with the query length times the
+        # width rather than with the reference.  The band's diagonal is the
+        # reference position minus the query position (of the strand being
+        # aligned).  band_limited is set on the result when the alignment
+        # reaches the edge of the band, or the band misses the reference: a
+        # better one may lie outside it, and a full alignment is the way to
+        # find out.
+        if self.gap_open <= self.gap_extend:
+            raise ValueError("gap_open must always be greater than gap_extend")
+        query = self.encode(query)
+        reference = self.encode(reference)
+        (diagonal, width) = band
+        (flags, filter_score, filter_distance) = self._align_flags(score_only, min_score, max_span)
+        if strand == "+":
+            queries = [(query, "+")]
+        elif strand == "-":
+            queries = [(query.reverse_complement(), "-")]
+        else:
+            queries = [(query, "+"), (query.reverse_complement(), "-")]
+        best = None
+        edge = libssw.c_int32()
+        for (strand_query, query_strand) in queries:
+            start = self.instrument and _clock()
+            result = libssw.ssw_align_banded(
+                strand_query, len(strand_query), reference, len(reference), self.matrix._matrix, len(self.matrix.alphabet),
+                self.gap_open, self.gap_extend, diagonal, width, flags, filter_score, filter_distance,
+                max(15, len(query) // 2), libssw.byref(edge))
+            if start:
+                self.instrument.record("banded", start)
+            if not result:
+                raise RuntimeError("SSW alignment failed")
+            try:
+                if best is None or result.contents.score > best.score:
+                    best = self._alignment(result, strand_query, reference, query_strand)
+                    best.band_limited = bool(edge.value)
+            finally:
+                libssw.ssw_align_del(result)
+        return best
+
+    def _align_indexed(self, query, strand, **kw):
+        # Seed and extend: only the windows around the diagonals hit by
+        # k-mers of the query are aligned, and the best of them is mapped
+        # back onto the whole reference.  The windows are padded by the
+        # longest gap a positive score can pay for, so whenever the best
+        # alignment holds a seed the result is the exhaustive one; score2
+        # only covers the windows.
+        reference = self.encode(self._reference)
+        profile = self._query_profile(query)
+        profiles = {"+": [profile], "-": [profile.reverse_complement()], "both": [profile, profile.reverse_complement()]}[strand]
+        max_score = max(self.matrix.iter_matrix()) * len(profile)
+        pad = max(0, (max_score - self.gap_open) // self.gap_extend + 1)
+        codes = reference.codes
+        best = None
+        for strand_profile in profiles:
+            for (start, stop) in self._index.windows(strand_profile.query, pad):
+                window = EncodedSequence.from_codes(codes[start:stop], self.matrix)
+                alignment = self.align_profile(strand_profile, window, **kw)
+                if best is None or alignment.score > best[0].score:
+                    best = (alignment, start)
+        if best is None:
+            return self._unaligned(profiles[0].query, reference, profiles[0].strand)
+        (alignment, start) = best
+        if alignment.reference_begin >= 0:
+            alignment.reference_begin += start
+        if alignment.reference_end >= 0:
+            alignment.reference_end += start
+        alignment._reference = reference
+        return alignment
+
+    def _unaligned(self, query, reference, strand):
+        # score 0 and no positions, for pairs that were never aligned; query
+        # is the one of the strand
+        return Alignment(_unaligned_result(), query, reference, self.matrix, strand=strand)
+
+    def _align_flags(self, score_only=False, min_score=None, max_span=None):
+        # score_only skips the reverse pass and the traceback altogether;
+        # min_score and max_span only build a CIGAR for alignments scoring
+        # at least min_score and spanning at most max_span bases on both
+        # the query and the reference.
+        if score_only:
+            return (libssw.FLAG_MASK_SCORE_ONLY, 0, 0)
+        flags = filter_score = filter_distance = 0
+        if min_score is not None:
+            flags |= libssw.FLAG_MASK_FILTER_SCORE
+            filter_score = max(0, min(int(min_score), 0xffff))
+        if max_span is not None:
+            flags |= libssw.FLAG_MASK_FILTER_DISTANCE
+            filter_distance = max(0, int(max_span) - 1)
+        if not flags:
+            flags = libssw.FLAG_MASK_BUILD_CIGAR
+        return (flags, filter_score, filter_distance)
+
+    def align_many(self, queries, reference=None, revcomp=True, workers=None, ordered=True, chunksize=16, strand=None, columnar=False, **kw):
+        # With a reference (or one set on the aligner), queries is an
+        # iterable of query sequences, otherwise of (query, reference)
+        # pairs.  The native alignment runs without the GIL, so a pool of
+        # threads scales with the cores.  Ordered results come back as a
+        # list in input order, unordered results as a generator of
+        # (index, alignment) tuples in completion order.  columnar results
+        # come back in input order as a columnar.AlignmentTable, which
+        # needs numpy.  Any other keywords (score_only, min_score,
+        # max_span) are passed through to align_profile.  For ordered and
+        # columnar results each distinct pair is only aligned once, and
+        # duplicates share its Alignment.
+        strand = self._strand(strand, revcomp)
+        reference = reference if reference is not None else self.reference
+        if reference is not None:
+            reference = self.encode(reference)
+            pairs = ((query, reference) for query in queries)
+        else:
+            pairs = queries
+        batch = _AlignBatch(self, strand, **kw)
+        workers = workers if workers is not None else multiprocessing.cpu_count()
+        if columnar or ordered:
+            (pairs, inverse) = _dedupe(pairs, _pair_key)
+        if columnar:
+            table = batch.run_columnar(pairs, workers, chunksize)
+            return table.take(inverse) if len(pairs) < len(inverse) else table
+        if workers <= 1:
+            results = batch.run(enumerate(pairs))
+        else:
+            results = batch.run_pool(enumerate(pairs), workers, ordered, chunksize)
+        if ordered:
+            results = [alignment for (idx, alignment) in results]
+            return [results[idx] for idx in inverse]
+        return results
+
+    def score_many(self, queries, reference=None, revcomp=True, strand=None, traceback_score=None, columnar=False):
+        # Scores and ending positions, as align(score_only=True) gives them,
+        # for many (mostly short) pairs at once: the native batch scorer
+        # runs several pairs side by side in each vector instead of
+        # profiling and aligning one pair at a time.  queries are as for
+        # align_many.  Pairs scoring at least traceback_score are aligned
+        # again in full on their best strand, to get their start positions
+        # and CIGAR.  Results come back in input order, as a list of
+        # Alignments or, with columnar, as a columnar.AlignmentTable;
+        # duplicate pairs are scored once.
+        strand = self._strand(strand, revcomp)
+        reference = reference if reference is not None else self.reference
+        if reference is not None:
+            reference = self.encode(reference)
+            (queries, inverse) = _dedupe(queries, _identity)
+            pairs = [(self.encode(query), reference) for query in queries]
+        else:
+            (queries, inverse) = _dedupe(queries, _pair_key)
+            # runs of the same reference object are encoded once
+            pairs = []
+            last = encoded = None
+            for pair in queries:
+                try:
+                    (query, reference) = pair
+                except (TypeError, ValueError):
+                    raise ValueError("score_many needs a reference or (query, reference) pairs")
+                if encoded is None or reference is not last:
+                    (last, encoded) = (reference, self.encode(reference))
+                pairs.append((self.encode(query), encoded))
+        if strand == "+":
+            lanes = [(query, reference, "+") for (query, reference) in pairs]
+        elif strand == "-":
+            lanes = [(query.reverse_complement(), reference, "-") for (query, reference) in pairs]
+        else:
+            lanes = [(query, reference, "+") for (query, reference) in pairs]
+            lanes += [(query.reverse_complement(), reference, "-") for (query, reference) in pairs]
+        if self.prefilter is not None and pairs:
+            # pairs the prefilter rules out stay unaligned on every strand
+            pruned = [not self.prefilter.passes(self, query, reference, strand) for (query, reference) in pairs]
+            results = self._score_batch(lanes, pruned * (len(lanes) // len(pairs)))
+        else:
+            results = self._score_batch(lanes)
+        # the best strand of each pair, ties going to "+"
+        best = list(range(len(pairs)))
+        for idx in range(len(pairs), len(lanes)):
+            if results[idx].score > results[idx - len(pairs)].score:
+                best[idx - len(pairs)] = idx
+        if columnar:
+            table = self._score_table(pairs, lanes, results, best, traceback_score)
+            return table.take(inverse) if len(pairs) < len(inverse) else table
+        alignments = []
+        for (row, idx) in enumerate(best):
+            (query, reference, lane_strand) = lanes[idx]
+            if traceback_score is not None and results[idx].score >= traceback_score:
+                with self.profile(pairs[row][0]) as profile:
+                    alignments.append(self.align_profile(profile, reference, strand=lane_strand))
+            else:
+                alignments.append(Alignment(results[idx], query, reference, self.matrix, strand=lane_strand))
+        return [alignments[idx] for idx in inverse]
+
+    def _score_batch(self, lanes, skip=None):
+        # skip marks the lanes to leave unaligned
+        if self.gap_open <= self.gap_extend:
+            raise ValueError("gap_open must always be greater than gap_extend")
+        if skip is not None and any(skip):
+            kept = [idx for idx in range(len(lanes)) if not skip[idx]]
+            scored = self._score_batch([lanes[idx] for idx in kept])
+            results = (libssw.AlignmentResult * len(lanes))(*[_unaligned_result()] * len(lanes))
+            for (pos, idx) in enumerate(kept):
+                results[idx] = scored[pos]
+            return results
+        count = len(lanes)
+        queries = (libssw.symbol_p * count)(*[query._as_parameter_ for (query, reference, strand) in lanes])
+        query_lengths = (libssw.c_int32 * count)(*[len(query) for (query, reference, strand) in lanes])
+        references = (libssw.symbol_p * count)(*[reference._as_parameter_ for (query, reference, strand) in lanes])
+        reference_lengths = (libssw.c_int32 * count)(*[len(reference) for (query, reference, strand) in lanes])
+        results = (libssw.AlignmentResult * count)()
+        start = self.instrument and _clock()
+        if count and libssw.ssw_score_batch(queries, query_lengths, references, reference_lengths, count, self.matrix._matrix, len(self.matrix.alphabet), self.gap_open, self.gap_extend, 0, results) != 0:
+            raise RuntimeError("SSW batch scoring failed")
+        if start:
+            self.instrument.record("batch", start, count)
+        return results
+
+    def _score_table(self, pairs, lanes, results, best, traceback_score):
+        from . import columnar
+        writer = columnar._TableWriter(len(best))
+        chunk = writer.chunk()
+        for (row, idx) in enumerate(best):
+            (query, reference, lane_strand) = lanes[idx]
+            if traceback_score is not None and results[idx].score >= traceback_score:
+                with self.profile(pairs[row][0]) as profile:
+                    (profile, alignment) = self._align_result(profile, reference, strand=lane_strand)
+                    try:
+                        writer.put(row, alignment, lane_strand, len(query), len(reference), chunk)
+                    finally:
+                        libssw.ssw_align_del(alignment)
+            else:
+                writer.put(row, libssw.pointer(results[idx]), lane_strand, len(query), len(reference), chunk)
+        return writer.finish([chunk])
+
+    def align_profile(self, profile, reference, score_only=False, min_score=None, max_span=None, strand="+"):
+        return self._align_strands(*self._align_args(profile, reference, score_only, min_score, max_span, strand))
+
+    def _align_result(self, profile, reference, score_only=False, min_score=None, max_span=None, strand="+"):
+        # align_profile without building an Alignment: (profile, native
+        # result) for the winning strand, to be freed by the caller
+        return self._align_best(*self._align_args(profile, reference, score_only, min_score, max_span, strand))
+
+    def _align_args(self, profile, reference, score_only, min_score, max_span, strand):
+        if profile.closed:
+            raise ValueError("alignment against a closed query profile")
+        self._check_matrix(profile)
+        strand = self._strand(strand)
+        (flags, filter_score, filter_distance) = self._align_flags(score_only, min_score, max_span)
+        mask_length = max(15, len(profile) // 2)
+        reference = self.encode(reference)
+        if strand == "+":
+            profiles = [profile]
+        elif strand == "-":
+            profiles = [profile.reverse_complement()]
+        else:
+            profiles = [profile, profile.reverse_complement()]
+        return (profiles, reference, flags, filter_score, filter_distance, mask_length)
+
+    def _align_strands(self, profiles, reference, flags, filter_score, filter_distance, mask_length):
+        (profile, alignment) = self._align_best(profiles, reference, flags, filter_score, filter_distance, mask_length)
+        try:
+            return self._alignment(alignment, profile.query, reference, profile.strand)
+        finally:
+            libssw.ssw_align_del(alignment)
+
+    def _align_best(self, profiles, reference, flags, filter_score, filter_distance, mask_length):
+        # (profile, native result) for the best scoring strand, ties going
+        # to the first profile; the caller frees the result.  With two
+        # strands every one is scored first, and only the winner has its
+        # start found and is traced back.
+        two_pass = len(profiles) > 1 and flags != libssw.FLAG_MASK_SCORE_ONLY
+        pass_flags = libssw.FLAG_MASK_SCORE_ONLY if two_pass else flags
+        results = []
+        try:
+            for profile in profiles:
+                results.append(self._ssw_align(profile, reference, pass_flags, filter_score, filter_distance, mask_length))
+            best = 0
+            for idx in range(1, len(results)):
+                if results[idx].contents.score > results[best].contents.score:
+                    best = idx
+            if two_pass:
+                start = self.instrument and _clock()
+                if libssw.ssw_traceback(profiles[best]._profile, reference, self.gap_open, self.gap_extend, flags, filter_score, filter_distance, mask_length, results[best]) != 0:
+                    raise RuntimeError("SSW traceback failed")
+                if start:
+                    self.instrument.record("traceback", start)
+            return (profiles[best], results.pop(best))
+        finally:
+            for alignment in results:
+                libssw.ssw_align_del(alignment)
+
+    def _ssw_align(self, profile, reference, flags, filter_score, filter_distance, mask_length):
+        if self.gap_open <= self.gap_extend:
+            raise ValueError("gap_open must always be greater than gap_extend")
+        start = self.instrument and _clock()
+        alignment = libssw.ssw_align_init(profile._profile, reference, len(reference), self.gap_open, self.gap_extend, flags, filter_score, filter_distance, mask_length) 
+        if start:
+            self.instrument.record("align", start)
+        if not alignment:
+            raise RuntimeError("SSW alignment failed")
+        return alignment
+
+class _AlignBatch(object):
+    # per-thread profile and encoding state for Aligner.align_many; runs of
+    # the same query object reuse their profiles, and runs of the same
+    # reference object reuse its encoding
+    def __init__(self, aligner, strand, **kw):
+        self.aligner = aligner
+        self.strand = strand
+        self.align_args = kw
+        self.local = threading.local()
+
+    def __call__(self, item):
+        (idx, pair) = item
+        (profile, reference) = self._state(pair)
+        cache = self.aligner.cache
+        if cache is None:
+            return (idx, self._align(profile, reference))
+        key = self.aligner._cache_key(profile.query, reference, self.strand, **self.align_args)
+        res = cache.get(key)
+        if res is None:
+            res = self._align(profile, reference)
+            cache.put(key, res)
+        return (idx, res)
+
+    def _align(self, profile, reference):
+        strand = self._pruned(profile, reference)
+        if strand is not None:
+            query = profile.query.reverse_complement() if strand == "-" else profile.query
+            return self.aligner._unaligned(query, reference, strand)
+        return self.aligner.align_profile(profile, reference, strand=self.strand, **self.align_args)
+
+    def _pruned(self, profile, reference):
+        # None when the aligner's prefilter (if any) lets the pair through,
+        # otherwise the strand of its unaligned result
+        aligner = self.aligner
+        if aligner.prefilter is None or aligner.prefilter.passes(aligner, profile.query, reference, self.strand):
+            return None
+        return "-" if self.strand == "-" else "+"
+
+    def _state(self, pair):
+        try:
+            (query, reference) = pair
+        except (TypeError, ValueError):
+            raise ValueError("align_many needs a reference or (query, reference) pairs")
+        aligner = self.aligner
+        state = self.local
+        if getattr(state, "query", None) is not query:
+            self.close()
+            state.profile = aligner.profile(query)
+            state.query = query
+        if getattr(state, "reference", None) is not reference:
+            state.encoded_reference = aligner.encode(reference)
+            state.reference = reference
+        return (state.profile, state.encoded_reference)
+
+    def fill(self, writer, pairs, start, stop):
+        # writes rows start..stop of a columnar result straight from the
+        # native results, without an Alignment for each
+        chunk = writer.chunk()
+        try:
+            for row in range(start, stop):
+                (profile, reference) = self._state(pairs[row])
+                strand = self._pruned(profile, reference)
+                if strand is not None:
+                    writer.put(row, libssw.pointer(_unaligned_result()), strand, len(profile), len(reference), chunk)
+                    continue
+                (profile, alignment) = self.aligner._align_result(profile, reference, strand=self.strand, **self.align_args)
+                try:
+                    writer.put(row, alignment, profile.strand, len(profile), len(reference), chunk)
+                finally:
+                    libssw.ssw_align_del(alignment)
+        finally:
+            self.close()
+        return chunk
+
+    def close(self):
+        state = self.local
+        if getattr(state, "profile", None) is not None:
+            state.profile.close()
+        state.profile = state.query = state.reference = state.encoded_reference = None
+
+    def run(self, items):
+        try:
+            for item in items:
+                yield self(item)
+        finally:
+            self.close()
+
+    def run_columnar(self, pairs, workers, chunksize):
+        from . import columnar
+        pairs = list(pairs)
+        writer = columnar._TableWriter(len(pairs))
+        bounds = [(start, min(start + chunksize, len(pairs))) for start in range(0, len(pairs), chunksize)]
+        if workers <= 1:
+            chunks = [self.fill(writer, pairs, start, stop) for (start, stop) in bounds]
+        else:
+            pool = ThreadPool(workers)
+            try:
+                chunks = pool.map(lambda bound: self.fill(writer, pairs, bound[0], bound[1]), bounds)
+            finally:
+                pool.terminate()
+                pool.join()
+        return writer.finish(chunks)
+
+    def run_pool(self, items, workers, ordered, chunksize):
+        pool = ThreadPool(workers)
+        try:
+            if ordered:
+                results = pool.imap(self, items, chunksize)
+            else:
+                results = pool.imap_unordered(self, items, chunksize)
+            for result in results:
+                yield result
+        finally:
+            pool.terminate()
+            pool.join()
+
+CIGAR_OPS = "MIDNSHP=X"
 
 class Alignment(object):
-    def __init__ (self, alignment, query, reference, matrix=None):
-        self.score = alignment.contents.score
-        self.score2 = alignment.contents.score2
-        self.reference = reference
-        self.reference_begin = alignment.contents.ref_begin
-        self.reference_end = alignment.contents.ref_end
-        self.query = query
-        self.query_begin = alignment.contents.query_begin
-        self.query_end = alignment.contents.query_end
-        self.query_coverage = (self.query_end - self.query_begin + 1) / len(self.query)
-        self.reference_coverage = (self.reference_end - self.reference_begin + 1) / len(self.reference)
+    # There can be millions of these, so they are kept small: the query and
+    # reference are shared with the aligner rather than copied, the CIGAR
+    # is a packed array, and everything else is computed on request.
+    __slots__ = (
+        "strand", "score", "score2",
+        "reference_begin", "reference_end", "query_begin", "query_end",
+        "matrix", "_query", "_reference", "_cigar", "_stats", "_mismatches",
+        "band_limited",
+    )
+
+    def __init__ (self, alignment, query, reference, matrix=None, strand="+"):
+        # alignment is a native result, a pointer to one, or the (score,
+        # score2, ref_begin, ref_end, query_begin, query_end, packed cigar)
+        # tuple of the compiled binding
+        self.strand = strand
+        self._reference = reference
+        self._query = query
         self.matrix = matrix
-        self._cigar_string = [alignment.contents.cigar[idx] for idx in range(alignment.contents.cigarLen)]
+        self._cigar = array('I')
+        if isinstance(alignment, tuple):
+            (self.score, self.score2, self.reference_begin, self.reference_end, self.query_begin, self.query_end, cigar) = alignment
+            self._cigar.frombytes(cigar)
+        else:
+            if isinstance(alignment, libssw.POINTER(libssw.AlignmentResult)):
+                alignment = alignment.contents
+            self.score = alignment.score
+            self.score2 = alignment.score2
+            self.reference_begin = alignment.ref_begin
+            self.reference_end = alignment.ref_end
+            self.query_begin = alignment.query_begin
+            self.query_end = alignment.query_end
+            if alignment.cigarLen > 0:
+                self._cigar.frombytes(libssw.string_at(alignment.cigar, alignment.cigarLen * self._cigar.itemsize))
+        self._stats = None
+        self._mismatches = None
+        # only banded alignments know whether they were held in by the band
+        self.band_limited = None
+
+    def __getstate__(self):
+        return tuple(getattr(self, name) for name in self.__slots__)
+
+    def __setstate__(self, state):
+        for (name, value) in zip(self.__slots__, state):
+            setattr(self, name, value)
+
+    @property
+    def query(self):
+        query = self._query
+        return query.text if isinstance(query, EncodedSequence) else query
+
+    @property
+    def reference(self):
+        reference = self._reference
+        return reference.text if isinstance(reference, EncodedSequence) else reference
+
+    @property
+    def query_coverage(self):
+        if self.query_begin < 0:
+            # score only, or filtered out: no start position or traceback
+            return None
+        return (self.query_end - self.query_begin + 1) / len(self._query)
+
+    @property
+    def reference_coverage(self):
+        if self.reference_begin < 0:
+            return None
+        return (self.reference_end - self.reference_begin + 1) / len(self._reference)
 
     @property
     def iter_cigar(self):
-        for val in self._cigar_string:
-            op_len = libssw.cigar_int_to_len(val)
-            op_char = libssw.cigar_int_to_op(val).decode("latin")
-            yield (op_len, op_char)
+        for val in self._cigar:
+            op = val & 0xf
+            yield (val >> 4, CIGAR_OPS[op] if op < len(CIGAR_OPS) else 'M')
 
     @property
     def cigar(self):
         cigar = ""
+        if self.query_begin < 0:
+            return cigar
         if self.query_begin > 0:
             cigar += str(self.query_begin) + "S"
         cigar += str.join('', (str.join('', map(str, cstr)) for cstr in self.iter_cigar))
-        end_len = len(self.query) - self.query_end - 1
+        end_len = len(self._query) - self.query_end - 1
+        if end_len != 0:
+            cigar += str(end_len) + "S"
+        return cigar
+
+    def _codes(self, seq, begin, end):
+        # symbol indices of seq[begin:end], for matching through the matrix
+        if isinstance(seq, EncodedSequence):
+            return bytearray(memoryview(seq.codes)[begin:end])
+        return bytearray(self.matrix.convert_sequence_to_ints(seq[begin:end]))
+
+    def _match_flags(self):
+        # one flag per aligned column of the M operations: 1 when the
+        # matrix scores the reference and query symbols as a match
+        if self.matrix is None:
+            r_seq = self.reference[self.reference_begin:self.reference_end + 1].upper()
+            q_seq = self.query[self.query_begin:self.query_end + 1].upper()
+            (r_codes, q_codes, table, n) = (bytearray(r_seq.encode("latin-1")), bytearray(q_seq.encode("latin-1")), None, 0)
+        else:
+            r_codes = self._codes(self._reference, self.reference_begin, self.reference_end + 1)
+            q_codes = self._codes(self._query, self.query_begin, self.query_end + 1)
+            (table, n) = (self.matrix._match_table, len(self.matrix.alphabet))
+        r_index = q_index = 0
+        for (op_len, op_char) in self.iter_cigar:
+            if op_char in "M=X":
+                if table is None:
+                    flags = [int(r == q) for (r, q) in zip(r_codes[r_index:r_index + op_len], q_codes[q_index:q_index + op_len])]
+                else:
+                    flags = [table[r * n + q] for (r, q) in zip(r_codes[r_index:r_index + op_len], q_codes[q_index:q_index + op_len])]
+                yield (op_len, op_char, flags)
+                r_index += op_len
+                q_index += op_len
+            elif op_char == 'I':
+                yield (op_len, op_char, None)
+                q_index += op_len
+            elif op_char == 'D':
+                yield (op_len, op_char, None)
+                r_index += op_len
+
+    def _encoded(self, seq):
+        if isinstance(seq, EncodedSequence):
+            return seq
+        return EncodedSequence(seq, self.matrix)
+
+    def _mismatch_info(self):
+        # (NM, MD, =/X cigar) from one native pass over the alignment,
+        # matching symbols through the score matrix so that degenerate
+        # bases count the same way they score
+        if self._mismatches is None:
+            cigar_len = len(self._cigar)
+            aligned = sum(val >> 4 for val in self._cigar if (val & 0xf) not in (1, 2))
+            cigar = (libssw.c_uint32 * max(cigar_len, 1)).from_buffer(self._cigar) if cigar_len else None
+            xcigar = array('I', bytes(4 * (aligned + cigar_len + 1)))
+            xcigar_len = libssw.c_int32()
+            md = libssw.create_string_buffer(12 * (self.reference_end - self.reference_begin + cigar_len + 2))
+            md_len = libssw.c_int32()
+            matrix = self.matrix
+            nm = libssw.mismatch_info(
+                self.reference_begin, self.query_begin,
+                self._encoded(self._reference), self._encoded(self._query),
+                cigar, cigar_len,
+                matrix._match_table, len(matrix.alphabet), matrix._decode_table,
+                (libssw.c_uint32 * len(xcigar)).from_buffer(xcigar), libssw.byref(xcigar_len),
+                md, libssw.byref(md_len)
+            )
+            del xcigar[xcigar_len.value:]
+            self._mismatches = (nm, md.value[:md_len.value].decode("latin-1"), xcigar)
+        return self._mismatches
+
+    @property
+    def nm(self):
+        if self.query_begin < 0:
+            return None
+        return self._mismatch_info()[0]
+
+    @property
+    def md(self):
+        if self.query_begin < 0:
+            return None
+        return self._mismatch_info()[1]
+
+    @property
+    def extended_cigar(self):
+        # the CIGAR with =/X for matches and mismatches instead of M
+        if self.query_begin < 0:
+            return ""
+        cigar = ""
+        if self.query_begin > 0:
+            cigar += str(self.query_begin) + "S"
+        for val in self._mismatch_info()[2]:
+            cigar += str(val >> 4) + CIGAR_OPS[val & 0xf]
+        end_len = len(self._query) - self.query_end - 1
         if end_len != 0:
             cigar += str(end_len) + "S"
         return cigar
 
+    @property
+    def stats(self):
+        # (matches, mismatches, insertions, deletions), worked out once from
+        # the CIGAR and the native mismatch count, and then cached
+        if self._stats is None:
+            aligned = insertions = deletions = 0
+            for (op_len, op_char) in self.iter_cigar:
+                if op_char == 'I':
+                    insertions += op_len
+                elif op_char == 'D':
+                    deletions += op_len
+                else:
+                    aligned += op_len
+            mismatches = 0
+            if self.query_begin >= 0 and self.matrix is not None:
+                mismatches = self._mismatch_info()[0] - insertions - deletions
+            elif self.query_begin >= 0:
+                mismatches = sum(op_len - sum(flags) for (op_len, op_char, flags) in self._match_flags() if flags is not None)
+            self._stats = (aligned - mismatches, mismatches, insertions, deletions)
+        return self._stats
+
     @property
     def alignment(self):
         r_index = 0
         q_index = 0
+        if self.query_begin < 0:
+            return ('', '', '')
         r_seq = self.reference[self.reference_begin: self.reference_end + 1]
         q_seq = self.query[self.query_begin: self.query_end + 1]
-        r_line = m_line = q_line = ''
-        match_flag = lambda rq: '|' if self.matrix.test_match(*rq) else '*'
-        for (op_len, op_char) in self.iter_cigar:
-            op_len = int(op_len)
-            if op_char.upper() == 'M':
+        r_line = []
+        m_line = []
+        q_line = []
+        for (op_len, op_char, flags) in self._match_flags():
+            if flags is not None:
                 # match between reference and query
-                ref_chunk = r_seq[r_index: r_index + op_len]
-                query_chunk = q_seq[q_index: q_index + op_len]
-                r_line += ref_chunk
-                q_line += query_chunk
-                match_seq = str.join('', map(match_flag, zip(ref_chunk, query_chunk)))
-                m_line += match_seq
+                r_line.append(r_seq[r_index: r_index + op_len])
+                q_line.append(q_seq[q_index: q_index + op_len])
+                m_line.extend('|' if flag else '*' for flag in flags)
                 r_index += op_len
                 q_index += op_len
-            elif op_char.upper() == 'I':
+            elif op_char == 'I':
                 # insertion into reference
-                r_line += '-' * op_len
-                m_line += ' ' * op_len
-                q_line += q_seq[q_index: q_index + op_len]
+                r_line.append('-' * op_len)
+                m_line.append(' ' * op_len)
+                q_line.append(q_seq[q_index: q_index + op_len])
                 #  only query index change
                 q_index += op_len
-            elif op_char.upper() == 'D':
+            elif op_char == 'D':
                 # deletion from reference
-                r_line += r_seq[r_index: r_index + op_len]
-                m_line += ' ' * op_len
-                q_line += '-' * op_len
+                r_line.append(r_seq[r_index: r_index + op_len])
+                m_line.append(' ' * op_len)
+                q_line.append('-' * op_len)
                 #  only ref index change
                 r_index += op_len
-        return (r_line, m_line, q_line)
-
-    # XXX: all of these count functions are ineffecient
+        return (str.join('', r_line), str.join('', m_line), str.join('', q_line))
 
     @property
     def match_count(self):
-        return self.alignment[1].count('|')
+        return self.stats[0]
 
     @property
     def mismatch_count(self):
-        return self.alignment[1].count('*')
+        return self.stats[1]
 
     @property
     def insertion_count(self):
-        cnt = 0
-        for (op_len, op_char) in self.iter_cigar:
-            if op_char.upper() == 'I':
-                cnt += op_len
-        return cnt
+        return self.stats[2]
 
     @property
     def deletion_count(self):
-        cnt = 0
-        for (op_len, op_char) in self.iter_cigar:
-            if op_char.upper() == 'D':
-                cnt += op_len
-        return cnt
+        return self.stats[3]
 
     def alignment_report(self, width=80, header=True):
         def window(lines, width):
@@ -239,7 +1253,7 @@ class Alignment(object):
         margin_width = len(str(max(self.query_end, self.reference_end))) + 8
         rpt = ''
         if header:
-            rpt += "Score = %s, Matches = %s, Mismatches = %s, Insertions = %s, Deletions = %s\n" % (self.score, self.match_count, self.mismatch_count, self.insertion_count, self.deletion_count)
+            rpt += "Score = %s, Matches = %s, Mismatches = %s, Insertions = %s, Deletions = %s\n" % ((self.score,) + self.stats)
             rpt += '\n'
         for (lines, offset) in window(self.alignment, width - margin_width):
             for (name, seq_offset, line) in zip(["ref", "", "query"], [self.reference_begin, None, self.query_begin], lines):
@@ -1,9 +1,34 @@
 #!/usr/bin/env python
 
+import os
+import io
+import gzip
+import gc
+import sys
+import shutil
+import subprocess
+import tempfile
 import unittest
 import pickle
+import random
+import json
+import time
 import ssw
+from ssw import libssw
 from ssw import iupac
+from ssw import fastx
+from ssw import pipeline
+from ssw import index
+from ssw import refstore
+from ssw import panel
+from ssw import cache
+from ssw import prefilter
+from ssw import instrument
+
+try:
+    import asyncio
+except ImportError:
+    asyncio = None
 
 class TestIUPAC(unittest.TestCase):
     def test_degen_revcomp(self):
@@ -20,12 +45,36 @@ class TestPickle(unittest.TestCase):
         query = reference
         aligner = ssw.Aligner()
         al = aligner.align(query, reference)
-        orig_dict = al.__dict__.copy()
         clone = pickle.loads(pickle.dumps(al))
-        clone_dict = clone.__dict__.copy()
-        for key in orig_dict.keys():
-            self.assertIn(key, clone_dict)
-            self.assertEqual(orig_dict[key], clone_dict[key])
+        for key in ("strand", "score", "score2", "reference_begin", "reference_end", "query_begin", "query_end", "matrix", "_cigar"):
+            self.assertEqual(getattr(al, key), getattr(clone, key))
+        self.assertEqual(al.query, clone.query)
+        self.assertEqual(al.reference, clone.reference)
+        self.assertEqual(al.cigar, clone.cigar)
+        self.assertEqual(al.alignment_report(), clone.alignment_report())
+
+    def test_aligner_pickle_after_align(self):
+        reference = "TTGA" * 8 + "GTGCGATGTGCGATGAGATC" + "CAAT" * 8
+        query = "GTGCGATGTGCGATGAGATC"
+        (extension, libssw.extension) = (libssw.extension, None)
+        try:
+            for indexed in (False, True):
+                aligner = ssw.Aligner(reference=reference)
+                if indexed:
+                    aligner.build_index(k=8)
+                expected = aligner.align(query)
+                clone = pickle.loads(pickle.dumps(aligner))
+                self.assertEqual(clone.index is not None, indexed)
+                al = clone.align(query)
+                self.assertEqual((al.score, al.cigar, al.reference_begin), (expected.score, expected.cigar, expected.reference_begin))
+        finally:
+            libssw.extension = extension
+
+    def test_alignment_slots(self):
+        al = ssw.Aligner().align("GTGCGATGTG", "GTGCGATGTGCGATGAGATC")
+        self.assertFalse(hasattr(al, "__dict__"))
+        self.assertEqual(al._cigar.typecode, 'I')
+        self.assertEqual(al.stats, (10, 0, 0, 0))
 
 class TestAlignment(unittest.TestCase):
     def test_mixed_case(self):
@@ -132,10 +181,1065 @@ class TestAlignment(unittest.TestCase):
         self.assertEqual(m_line, "||*|||*|||*|||*|||*|||*|||*|||*|||*|||")
         self.assertEqual(q_line, "AGGTAGGTAGGTAGGTAGGTAGGTAGGTAGGTAGGTAG")
 
+    def test_mismatch_tags(self):
+        reference = "GTGCGATGTGCGATGAGATC"
+        query = reference[:4] + 'A' + reference[5:10] + 'T' + reference[10:17]
+        aligner = ssw.Aligner()
+        al = aligner.align(query, reference, revcomp=False)
+        self.assertEqual(al.cigar, "10M1I7M")
+        self.assertEqual(al.extended_cigar, "4=1X5=1I7=")
+        self.assertEqual(al.nm, 2)
+        self.assertEqual(al.md, "4G12")
+        self.assertEqual(al.mismatch_count, 1)
+        query = reference[:10] + reference[11:]
+        al = aligner.align(query, reference, revcomp=False)
+        self.assertEqual(al.cigar, "10M1D9M")
+        self.assertEqual(al.extended_cigar, "10=1D9=")
+        self.assertEqual(al.nm, 1)
+        self.assertEqual(al.md, "10^C9")
+
+    def test_degen_mismatch_tags(self):
+        # degenerate reference symbols match through the score matrix
+        reference = "AGCGATCANGTACGT"
+        query = "AGCGATCATGTACGT"
+        aligner = ssw.Aligner()
+        al = aligner.align(query, reference, revcomp=False)
+        self.assertEqual(al.nm, 0)
+        self.assertEqual(al.md, "15")
+        self.assertEqual(al.extended_cigar, "15=")
+
+    def test_match_without_matrix(self):
+        # without a matrix, columns match when their letters do
+        reference = "GTGCGATGTGCGATGAGATC"
+        query = reference[:4] + 'A' + reference[5:]
+        al = ssw.Aligner().align(query, reference, revcomp=False)
+        result = (al.score, al.score2, al.reference_begin, al.reference_end, al.query_begin, al.query_end, al._cigar.tobytes())
+        bare = ssw.Alignment(result, query, reference)
+        self.assertIsNone(bare.matrix)
+        self.assertEqual(bare.stats, (19, 1, 0, 0))
+        self.assertEqual(bare.alignment, al.alignment)
+
     def test_issue_3(self):
         # https://github.com/vishnubob/ssw/issues/3
         self.assertRaises(ValueError, ssw.Aligner, gap_open=1, gap_extend=2)
         self.assertRaises(ValueError, ssw.Aligner, gap_open=1, gap_extend=1)
 
+class TestProfile(unittest.TestCase):
+    def test_profile_reuse(self):
+        references = ["GTGCGATGTGCGATGAGATC", "CCC" + "AGCT" * 10, "AAAGTGCGATGTTTT"]
+        query = "GTGCGATGTG"
+        aligner = ssw.Aligner()
+        with aligner.profile(query) as profile:
+            for reference in references:
+                encoded = aligner.encode(reference)
+                al = aligner.align_profile(profile, encoded)
+                expected = aligner.align(query, reference, revcomp=False)
+                self.assertEqual(al.score, expected.score)
+                self.assertEqual(al.cigar, expected.cigar)
+                self.assertEqual(al.reference_begin, expected.reference_begin)
+                self.assertEqual(al.reference, reference)
+        self.assertTrue(profile.closed)
+        self.assertRaises(ValueError, aligner.align_profile, profile, references[0])
+
+    def test_reference_encoded_once(self):
+        aligner = ssw.Aligner(reference="GTGCGATGTGCGATGAGATC")
+        self.assertIs(aligner.encode(aligner.reference), aligner.encode(aligner.reference))
+        aligner.reference = "GATCTCATCGCACATCGCAC"
+        self.assertEqual(aligner.encode(aligner.reference).sequence, aligner.reference)
+
+    def test_encoded_pickle(self):
+        aligner = ssw.Aligner()
+        encoded = aligner.encode("GTGCGATGTG")
+        clone = pickle.loads(pickle.dumps(encoded))
+        self.assertEqual(list(clone._codes), list(encoded._codes))
+
+    def test_mismatched_matrix(self):
+        aligner = ssw.Aligner()
+        other = ssw.Aligner(matrix=ssw.ScoreMatrix(alphabet="ACGT"))
+        encoded = other.encode("ACGT")
+        self.assertRaises(ValueError, aligner.align_profile, aligner.profile("ACGT"), encoded)
+
+class TestEncoding(unittest.TestCase):
+    def test_buffer_inputs(self):
+        reference = "GTGCGATGTGCGATGAGATC"
+        query = "GATCTCATCGCACATCGCAC"
+        aligner = ssw.Aligner()
+        expected = aligner.align(query, reference)
+        for convert in (lambda s: s.encode("ascii"), lambda s: bytearray(s.encode("ascii")), lambda s: memoryview(s.encode("ascii"))):
+            al = aligner.align(convert(query), convert(reference))
+            self.assertEqual(al.score, expected.score)
+            self.assertEqual(al.cigar, expected.cigar)
+            self.assertEqual(al.alignment, expected.alignment)
+
+    def test_numpy_input(self):
+        try:
+            import numpy
+        except ImportError:
+            raise unittest.SkipTest("numpy is not installed")
+        reference = "GTGCGATGTGCGATGAGATC"
+        aligner = ssw.Aligner()
+        encoded = aligner.encode(numpy.frombuffer(reference.lower().encode("ascii"), dtype=numpy.uint8))
+        self.assertEqual(bytes(bytearray(encoded.codes)), bytes(aligner.encode(reference).codes))
+        self.assertEqual(encoded.text, reference)
+        self.assertRaises(ValueError, aligner.encode, numpy.frombuffer(b"ACGZ", dtype=numpy.uint8))
+
+    def test_unknown_symbol(self):
+        aligner = ssw.Aligner()
+        with self.assertRaises(ValueError) as ctx:
+            aligner.encode("ACGTACXGT")
+        self.assertIn("position 6", str(ctx.exception))
+        with self.assertRaises(ValueError) as ctx:
+            aligner.encode(b"ACG-")
+        self.assertIn("position 3", str(ctx.exception))
+
+    def test_from_codes(self):
+        aligner = ssw.Aligner()
+        reference = "GTGCGATGTGCGATGAGATC"
+        codes = bytearray(aligner.encode(reference).codes)
+        encoded = ssw.EncodedSequence.from_codes(codes, aligner.matrix)
+        self.assertIs(encoded.codes, codes)
+        self.assertEqual(encoded.text, reference)
+        al = aligner.align(reference, encoded)
+        self.assertEqual(al.cigar, "20M")
+        self.assertRaises(ValueError, ssw.EncodedSequence.from_codes, b"\x00\x01\x7f", aligner.matrix)
+
+    def test_encoded_reverse_complement(self):
+        aligner = ssw.Aligner()
+        seq = "AGTCMRYSWKBDHVN"
+        rc = aligner.encode(seq).reverse_complement()
+        self.assertEqual(rc.text, "NBDHVMWSRYKGACT")
+        self.assertEqual(bytes(rc.codes), bytes(aligner.encode("NBDHVMWSRYKGACT").codes))
+        rc = aligner.encode(seq.encode("ascii")).reverse_complement()
+        self.assertEqual(rc.text, "NBDHVMWSRYKGACT")
+
+class TestFilters(unittest.TestCase):
+    reference = "CCC" + "AGCT" * 10 + "GTGCGATGTGCGATGAGATC"
+    query = "GTGCGATGTGCGATGAGATC"
+
+    def test_score_only(self):
+        aligner = ssw.Aligner()
+        full = aligner.align(self.query, self.reference)
+        al = aligner.align(self.query, self.reference, score_only=True)
+        self.assertEqual(al.score, full.score)
+        self.assertEqual(al.score2, full.score2)
+        self.assertEqual(al.reference_end, full.reference_end)
+        self.assertEqual(al.query_end, full.query_end)
+        self.assertEqual(al.reference_begin, -1)
+        self.assertEqual(al.cigar, "")
+        self.assertEqual(al.query_coverage, None)
+
+    def test_min_score(self):
+        aligner = ssw.Aligner()
+        al = aligner.align(self.query, self.reference, min_score=40)
+        self.assertEqual(al.cigar, "20M")
+        al = aligner.align(self.query, self.reference, min_score=41)
+        self.assertEqual(al.score, 40)
+        self.assertEqual(al.cigar, "")
+
+    def test_max_span(self):
+        aligner = ssw.Aligner()
+        al = aligner.align(self.query, self.reference, max_span=20)
+        self.assertEqual(al.cigar, "20M")
+        al = aligner.align(self.query, self.reference, max_span=19)
+        self.assertEqual(al.reference_begin, 43)
+        self.assertEqual(al.cigar, "")
+        al = aligner.align(self.query, self.reference, min_score=30, max_span=20)
+        self.assertEqual(al.cigar, "20M")
+
+    def test_align_many_score_only(self):
+        aligner = ssw.Aligner(reference=self.reference)
+        results = aligner.align_many([self.query] * 3, workers=1, score_only=True)
+        self.assertEqual([al.score for al in results], [40] * 3)
+        self.assertEqual([al.cigar for al in results], [""] * 3)
+
+class TestStrand(unittest.TestCase):
+    reference = "CCC" + "AGCT" * 10 + "GTGCGATGTGCGATGAGATC"
+    query = "GATCTCATCGCACATCGCAC"
+
+    def test_strand_option(self):
+        aligner = ssw.Aligner()
+        fwd = aligner.align(self.query, self.reference, strand="+")
+        rev = aligner.align(self.query, self.reference, strand="-")
+        both = aligner.align(self.query, self.reference, strand="both")
+        self.assertEqual(fwd.strand, "+")
+        self.assertEqual(rev.strand, "-")
+        self.assertEqual(rev.cigar, "20M")
+        self.assertEqual(rev.query, iupac.nucleotide_reverse_complement(self.query))
+        self.assertEqual((both.strand, both.score, both.cigar), (rev.strand, rev.score, rev.cigar))
+        self.assertEqual(aligner.align(self.query, self.reference, revcomp=False).strand, "+")
+        self.assertRaises(ValueError, aligner.align, self.query, self.reference, strand="x")
+
+    def test_both_matches_separate_strands(self):
+        aligner = ssw.Aligner()
+        references = [self.reference, self.reference[::-1], "CATCGCACATCGCACAAAAGTGCGATG"]
+        with aligner.profile(self.query[:15]) as profile:
+            for reference in references:
+                fwd = aligner.align_profile(profile, reference)
+                rev = aligner.align_profile(profile, reference, strand="-")
+                expected = rev if rev.score > fwd.score else fwd
+                both = aligner.align_profile(profile, reference, strand="both")
+                self.assertEqual((both.strand, both.score, both.score2, both.cigar, both.reference_begin), (expected.strand, expected.score, expected.score2, expected.cigar, expected.reference_begin))
+            rc_profile = profile.reverse_complement()
+            self.assertIs(profile.reverse_complement(), rc_profile)
+        self.assertTrue(rc_profile.closed)
+
+    def test_query_profile_cached(self):
+        # both profiles are reused, with and without the compiled binding
+        extension = libssw.extension
+        try:
+            for binding in set([extension, None]):
+                libssw.extension = binding
+                aligner = ssw.Aligner()
+                expected = aligner.align(self.query, self.reference)
+                profile = aligner._last_profile[1]
+                rc_profile = profile.reverse_complement()
+                aligner.align(self.query, self.reference[::-1])
+                alignment = aligner.align(self.query, self.reference)
+                self.assertIs(aligner._last_profile[1], profile)
+                self.assertIs(profile.reverse_complement(), rc_profile)
+                self.assertEqual((alignment.score, alignment.cigar, alignment.strand), (expected.score, expected.cigar, expected.strand))
+        finally:
+            libssw.extension = extension
+
+class TestBand(unittest.TestCase):
+    reference = str.join("", map(random.Random(19).choice, ["ACGT"] * 200))
+    # diagonal 30 for 20 bases, then a deletion puts the rest on 31
+    query = reference[30:50] + reference[51:70]
+
+    def test_band_matches_full(self):
+        aligner = ssw.Aligner()
+        full = aligner.align(self.query, self.reference, strand="+")
+        banded = aligner.align(self.query, self.reference, strand="+", band=(30, 3))
+        for name in ("score", "reference_begin", "reference_end", "query_begin", "query_end", "cigar"):
+            self.assertEqual(getattr(banded, name), getattr(full, name), name)
+        self.assertEqual(banded.cigar, "20M1D19M")
+        self.assertFalse(banded.band_limited)
+        self.assertIsNone(full.band_limited)
+
+    def test_band_iupac(self):
+        # ambiguity codes in the reference match the bases they stand for,
+        # but not the other way around
+        aligner = ssw.Aligner()
+        reference = self.reference[:40] + "RYN" + self.reference[43:]
+        for (query, ref) in ((self.reference[30:60], reference), (reference[30:60], self.reference)):
+            full = aligner.align(query, ref, strand="+")
+            banded = aligner.align(query, ref, strand="+", band=(30, 3))
+            self.assertEqual((banded.score, banded.cigar), (full.score, full.cigar))
+
+    def test_band_too_narrow(self):
+        aligner = ssw.Aligner()
+        banded = aligner.align(self.query, self.reference, strand="+", band=(30, 0))
+        self.assertEqual((banded.score, banded.cigar), (40, "20M19S"))
+        self.assertTrue(banded.band_limited)
+
+    def test_band_misses_reference(self):
+        aligner = ssw.Aligner()
+        for band in ((1000, 2), (-1000, 2)):
+            banded = aligner.align(self.query, self.reference[:70], band=band)
+            self.assertEqual(banded.score, 0)
+            self.assertTrue(banded.band_limited)
+
+    def test_band_options(self):
+        aligner = ssw.Aligner()
+        rc = iupac.nucleotide_reverse_complement(self.query)
+        banded = aligner.align(rc, self.reference, band=(30, 3))
+        self.assertEqual((banded.strand, banded.cigar), ("-", "20M1D19M"))
+        score_only = aligner.align(self.query, self.reference, strand="+", band=(30, 3), score_only=True)
+        self.assertEqual((score_only.score, score_only.reference_end, score_only.query_begin), (banded.score, banded.reference_end, -1))
+        self.assertFalse(score_only.band_limited)
+        self.assertRaises(ValueError, aligner.align, self.query, self.reference, band=(30, -1))
+        self.assertRaises(ValueError, aligner.align, self.query, self.reference, band=30)
+
+class TestScoreWidth(unittest.TestCase):
+    def test_short_query_is_byte_only(self):
+        aligner = ssw.Aligner()
+        with aligner.profile("ACGT" * 10) as profile:
+            self.assertEqual(profile.score_size, 0)
+            self.assertEqual(profile.widths, (8,))
+            self.assertEqual(aligner.align_profile(profile, "ACGT" * 10).score, 80)
+
+    def test_word_profile_built_on_overflow(self):
+        aligner = ssw.Aligner()
+        with aligner.profile("ACGT" * 100) as profile:
+            self.assertEqual(profile.score_size, 2)
+            self.assertEqual(profile.widths, (8,))
+            aligner.align_profile(profile, "TTTT" * 10)
+            self.assertEqual(profile.widths, (8,))
+            alignment = aligner.align_profile(profile, "ACGT" * 100)
+            self.assertEqual(profile.widths, (8, 16))
+            # reusing the profile keeps both widths
+            aligner.align_profile(profile, "TTTT" * 10)
+            self.assertEqual(profile.widths, (8, 16))
+        with aligner.profile("ACGT" * 100, score_size=1) as word:
+            expected = aligner.align_profile(word, "ACGT" * 100)
+        self.assertEqual((alignment.score, alignment.cigar), (800, "400M"))
+        self.assertEqual((alignment.score, alignment.cigar), (expected.score, expected.cigar))
+
+class TestInstrument(unittest.TestCase):
+    def tearDown(self):
+        libssw.enable_native_stats(False)
+
+    def test_disabled(self):
+        aligner = ssw.Aligner()
+        aligner.align("ACGT" * 10, "ACGT" * 20)
+        self.assertIsNone(aligner.stats())
+
+    def test_stages(self):
+        events = []
+        aligner = ssw.Aligner(instrument=instrument.Instrumentation(hook=lambda *event: events.append(event)))
+        with aligner.profile("ACGT" * 100) as profile:
+            alignment = aligner.align_profile(profile, "TT" + "ACGT" * 100, strand="both")
+        self.assertEqual(alignment.score, 800)
+        stats = aligner.stats()
+        stages = stats["stages"]
+        self.assertEqual(stages["encode"]["calls"], 2)
+        self.assertEqual(stages["profile"]["calls"], 1)
+        self.assertEqual(stages["align"]["calls"], 2)
+        self.assertEqual(stages["traceback"]["calls"], 1)
+        self.assertEqual(stages["alignment"]["calls"], 1)
+        self.assertEqual(len(events), 7)
+        self.assertEqual([stage for (stage, seconds, items) in events][:2], ["encode", "profile"])
+        # both strands overflow the 8 bit scores and get a 16 bit profile
+        native = stats["native"]
+        self.assertEqual((native["alignments"], native["byte_overflows"], native["word_profiles"]), (2, 2, 2))
+        self.assertEqual(native["cells"], 2 * 400 * 402)
+        self.assertEqual((native["reverse_passes"], native["tracebacks"]), (1, 1))
+        aligner.instrument.reset()
+        stats = aligner.stats()
+        self.assertEqual(stats["stages"]["align"]["calls"], 0)
+        self.assertEqual(stats["native"]["alignments"], 0)
+
+    def test_native_restored(self):
+        # the native counters go back off once the last instrument is closed
+        libssw.enable_native_stats(False)
+        with instrument.Instrumentation() as outer:
+            inner = instrument.Instrumentation()
+            inner.close()
+            inner.close()
+            self.assertTrue(libssw.enable_native_stats(True))
+        self.assertFalse(libssw.enable_native_stats(False))
+        aligner = ssw.Aligner(instrument=True)
+        aligner.align("ACGT" * 10, "ACGT" * 20, strand="+")
+        self.assertEqual(aligner.stats()["native"]["alignments"], 1)
+        del aligner
+        gc.collect()
+        self.assertFalse(libssw.enable_native_stats(False))
+
+    def test_batch_and_band(self):
+        aligner = ssw.Aligner(instrument=True)
+        aligner.score_many(["ACGT" * 5, "TTGCA" * 4], "ACGT" * 20, strand="+")
+        aligner.align("ACGT" * 5, "ACGT" * 20, band=(0, 4), strand="+")
+        stages = aligner.stats()["stages"]
+        self.assertEqual((stages["batch"]["calls"], stages["batch"]["items"]), (1, 2))
+        self.assertEqual(stages["banded"]["calls"], 1)
+        self.assertEqual(aligner.stats()["native"]["banded"], 1)
+
+    def test_pickle(self):
+        aligner = pickle.loads(pickle.dumps(ssw.Aligner(instrument=instrument.Instrumentation(native=False))))
+        aligner.align("ACGT" * 10, "ACGT" * 20)
+        stats = aligner.stats()
+        self.assertNotIn("native", stats)
+        self.assertGreater(stats["stages"]["alignment"]["calls"], 0)
+
+class TestExtension(unittest.TestCase):
+    options = [{}, {"score_only": True}, {"min_score": 30}, {"max_span": 25}]
+
+    def setUp(self):
+        if libssw.extension is None:
+            self.skipTest("the compiled binding is not built")
+
+    def assertSameAlignment(self, al, expected):
+        for name in ("score", "score2", "reference_begin", "reference_end", "query_begin", "query_end", "cigar", "strand", "query"):
+            self.assertEqual(getattr(al, name), getattr(expected, name), name)
+
+    def test_matches_ctypes(self):
+        rng = random.Random(17)
+        reference = str.join("", (rng.choice("ACGT") for idx in range(300)))
+        queries = ["", "A", iupac.nucleotide_reverse_complement(reference[100:140])]
+        for idx in range(20):
+            start = rng.randrange(0, 250)
+            query = list(reference[start:start + rng.randrange(10, 50)])
+            for pos in range(len(query)):
+                if rng.random() < 0.1:
+                    query[pos] = rng.choice("ACGT")
+            queries.append(str.join("", query))
+        aligner = ssw.Aligner()
+        for query in queries:
+            for strand in ("+", "-", "both"):
+                for kw in self.options:
+                    expected = aligner.align_profile(aligner.profile(query), reference, strand=strand, **kw)
+                    self.assertSameAlignment(aligner.align(query, reference, strand=strand, **kw), expected)
+
+    def test_fallback(self):
+        aligner = ssw.Aligner()
+        query = "GATCTCATCGCACATCGCAC"
+        reference = "CCC" + "AGCT" * 10 + "GTGCGATGTGCGATGAGATC"
+        native = aligner.align(query, reference)
+        (extension, libssw.extension) = (libssw.extension, None)
+        try:
+            self.assertSameAlignment(aligner.align(query, reference), native)
+        finally:
+            libssw.extension = extension
+
+class TestBatch(unittest.TestCase):
+    reference = "CCC" + "AGCT" * 10 + "GTGCGATGTGCGATGAGATC"
+    queries = ["GTGCGATGTGCGATGAGATC", "GATCTCATCGCACATCGCAC", "AGGT" * 10, "GTGCGATGTGCAGATGAGATC"] * 5
+
+    def assertSameAlignment(self, al, expected):
+        self.assertEqual(al.score, expected.score)
+        self.assertEqual(al.cigar, expected.cigar)
+        self.assertEqual(al.reference_begin, expected.reference_begin)
+        self.assertEqual(al.query, expected.query)
+
+    def test_ordered(self):
+        aligner = ssw.Aligner()
+        expected = [aligner.align(query, self.reference) for query in self.queries]
+        for workers in (1, 4):
+            results = aligner.align_many(self.queries, reference=self.reference, workers=workers, chunksize=3)
+            self.assertEqual(len(results), len(expected))
+            for (al, exp) in zip(results, expected):
+                self.assertSameAlignment(al, exp)
+
+    def test_unordered(self):
+        aligner = ssw.Aligner(reference=self.reference)
+        expected = [aligner.align(query) for query in self.queries]
+        results = dict(aligner.align_many(iter(self.queries), workers=3, ordered=False, chunksize=2))
+        self.assertEqual(sorted(results), list(range(len(self.queries))))
+        for (idx, exp) in enumerate(expected):
+            self.assertSameAlignment(results[idx], exp)
+
+    def test_pairs(self):
+        aligner = ssw.Aligner()
+        pairs = [(query, self.reference[idx:]) for (idx, query) in enumerate(self.queries)]
+        expected = [aligner.align(query, reference, revcomp=False) for (query, reference) in pairs]
+        results = aligner.align_many(pairs, revcomp=False, workers=2)
+        for (al, exp) in zip(results, expected):
+            self.assertSameAlignment(al, exp)
+        self.assertRaises(ValueError, aligner.align_many, self.queries, workers=1)
+
+    def test_columnar(self):
+        try:
+            import numpy
+        except ImportError:
+            raise unittest.SkipTest("numpy is not installed")
+        aligner = ssw.Aligner()
+        expected = aligner.align_many(self.queries, reference=self.reference, workers=1)
+        for workers in (1, 3):
+            table = aligner.align_many(self.queries, reference=self.reference, workers=workers, chunksize=3, columnar=True)
+            self.assertEqual(len(table), len(expected))
+            self.assertEqual(table.offsets[-1], len(table.cigars))
+            for (idx, exp) in enumerate(expected):
+                row = table[idx]
+                self.assertEqual(row["score"], exp.score)
+                self.assertEqual(row["score2"], exp.score2)
+                self.assertEqual(row["reference_begin"], exp.reference_begin)
+                self.assertEqual(row["query_end"], exp.query_end)
+                self.assertEqual(row["strand"], exp.strand.encode("ascii"))
+                self.assertAlmostEqual(row["query_coverage"], exp.query_coverage, places=5)
+                self.assertEqual(table.cigar(idx), exp.cigar)
+        table = aligner.align_many(self.queries, reference=self.reference, columnar=True, score_only=True)
+        self.assertEqual(len(table.cigars), 0)
+        self.assertTrue(numpy.isnan(table["reference_coverage"]).all())
+
+class TestScoreMany(unittest.TestCase):
+    def pairs(self):
+        rnd = random.Random(11)
+        pairs = []
+        for idx in range(200):
+            reference = str.join("", (rnd.choice("ACGTN") for pos in range(rnd.randint(0, 150))))
+            start = rnd.randint(0, len(reference))
+            query = str.join("", (base if rnd.random() > 0.1 else rnd.choice("ACGT") for base in reference[start:start + rnd.randint(0, 80)]))
+            if idx % 3 == 0:
+                query = ssw.iupac.nucleotide_reverse_complement(query)
+            pairs.append((query, reference))
+        # long enough to need 16 bit scores
+        pairs.append(("ACGT" * 100, "TT" + "ACGT" * 100))
+        return pairs
+
+    def test_matches_align(self):
+        aligner = ssw.Aligner(gap_open=5, gap_extend=2)
+        pairs = self.pairs()
+        for strand in ("+", "-", "both"):
+            results = aligner.score_many(pairs, strand=strand)
+            self.assertEqual(len(results), len(pairs))
+            for ((query, reference), al) in zip(pairs, results):
+                exp = aligner.align(query, reference, score_only=True, strand=strand)
+                self.assertEqual((al.score, al.score2, al.reference_end, al.query_end, al.strand), (exp.score, exp.score2, exp.reference_end, exp.query_end, exp.strand))
+                self.assertEqual(al.reference_begin, -1)
+                self.assertEqual(al.cigar, "")
+
+    def test_traceback_score(self):
+        aligner = ssw.Aligner(reference=TestBatch.reference)
+        results = aligner.score_many(TestBatch.queries, traceback_score=30)
+        for (query, al) in zip(TestBatch.queries, results):
+            exp = aligner.align(query)
+            self.assertEqual(al.score, exp.score)
+            if al.score >= 30:
+                self.assertEqual((al.reference_begin, al.cigar, al.strand), (exp.reference_begin, exp.cigar, exp.strand))
+            else:
+                self.assertEqual(al.query_begin, -1)
+        self.assertEqual(aligner.score_many([]), [])
+        self.assertRaises(ValueError, ssw.Aligner().score_many, TestBatch.queries)
+
+    def test_columnar(self):
+        try:
+            import numpy
+        except ImportError:
+            raise unittest.SkipTest("numpy is not installed")
+        aligner = ssw.Aligner()
+        pairs = self.pairs()
+        expected = aligner.score_many(pairs, traceback_score=40)
+        table = aligner.score_many(pairs, traceback_score=40, columnar=True)
+        self.assertEqual(len(table), len(expected))
+        for (idx, exp) in enumerate(expected):
+            row = table[idx]
+            self.assertEqual((row["score"], row["reference_end"], row["query_end"], row["reference_begin"]), (exp.score, exp.reference_end, exp.query_end, exp.reference_begin))
+            self.assertEqual(row["strand"], exp.strand.encode("ascii"))
+            self.assertEqual(table.cigar(idx), exp.cigar)
+
+class TestPrefilter(unittest.TestCase):
+    min_score = 170
+
+    @classmethod
+    def setUpClass(cls):
+        rnd = random.Random(23)
+        cls.reference = str.join("", map(rnd.choice, ["ACGT"] * 3000))
+        cls.hits = [cls.reference[idx:idx + 100] for idx in range(0, 2000, 400)]
+        cls.unrelated = [str.join("", map(rnd.choice, ["ACGT"] * 100)) for idx in range(30)]
+
+    def test_bound(self):
+        self.assertEqual(prefilter._min_shared(100, 200, 8, 2, 2, 3), 93)
+        self.assertEqual(prefilter._min_shared(100, 150, 8, 2, 2, 3), 0)
+        self.assertIsNone(prefilter._min_shared(100, 201, 8, 2, 2, 3))
+
+    def test_align(self):
+        kmers = prefilter.KmerPrefilter(self.min_score)
+        aligner = ssw.Aligner(reference=self.reference, prefilter=kmers)
+        plain = ssw.Aligner(reference=self.reference)
+        for query in self.hits + self.unrelated:
+            expected = plain.align(query)
+            alignment = aligner.align(query)
+            if alignment.score:
+                self.assertEqual((alignment.score, alignment.cigar), (expected.score, expected.cigar))
+            else:
+                self.assertLess(expected.score, self.min_score)
+                self.assertEqual((alignment.reference_end, alignment.query_begin), (-1, -1))
+        self.assertEqual(kmers.stats(), {"checked": 35, "pruned": 30})
+        kmers.reset()
+        self.assertEqual(kmers.stats(), {"checked": 0, "pruned": 0})
+
+    def test_iupac(self):
+        # the reference spells the hit with ambiguity codes
+        aligner = ssw.Aligner(prefilter=prefilter.KmerPrefilter(self.min_score))
+        query = self.hits[0]
+        for reference in (query[:40] + "N" + query[41:60] + "R" + query[61:], query.replace("A", "R")):
+            self.assertTrue(aligner.prefilter.passes(aligner, aligner.encode(query), aligner.encode(reference)))
+            self.assertGreaterEqual(aligner.align(query, reference).score, self.min_score - 4)
+
+    def test_batch(self):
+        kmers = prefilter.KmerPrefilter(self.min_score)
+        aligner = ssw.Aligner(reference=self.reference, prefilter=kmers)
+        queries = self.unrelated + self.hits
+        scores = [al.score for al in aligner.align_many(queries, workers=2)]
+        self.assertEqual(scores[:30], [0] * 30)
+        self.assertEqual(scores[30:], [200] * 5)
+        self.assertEqual([al.score for al in aligner.score_many(queries)], scores)
+        self.assertEqual(kmers.stats(), {"checked": 70, "pruned": 60})
+
+    def test_shared(self):
+        # a reference is read through on first sight and indexed by content
+        # when it comes back, and both count the same
+        kmers = prefilter.KmerPrefilter(self.min_score)
+        aligner = ssw.Aligner()
+        queries = self.hits + self.unrelated[:5]
+        expected = [sum(1 for idx in range(len(query) - 7) if query[idx:idx + 8] in self.reference) for query in queries]
+        self.assertEqual([kmers.shared(aligner, aligner.encode(query), aligner.encode(self.reference)) for query in queries], expected)
+        self.assertEqual(len(kmers._references), 1)
+        self.assertEqual([kmers.shared(aligner, aligner.encode(query), aligner.encode(self.reference)) for query in queries], expected)
+        self.assertEqual(len(kmers._references), 1)
+
+class TestCache(unittest.TestCase):
+    reference = TestBatch.reference
+    queries = TestBatch.queries
+
+    def test_cached_align(self):
+        aligner = ssw.Aligner(reference=self.reference, cache=True)
+        plain = ssw.Aligner(reference=self.reference)
+        for query in self.queries:
+            (al, exp) = (aligner.align(query), plain.align(query))
+            self.assertEqual((al.score, al.cigar, al.strand, al.reference_begin), (exp.score, exp.cigar, exp.strand, exp.reference_begin))
+        self.assertEqual(aligner.cache.misses, 4)
+        self.assertEqual(aligner.cache.hits, len(self.queries) - 4)
+        self.assertIs(aligner.align(self.queries[0]), aligner.align(self.queries[0]))
+        # every option is part of the key
+        self.assertEqual(aligner.align(self.queries[1], strand="+").score, plain.align(self.queries[1], strand="+").score)
+        self.assertEqual(aligner.align(self.queries[0], score_only=True).cigar, "")
+        self.assertEqual(aligner.align(self.queries[0], reference=self.reference[10:]).reference_begin, plain.align(self.queries[0], reference=self.reference[10:]).reference_begin)
+        aligner.gap_open = 5
+        before = aligner.cache.misses
+        aligner.align(self.queries[0])
+        self.assertEqual(aligner.cache.misses, before + 1)
+
+    def test_eviction(self):
+        aligner = ssw.Aligner(reference=self.reference, cache=cache.AlignmentCache(max_entries=2))
+        for query in self.queries[:3]:
+            aligner.align(query)
+        self.assertEqual((len(aligner.cache), aligner.cache.evictions), (2, 1))
+        aligner.align(self.queries[1])
+        self.assertEqual(aligner.cache.hits, 1)
+        aligner.align(self.queries[0])
+        self.assertEqual(aligner.cache.misses, 4)
+        lru = cache.AlignmentCache(max_entries=None, max_bytes=3 * cache.ENTRY_OVERHEAD)
+        aligner = ssw.Aligner(reference=self.reference, cache=lru)
+        for query in self.queries:
+            aligner.align(query)
+        self.assertLessEqual(lru.nbytes, lru.max_bytes)
+        self.assertEqual(len(lru), 2)
+        aligner = pickle.loads(pickle.dumps(ssw.Aligner(cache=lru)))
+        self.assertEqual((len(aligner.cache), aligner.cache.max_bytes), (0, lru.max_bytes))
+
+    def test_batch_dedupe(self):
+        aligner = ssw.Aligner(cache=True)
+        results = aligner.align_many(self.queries, reference=self.reference, workers=2)
+        self.assertEqual(aligner.cache.misses, 4)
+        self.assertIs(results[0], results[4])
+        for (query, al) in zip(self.queries, results):
+            self.assertEqual(al.cigar, ssw.Aligner().align(query, self.reference).cigar)
+        scores = aligner.score_many(self.queries, reference=self.reference)
+        self.assertEqual([al.score for al in scores], [al.score for al in results])
+        try:
+            import numpy
+        except ImportError:
+            return
+        table = aligner.align_many(self.queries, reference=self.reference, columnar=True)
+        self.assertEqual([table.cigar(idx) for idx in range(len(table))], [al.cigar for al in results])
+        table = aligner.score_many(self.queries, reference=self.reference, columnar=True)
+        self.assertEqual(list(table["score"]), [al.score for al in results])
+
+    def test_miss_encodes_once(self):
+        aligner = ssw.Aligner(cache=True, instrument=instrument.Instrumentation(native=False))
+        for extension in (libssw.extension, None):
+            (saved, libssw.extension) = (libssw.extension, extension)
+            try:
+                aligner.cache.clear()
+                aligner.instrument.reset()
+                aligner.align(self.queries[0], self.reference)
+            finally:
+                libssw.extension = saved
+            self.assertEqual(aligner.stats()["stages"]["encode"]["calls"], 2)
+
+class TestAsync(unittest.TestCase):
+    reference = TestBatch.reference
+    queries = TestBatch.queries
+
+    def setUp(self):
+        if asyncio is None:
+            raise unittest.SkipTest("asyncio front end needs Python 3.6")
+        try:
+            from ssw import aio
+        except (ImportError, SyntaxError):
+            raise unittest.SkipTest("asyncio front end needs Python 3.6")
+        self.aio = aio
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.addCleanup(self.loop.close)
+        self.addCleanup(asyncio.set_event_loop, None)
+
+    def collect(self, results):
+        # drains an async iterator
+        collected = []
+        while True:
+            try:
+                collected.append(self.loop.run_until_complete(results.__anext__()))
+            except StopAsyncIteration:
+                return collected
+
+    def test_align(self):
+        plain = ssw.Aligner()
+        aligner = self.aio.AsyncAligner(workers=2, batch_size=8)
+        futures = [aligner.align(query, self.reference, min_score=10) for query in self.queries]
+        results = self.loop.run_until_complete(asyncio.gather(*futures))
+        for (query, al) in zip(self.queries, results):
+            expected = plain.align(query, self.reference, min_score=10)
+            self.assertEqual((al.score, al.cigar, al.reference_begin), (expected.score, expected.cigar, expected.reference_begin))
+        # 20 concurrent requests against one reference, in batches of 8
+        self.assertEqual(aligner.stats(), {"pending": 0, "batches": 3, "aligned": 20})
+        self.loop.run_until_complete(aligner.close())
+
+    def test_align_many(self):
+        plain = ssw.Aligner()
+        expected = [al.score for al in plain.align_many(self.queries, self.reference)]
+        aligner = self.aio.AsyncAligner(workers=2, max_pending=3, batch_size=2)
+        self.assertEqual([al.score for al in self.collect(aligner.align_many(self.queries, self.reference))], expected)
+        unordered = self.collect(aligner.align_many([(query, self.reference) for query in self.queries], ordered=False))
+        self.assertEqual([al.score for (idx, al) in sorted(unordered, key=lambda item: item[0])], expected)
+        self.loop.run_until_complete(aligner.close())
+
+    def test_errors(self):
+        aligner = self.aio.AsyncAligner(workers=1)
+        futures = [aligner.align("AGCT", self.reference), aligner.align("AGCZ", self.reference)]
+        (good, bad) = self.loop.run_until_complete(asyncio.gather(*futures, return_exceptions=True))
+        self.assertEqual(good.score, 8)
+        self.assertIsInstance(bad, ValueError)
+        self.loop.run_until_complete(aligner.close())
+
+class TestSIMD(unittest.TestCase):
+    def setUp(self):
+        self.default = libssw.get_simd()
+
+    def tearDown(self):
+        libssw.set_simd(self.default)
+
+    def alignments(self, level):
+        libssw.set_simd(level)
+        rnd = random.Random(7)
+        aligner = ssw.Aligner(gap_open=3, gap_extend=1)
+        results = []
+        for length in (1, 15, 16, 17, 33, 64, 100, 300, 1200):
+            reference = str.join("", (rnd.choice("ACGTN") for idx in range(length + 200)))
+            start = rnd.randint(0, 200)
+            query = str.join("", (base if rnd.random() > 0.08 else rnd.choice("ACGT") for base in reference[start:start + length]))
+            for al in (aligner.align(query, reference), aligner.align(query[::-1], reference, revcomp=False)):
+                results.append((al.score, al.score2, al.reference_begin, al.reference_end, al.query_begin, al.query_end, al.cigar))
+        return results
+
+    def test_levels_match_sse2(self):
+        expected = self.alignments("sse2")
+        for level in libssw.simd_levels():
+            self.assertEqual(self.alignments(level), expected, level)
+
+    def test_set_simd(self):
+        self.assertIn("sse2", libssw.simd_levels())
+        self.assertEqual(libssw.set_simd("sse2"), "sse2")
+        self.assertEqual(libssw.get_simd(), "sse2")
+        self.assertRaises(ValueError, libssw.set_simd, "mmx")
+        self.assertIn(libssw.set_simd(), libssw.simd_levels())
+
+    def test_simd_environment(self):
+        # SSW_SIMD caps the level, a level the CPU lacks falls back to the
+        # widest below it, and an unknown name is reported and ignored
+        supported = libssw.simd_levels()
+        names = [libssw.ssw_simd_name(level).decode("ascii") for level in range(libssw.SIMD_AVX512 + 1) if libssw.ssw_simd_name(level) is not None]
+        for (idx, name) in enumerate(names):
+            expected = [level for level in supported if names.index(level) <= idx][-1]
+            self.assertEqual(self.simd_in_child(name), (expected, b""))
+        (level, err) = self.simd_in_child("mmx")
+        self.assertEqual(level, supported[-1])
+        self.assertIn(b"SSW_SIMD=mmx", err)
+
+    def simd_in_child(self, name):
+        # (level, stderr) of a fresh interpreter with SSW_SIMD set to name
+        script = "from ssw import libssw; print(libssw.get_simd())"
+        child = subprocess.Popen([sys.executable, "-c", script], stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=dict(os.environ, SSW_SIMD=name))
+        (out, err) = child.communicate()
+        self.assertEqual(child.returncode, 0, err)
+        return (out.decode("ascii").strip(), err)
+
+class TestIndex(unittest.TestCase):
+    def setUp(self):
+        rnd = random.Random(5)
+        self.reference = str.join("", (rnd.choice("ACGT") for idx in range(20000)))
+        self.reads = []
+        for idx in range(12):
+            start = rnd.randint(0, len(self.reference) - 200)
+            read = list(self.reference[start:start + rnd.randint(40, 150)])
+            for edit in range(len(read) // 20):
+                pos = rnd.randrange(len(read))
+                if edit % 3 == 0:
+                    del read[pos]
+                else:
+                    read[pos] = rnd.choice("ACGT")
+            read = str.join("", read)
+            self.reads.append(iupac.nucleotide_reverse_complement(read) if idx % 2 else read)
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def assertSameAlignments(self, aligner):
+        exhaustive = ssw.Aligner(reference=self.reference)
+        for read in self.reads:
+            (al, exp) = (aligner.align(read), exhaustive.align(read))
+            self.assertEqual((al.score, al.strand, al.reference_begin, al.reference_end, al.cigar, al.md), (exp.score, exp.strand, exp.reference_begin, exp.reference_end, exp.cigar, exp.md))
+
+    def test_seeded_alignment(self):
+        aligner = ssw.Aligner(reference=self.reference)
+        aligner.build_index(k=12)
+        self.assertSameAlignments(aligner)
+        al = aligner.align("ACGT" * 5)
+        self.assertEqual((al.score, al.reference_begin, al.cigar), (0, -1, ""))
+        # other references are aligned as before
+        self.assertEqual(aligner.align("ACGTACGT", reference="TTACGTACGTTT").score, 16)
+        aligner.reference = self.reference[:100]
+        self.assertIsNone(aligner.index)
+
+    def test_save_load(self):
+        path = os.path.join(self.tmpdir, "ref.idx")
+        ssw.Aligner(reference=self.reference).build_index().save(path)
+        aligner = ssw.Aligner(reference=self.reference)
+        aligner.load_index(path)
+        self.assertEqual(aligner.index.k, index.DEFAULT_KMER)
+        self.assertSameAlignments(aligner)
+        self.assertRaises(ValueError, ssw.Aligner(reference=self.reference[1:]).load_index, path)
+
+class TestReferenceStore(unittest.TestCase):
+    contigs = [("chr1", "ACGTNACGTTTGCA" * 20), ("chr2 \u00e9", "GATTACA"), ("empty", "")]
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, "ref.sswref")
+        self.assertEqual(refstore.write_reference_store(self.path, self.contigs), 3)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_contigs(self):
+        aligner = ssw.Aligner()
+        store = aligner.open_reference_store(self.path)
+        self.assertEqual(list(store), [name for (name, sequence) in self.contigs])
+        for (name, sequence) in self.contigs:
+            self.assertEqual(store[name].text, sequence)
+            self.assertEqual(store.length(name), len(sequence))
+        self.assertEqual(store.fetch("chr1", 3, 9).text, self.contigs[0][1][3:9])
+        self.assertRaises(KeyError, store.fetch, "chr3")
+        for query in ("TTTGCAACG", "TGTAATC"):
+            for (name, sequence) in self.contigs:
+                (al, exp) = (aligner.align(query, store[name]), aligner.align(query, sequence))
+                self.assertEqual((al.score, al.reference_begin, al.cigar, al.md), (exp.score, exp.reference_begin, exp.cigar, exp.md))
+
+    def test_pickle(self):
+        store = refstore.ReferenceStore(self.path)
+        contig = pickle.loads(pickle.dumps(store.fetch("chr1", 10, 100)))
+        self.assertIsInstance(contig, refstore.StoredSequence)
+        self.assertEqual(contig.text, self.contigs[0][1][10:100])
+        self.assertLess(len(pickle.dumps(store["chr1"])), len(self.contigs[0][1]))
+
+    def test_alphabet_mismatch(self):
+        self.assertRaises(ValueError, refstore.ReferenceStore, self.path, ssw.ScoreMatrix(alphabet="ACGT"))
+        self.assertRaises(ValueError, refstore.ReferenceStore, os.path.join(os.path.dirname(__file__), "test_ssw.py"))
+
+class TestPanel(unittest.TestCase):
+    def setUp(self):
+        rnd = random.Random(9)
+        self.references = [("ref%d" % idx, str.join("", (rnd.choice("ACGT") for pos in range(rnd.randint(30, 120))))) for idx in range(50)]
+        # two references that only differ outside of the query
+        self.references.append(("twin1", "AAAA" + self.references[7][1][5:25] + "CCCC"))
+        self.references.append(("twin2", "GGGG" + self.references[7][1][5:25] + "TTTT"))
+        self.panel = panel.ReferencePanel(self.references)
+
+    def test_search(self):
+        aligner = ssw.Aligner()
+        query = self.references[3][1][4:28]
+        for query in (query, iupac.nucleotide_reverse_complement(query)):
+            hits = self.panel.search(query, k=4)
+            self.assertEqual(len(hits), 4)
+            self.assertEqual(hits[0].name, "ref3")
+            self.assertFalse(hits[0].ambiguous)
+            expected = sorted(((aligner.align(query, seq).score, -idx) for (idx, (name, seq)) in enumerate(self.references)), reverse=True)[:4]
+            self.assertEqual([(hit.alignment.score, -hit.index) for hit in hits], expected)
+            exp = aligner.align(query, self.references[3][1])
+            self.assertEqual((hits[0].alignment.cigar, hits[0].alignment.strand), (exp.cigar, exp.strand))
+            self.assertEqual(hits[0].score2, max(hits[0].alignment.score2, hits[1].alignment.score))
+        self.assertEqual(len(self.panel.search(query, min_score=hits[1].alignment.score + 1)), 1)
+        self.assertEqual(self.panel.search(query, strand="+")[0].alignment.strand, "+")
+
+    def test_ambiguous(self):
+        hits = self.panel.search(self.references[7][1][5:25], k=3)
+        self.assertEqual([hit.name for hit in hits], ["ref7", "twin1", "twin2"])
+        self.assertTrue(all(hit.ambiguous for hit in hits))
+        self.assertEqual(hits[0].score2, hits[0].alignment.score)
+
+    def test_references(self):
+        self.assertEqual(len(self.panel), len(self.references))
+        self.assertEqual(self.panel["ref5"].text, self.references[5][1])
+        self.assertEqual(self.panel[6].text, self.references[6][1])
+        self.assertIn("twin1", self.panel)
+
+class TestBenchmark(unittest.TestCase):
+    def setUp(self):
+        import sys
+        path = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "benchmarks")
+        if not os.path.isdir(path):
+            raise unittest.SkipTest("the benchmarks are not in this tree")
+        sys.path.insert(0, path)
+        self.addCleanup(sys.path.remove, path)
+        import bench_ssw
+        self.bench = bench_ssw
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+
+    def test_synthetic(self):
+        (reference, reads) = self.bench.make_case(1, 50, 200, 0.1, 0.05, 0.01, 4)
+        self.assertEqual(len(reference), 200)
+        self.assertEqual(len(reads), 4)
+        self.assertEqual(self.bench.make_case(1, 50, 200, 0.1, 0.05, 0.01, 4), (reference, reads))
+        self.assertTrue(set(reference) - set("ACGT"))
+
+    def test_smoke(self):
+        # a tiny sweep, compared against itself
+        output = os.path.join(self.tmpdir, "bench.json")
+        args = ["--quick", "--query-lengths", "50", "--reference-lengths", "100", "--pairs", "2", "-o", output]
+        self.bench.main(args)
+        with open(output) as fh:
+            results = json.load(fh)
+        self.assertEqual(len(results["cases"]), 2)
+        case = results["cases"][0]
+        self.assertEqual(list(case["stages"]), ["encode", "profile", "align", "alignment", "cigar", "report"])
+        self.assertGreater(case["pairs_per_second"], 0)
+        self.assertGreater(case["mean_score"], 0)
+        results = self.bench.main(args + ["--baseline", output])
+        self.assertIn("speedup", results["cases"][0])
+
+class TestLibrary(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.environ = os.environ.pop(libssw.LIBRARY_ENV, None)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+        os.environ.pop(libssw.LIBRARY_ENV, None)
+        if self.environ is not None:
+            os.environ[libssw.LIBRARY_ENV] = self.environ
+
+    def site_packages(self, packages):
+        # a site-packages directory with ssw, the library and other packages
+        site = os.path.join(self.tmpdir, "site%d" % packages)
+        package_dir = os.path.dirname(os.path.abspath(ssw.__file__))
+        shutil.copytree(package_dir, os.path.join(site, "ssw"), ignore=shutil.ignore_patterns("__pycache__", "ssw"))
+        library = libssw.find_ssw_library()
+        shutil.copy(library, os.path.join(site, os.path.basename(library)))
+        for idx in range(packages):
+            os.makedirs(os.path.join(site, "package%d" % idx, "sub"))
+            with open(os.path.join(site, "package%d" % idx, "sub", "_libssw_decoy.so"), "w") as fh:
+                fh.write("")
+        return os.path.join(site, "ssw")
+
+    def lookup_time(self, package_dir):
+        start = time.time()
+        for idx in range(200):
+            self.assertTrue(libssw.find_ssw_library(package_dir).startswith(os.path.dirname(package_dir)))
+        return time.time() - start
+
+    def import_time(self, package_dir):
+        # the fastest of a few fresh interpreters importing ssw from the
+        # site-packages, which also fail if a directory is listed
+        script = str.join("; ", [
+            "import os, time",
+            "start = time.time()",
+            "os.walk = os.listdir = os.scandir = None",
+            "import ssw",
+            "assert ssw.__file__.startswith(%r)" % os.path.dirname(package_dir),
+            "print(time.time() - start)",
+        ])
+        env = dict(os.environ, PYTHONPATH=os.path.dirname(package_dir), PYTHONDONTWRITEBYTECODE="1")
+        times = []
+        for run in range(3):
+            output = subprocess.check_output([sys.executable, "-c", script], cwd=self.tmpdir, env=env)
+            times.append(float(output))
+        return min(times)
+
+    def test_import_does_not_grow_with_site_packages(self):
+        (small, large) = (self.site_packages(0), self.site_packages(5000))
+        self.assertLess(self.import_time(large), self.import_time(small) * 1.5 + 0.03)
+
+    def test_lookup_does_not_grow_with_site_packages(self):
+        (small, large) = (self.site_packages(0), self.site_packages(2000))
+        self.assertLess(self.lookup_time(large), self.lookup_time(small) * 5 + 0.05)
+        # no directory is ever listed
+        saved = (os.walk, os.listdir)
+        def listing(*args):
+            raise AssertionError("directory listed")
+        (os.walk, os.listdir) = (listing, listing)
+        try:
+            libssw.find_ssw_library(large)
+        finally:
+            (os.walk, os.listdir) = saved
+
+    def test_environment_override(self):
+        library = libssw.find_ssw_library()
+        empty = os.path.join(self.tmpdir, "empty", "ssw")
+        os.makedirs(empty)
+        self.assertRaises(ImportError, libssw.find_ssw_library, empty)
+        os.environ[libssw.LIBRARY_ENV] = library
+        self.assertEqual(libssw.find_ssw_library(empty), library)
+        os.environ[libssw.LIBRARY_ENV] = os.path.join(self.tmpdir, "missing.so")
+        self.assertRaises(ImportError, libssw.find_ssw_library)
+
+class TestPipeline(unittest.TestCase):
+    reference = "CCC" + "AGCT" * 10 + "GTGCGATGTGCGATGAGATC"
+    reads = [
+        ("fwd", "GTGCGATGTGCGATGAGATC", "ABCDEFGHIJKLMNOPQRST"),
+        ("rev", "GATCTCATCGCACATCGCAC", "ABCDEFGHIJKLMNOPQRST"),
+        ("none", "TTTTTTTTTT", "IIIIIIIIII"),
+    ]
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.reference_fn = os.path.join(self.tmpdir, "ref.fa")
+        with open(self.reference_fn, "w") as fh:
+            fh.write(">chr1 test\n%s\n%s\n" % (self.reference[:20], self.reference[20:]))
+        self.reads_fn = os.path.join(self.tmpdir, "reads.fq.gz")
+        with gzip.open(self.reads_fn, "wt") as fh:
+            for (name, seq, qual) in self.reads:
+                fh.write("@%s\n%s\n+\n%s\n" % (name, seq, qual))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_read_fastx(self):
+        (record,) = list(fastx.read_fastx(self.reference_fn))
+        self.assertEqual(record, ("chr1", self.reference, None))
+        self.assertEqual(list(fastx.read_fastx(self.reads_fn)), self.reads)
+
+    def test_read_fastx_stdin(self):
+        # plain or gzipped, and standard input stays open
+        stdin = sys.stdin
+        try:
+            for path in (self.reference_fn, self.reads_fn):
+                with open(path, "rb") as fh:
+                    sys.stdin = io.TextIOWrapper(io.BytesIO(fh.read()))
+                self.assertEqual(list(fastx.read_fastx("-")), list(fastx.read_fastx(path)))
+                self.assertFalse(sys.stdin.closed)
+        finally:
+            sys.stdin = stdin
+
+    def check_sam(self, sam):
+        lines = sam.splitlines()
+        self.assertEqual(lines[0], "@HD\tVN:1.6\tSO:unsorted")
+        self.assertEqual(lines[1], "@SQ\tSN:chr1\tLN:%d" % len(self.reference))
+        records = [line.split("\t") for line in lines if not line.startswith("@")]
+        self.assertEqual([rec[0] for rec in records], ["fwd", "rev", "none"])
+        (fwd, rev, none) = records
+        self.assertEqual(fwd[1:6], ["0", "chr1", "44", "255", "20M"])
+        self.assertEqual(fwd[9:12], [self.reads[0][1], self.reads[0][2], "AS:i:40"])
+        self.assertEqual(fwd[13:], ["NM:i:0", "MD:Z:20"])
+        self.assertEqual(rev[1:6], ["16", "chr1", "44", "255", "20M"])
+        self.assertEqual(rev[9:11], [self.reads[0][1], self.reads[1][2][::-1]])
+        self.assertEqual(none[1:6], ["4", "*", "0", "0", "*"])
+
+    def test_pipeline(self):
+        for workers in (1, 2):
+            output = io.StringIO()
+            pipeline.align_reads(self.reference_fn, self.reads_fn, output, workers=workers, chunk_size=1, max_pending=1, min_score=20)
+            self.check_sam(output.getvalue())
+
+    def test_main(self):
+        from ssw.__main__ import main
+        output_fn = os.path.join(self.tmpdir, "out.sam")
+        main(["align", self.reference_fn, self.reads_fn, "-o", output_fn, "-j", "1", "--min-score", "20"])
+        with open(output_fn) as fh:
+            self.check_sam(fh.read())
+
+    def test_encoded_reference(self):
+        from ssw.__main__ import main
+        store_fn = os.path.join(self.tmpdir, "ref.sswref")
+        main(["encode", self.reference_fn, "-o", store_fn])
+        self.assertTrue(refstore.is_reference_store(store_fn))
+        self.assertFalse(refstore.is_reference_store(self.reference_fn))
+        output_fn = os.path.join(self.tmpdir, "out.sam")
+        main(["align", store_fn, self.reads_fn, "-o", output_fn, "-j", "2", "--min-score", "20"])
+        with open(output_fn) as fh:
+            self.check_sam(fh.read())
+
 if __name__ == '__main__':
     unittest.main()